@@ -24,18 +24,86 @@ IMAP_USE_SSL = os.getenv("IMAP_USE_SSL", "true").lower() == "true"
 IMAP_SYNC_ENABLED = os.getenv("IMAP_SYNC_ENABLED", "false").lower() == "true"
 IMAP_SYNC_TO_USER = os.getenv("IMAP_SYNC_TO_USER", "shao")  # 同步到哪个本地用户
 IMAP_SYNC_INTERVAL_MINUTES = int(os.getenv("IMAP_SYNC_INTERVAL_MINUTES", "5"))  # 同步间隔（分钟）
+IMAP_SYNC_BATCH_SIZE = int(os.getenv("IMAP_SYNC_BATCH_SIZE", "200"))  # 每次 UID FETCH 拉取的邮件数
+IMAP_SYNC_WORKERS = int(os.getenv("IMAP_SYNC_WORKERS", "4"))  # 同时同步的账号数
+IMAP_SYNC_MAX_PER_HOST = int(os.getenv("IMAP_SYNC_MAX_PER_HOST", "2"))  # 同一服务器同时同步的账号数
+IMAP_SYNC_JITTER = float(os.getenv("IMAP_SYNC_JITTER", "0.2"))  # 同步间隔随机抖动比例，避免账号集中同步
+IMAP_IDLE_ENABLED = os.getenv("IMAP_IDLE_ENABLED", "true").lower() == "true"  # 服务器支持时使用 IDLE 长连接
+IMAP_IDLE_MAX_CONNECTIONS = int(os.getenv("IMAP_IDLE_MAX_CONNECTIONS", "16"))  # IDLE 长连接总数上限，超出的账号轮询
+IMAP_IDLE_TIMEOUT_SECONDS = int(os.getenv("IMAP_IDLE_TIMEOUT_SECONDS", "1500"))  # 单次 IDLE 时长（RFC 2177 建议小于 29 分钟）
+# 用户绑定外部 IMAP 邮箱的服务器限制：白名单为空时允许任意解析到公网地址的服务器（拒绝内网、回环等地址）
+IMAP_ALLOWED_HOSTS = [h.strip().lower() for h in os.getenv("IMAP_ALLOWED_HOSTS", "").split(",") if h.strip()]
+IMAP_ALLOWED_PORTS = [int(p) for p in os.getenv("IMAP_ALLOWED_PORTS", "143,993").split(",") if p.strip()]
+
+# 群发配置
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "500"))  # 每批读取/投递的用户数
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "4"))  # 并行投递的线程数
 
 # 数据库配置
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./data/app.db")
+# 异步驱动连接串（留空则由 DATABASE_URL 推导，如 sqlite -> sqlite+aiosqlite）
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", "")
 
 # 邮件域名
 MAIL_DOMAIN = os.getenv("MAIL_DOMAIN", "mail.com")
 
+# 附件上传
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(10 * 1024 * 1024)))  # 单个附件大小上限（默认 10MB）
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))  # 续传会话建议分块大小
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))  # 未完成的上传会话保留时长
+
+# 附件后处理（压缩存储、缩略图）
+ATTACHMENT_PIPELINE_WORKERS = int(os.getenv("ATTACHMENT_PIPELINE_WORKERS", "2"))  # 后处理线程数
+ATTACHMENT_COMPRESS_MIN_BYTES = int(os.getenv("ATTACHMENT_COMPRESS_MIN_BYTES", "1024"))  # 小于该大小的附件不压缩
+ATTACHMENT_THUMBNAIL_SIZE = int(os.getenv("ATTACHMENT_THUMBNAIL_SIZE", "320"))  # 缩略图最长边像素
+
+# 邮件文件存储后端：file 为 .txt 文件（默认）；maildir 为标准 Maildir（tmp/new/cur，标记写在文件名中）
+MAIL_STORAGE_BACKEND = os.getenv("MAIL_STORAGE_BACKEND", "file")
+# file 后端的目录布局：flat 平铺（默认，兼容旧数据）；date 按年/月分目录；hash 按文件名哈希前缀分桶
+# 修改后端或布局后新邮件写入新位置，旧文件可通过管理接口在线迁移，迁移期间读取自动兼容新旧位置
+MAIL_STORAGE_LAYOUT = os.getenv("MAIL_STORAGE_LAYOUT", "flat")
+
+# 邮件 ID 节点标识（多进程/多机部署时区分生成方，留空则每个进程随机生成）
+MAIL_NODE_ID = os.getenv("MAIL_NODE_ID", "")
+
+# 邮件文件写入持久性：none 仅原子替换不 fsync；batch 文件 fsync 后原子替换，
+# 目录 fsync 由并发写入合并批量执行（组提交）；fsync 每次写入都 fsync 文件与目录
+MAIL_DURABILITY = os.getenv("MAIL_DURABILITY", "batch")
+MAIL_FSYNC_BATCH_WINDOW_MS = int(os.getenv("MAIL_FSYNC_BATCH_WINDOW_MS", "0"))  # 组提交等待更多写入加入的时间窗口
+
+# 邮件头解析缓存（条目数）
+MAIL_HEADER_CACHE_SIZE = int(os.getenv("MAIL_HEADER_CACHE_SIZE", "4096"))
+
+# 邮件内容读缓存（HTTP 读信与 POP3 RETR 共用，按文件字节数计容量，0 表示关闭）
+MAIL_CACHE_MAX_BYTES = int(os.getenv("MAIL_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+MAIL_CACHE_MAX_ENTRY_BYTES = int(os.getenv("MAIL_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))  # 超过该大小的邮件不缓存
+
+# 全文检索：每封邮件正文最多索引的字符数
+SEARCH_INDEX_MAX_BODY_CHARS = int(os.getenv("SEARCH_INDEX_MAX_BODY_CHARS", "65536"))
+
+# 增量同步变更日志保留天数（更早的变更被压缩，落后太多的客户端须全量同步）
+MAIL_CHANGE_RETENTION_DAYS = int(os.getenv("MAIL_CHANGE_RETENTION_DAYS", "30"))
+
+# 新邮件推送（SSE /mail/events）
+MAIL_EVENTS_QUEUE_SIZE = int(os.getenv("MAIL_EVENTS_QUEUE_SIZE", "100"))  # 每个连接的待发送事件上限，满后丢弃并提示客户端 resync
+MAIL_EVENTS_MAX_PER_USER = int(os.getenv("MAIL_EVENTS_MAX_PER_USER", "8"))  # 单用户同时在线的推送连接数上限
+MAIL_EVENTS_HEARTBEAT_SECONDS = int(os.getenv("MAIL_EVENTS_HEARTBEAT_SECONDS", "15"))  # 无事件时的心跳间隔
+
+# 批量操作接口（/mail/batch/*）单次请求的邮件数上限
+MAIL_BATCH_MAX_ITEMS = int(os.getenv("MAIL_BATCH_MAX_ITEMS", "500"))
+
+# 软删除邮件的后台清理
+MAIL_PURGE_INTERVAL_MINUTES = int(os.getenv("MAIL_PURGE_INTERVAL_MINUTES", "30"))  # 清理任务间隔（分钟）
+MAIL_PURGE_AFTER_MINUTES = int(os.getenv("MAIL_PURGE_AFTER_MINUTES", "60"))  # 删除多久后物理清理文件（分钟）
+
 # JWT 配置
 TOKEN_SECRET = os.getenv("TOKEN_SECRET", "dev-secret-change")
 TOKEN_EXPIRE_MINUTES = int(os.getenv("TOKEN_EXPIRE_MINUTES", "60"))
 TOKEN_ALGORITHM = os.getenv("TOKEN_ALGORITHM", "HS256")
 
+# 外部邮箱密码等凭据的加密密钥（未设置时由 TOKEN_SECRET 派生；更换后已保存的凭据无法解密）
+CREDENTIAL_SECRET = os.getenv("CREDENTIAL_SECRET", "")
+
 # 管理员接口额外校验密钥（设置后启用）
 ADMIN_ACCESS_KEY = os.getenv("ADMIN_ACCESS_KEY", "")
 
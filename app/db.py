@@ -3,9 +3,9 @@
 """
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from app.models import Base
-from app.config import DATABASE_URL
-from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app.migrations import run_migrations
+from app.config import DATABASE_URL, ASYNC_DATABASE_URL
 
 # 创建数据库引擎
 engine = create_engine(
@@ -17,28 +17,26 @@ engine = create_engine(
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+def _to_async_url(url: str) -> str:
+    """将同步连接串转换为对应的异步驱动连接串"""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("mysql:") or url.startswith("mysql+pymysql:"):
+        return "mysql+aiomysql:" + url.split(":", 1)[1]
+    if url.startswith("postgresql:") or url.startswith("postgresql+psycopg2:"):
+        return "postgresql+asyncpg:" + url.split(":", 1)[1]
+    return url
+
+
+# 异步引擎与会话工厂（供 async 路由与 SMTP/POP3 协程使用，避免阻塞事件循环）
+async_engine = create_async_engine(ASYNC_DATABASE_URL or _to_async_url(DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+
 def init_db():
-    """初始化数据库表"""
-    Base.metadata.create_all(bind=engine)
-    print("数据库表初始化成功")
-    # 轻量列保障：为现有 users 表补充缺失列（SQLite）
-    try:
-        if "sqlite" in DATABASE_URL:
-            with engine.connect() as conn:
-                cols = conn.execute(text("PRAGMA table_info(users)"))
-                names = {row[1] for row in cols}
-                if "is_disabled" not in names:
-                    conn.execute(text("ALTER TABLE users ADD COLUMN is_disabled INTEGER DEFAULT 0"))
-                    print("已为 users 表添加列 is_disabled")
-                if "phone_number" not in names:
-                    conn.execute(text("ALTER TABLE users ADD COLUMN phone_number TEXT"))
-                    print("已为 users 表添加列 phone_number")
-                if "email" not in names:
-                    conn.execute(text("ALTER TABLE users ADD COLUMN email TEXT"))
-                    print("已为 users 表添加列 email")
-    except Exception as e:
-        # 非致命：打印提示继续运行
-        print(f"数据库列检查/升级时出现问题: {e}")
+    """初始化数据库表（按版本执行迁移，结构已是最新时跳过）"""
+    version = run_migrations(engine)
+    print(f"数据库表初始化成功（结构版本 v{version}）")
 
 
 def get_db():
@@ -48,3 +46,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """获取异步数据库会话"""
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -10,21 +10,47 @@ except Exception:
 import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.db import init_db
+from app.db import init_db, async_engine
 from app.services.smtp_server import SMTPServer
 from app.services.pop3_server import POP3Server
+from app.services.mail_storage import MailStorageService
+from app.services.change_journal import ChangeJournal
+from app.services.imap_sync_service import ImapSyncService
+from app.services.attachment_pipeline import AttachmentPipeline
+from app.services.log_service import LogService
+from app.config import MAIL_PURGE_INTERVAL_MINUTES, MAIL_PURGE_AFTER_MINUTES, MAIL_CHANGE_RETENTION_DAYS
 from app.routers import health, auth, admin, mail, appeal
 
 
 # 全局任务存储
 smtp_task = None
 pop3_task = None
+purge_task = None
+imap_sync_task = None
+
+
+async def purge_deleted_mails_loop():
+    """定期物理清理已软删除的邮件文件，并压缩过期的变更日志"""
+    while True:
+        await asyncio.sleep(MAIL_PURGE_INTERVAL_MINUTES * 60)
+        try:
+            count = await asyncio.to_thread(MailStorageService.purge_deleted_mails, MAIL_PURGE_AFTER_MINUTES)
+            if count:
+                LogService.log_system(f"已清理 {count} 封已删除邮件")
+        except Exception as e:
+            LogService.log_system(f"清理已删除邮件失败: {e}")
+        try:
+            count = await asyncio.to_thread(ChangeJournal.compact, MAIL_CHANGE_RETENTION_DAYS)
+            if count:
+                LogService.log_system(f"已压缩 {count} 条邮件变更日志")
+        except Exception as e:
+            LogService.log_system(f"压缩邮件变更日志失败: {e}")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
-    global smtp_task, pop3_task
+    global smtp_task, pop3_task, purge_task, imap_sync_task
     
     # 启动时的操作
     print("=" * 50)
@@ -33,6 +59,9 @@ async def lifespan(app: FastAPI):
     
     # 初始化数据库
     init_db()
+
+    if not AttachmentPipeline.previews_enabled():
+        LogService.log_system("未安装 Pillow，图片附件不生成缩略图，预览接口将返回 404（pip install -r requirements.txt）")
     
     # 启动 SMTP 和 POP3 服务
     smtp_server = SMTPServer()
@@ -40,6 +69,9 @@ async def lifespan(app: FastAPI):
     
     smtp_task = asyncio.create_task(smtp_server.start())
     pop3_task = asyncio.create_task(pop3_server.start())
+    purge_task = asyncio.create_task(purge_deleted_mails_loop())
+    # 外部 IMAP 账号同步调度（.env 中的账号在 IMAP_SYNC_ENABLED 时登记为账号之一）
+    imap_sync_task = asyncio.create_task(ImapSyncService.run())
     
     print("=" * 50)
     print("邮件系统启动完成！")
@@ -51,6 +83,8 @@ async def lifespan(app: FastAPI):
     print("\n关闭邮件系统...")
     smtp_task.cancel()
     pop3_task.cancel()
+    purge_task.cancel()
+    imap_sync_task.cancel()
     try:
         await smtp_task
     except asyncio.CancelledError:
@@ -59,6 +93,15 @@ async def lifespan(app: FastAPI):
         await pop3_task
     except asyncio.CancelledError:
         pass
+    try:
+        await purge_task
+    except asyncio.CancelledError:
+        pass
+    try:
+        await imap_sync_task
+    except asyncio.CancelledError:
+        pass
+    await async_engine.dispose()
     print("邮件系统已关闭")
 
 
@@ -0,0 +1,385 @@
+"""
+数据库结构迁移 - 版本化、幂等的迁移步骤
+
+schema_version 表记录已执行的版本。启动时只查询一次当前版本，
+已是最新则直接跳过，不再做任何表结构探测。
+
+迁移步骤不调用服务层（存储布局、后端选择、检索分词等之后还会变化），
+需要读取邮箱文件时使用本文件中固定的路径与解析逻辑，保证已发布步骤的行为不变。
+"""
+import hashlib
+import json
+import re
+from datetime import datetime
+from pathlib import Path
+from sqlalchemy import column, inspect, table, text
+from sqlalchemy.engine import Connection, Engine
+from app.models import (
+    Base, Mail, MailboxStat, MailChange, MailChangeFloor, ImapAccount, ImapSyncState, SchemaVersion
+)
+
+
+def _add_column_if_missing(conn: Connection, table: str, column: str, ddl: str):
+    """为表补充缺失列（已存在则跳过）"""
+    names = {col["name"] for col in inspect(conn).get_columns(table)}
+    if column not in names:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        print(f"已为 {table} 表添加列 {column}")
+
+
+def _create_indexes(conn: Connection, model, *names: str):
+    """
+    按名称创建模型上声明的索引（已存在则跳过）
+
+    每个迁移只创建自己引入的索引：模型声明的是最新结构，其中的部分索引依赖之后的迁移才添加的列。
+    """
+    indexes = {index.name: index for index in model.__table__.indexes}
+    for name in names:
+        indexes[name].create(conn, checkfirst=True)
+
+
+# ---- 迁移专用的固定实现（与编写迁移时的邮箱目录结构一致，不随服务代码变化） ----
+
+# 邮箱根目录（相对工作目录）；登记历史邮件时只有平铺布局：<用户>/*.txt、<用户>/sent/*.txt
+_MAILBOX_DIR = Path("mailbox")
+_HEADER_MAX_BYTES = 64 * 1024
+_FTS_MAX_BODY_CHARS = 65536
+_CJK_CLASS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_TOKEN_RE = re.compile(f"([{_CJK_CLASS}]+)|([^\\W_{_CJK_CLASS}]+)")
+
+
+def _read_headers(filepath) -> tuple[dict, int]:
+    """读取邮件头（到第一个空行为止），返回 (小写头名 -> 值, 头部字节数)；无法读取时为 ({}, 0)"""
+    try:
+        with open(filepath, "rb") as f:
+            block = f.read(_HEADER_MAX_BYTES)
+    except OSError:
+        return {}, 0
+    ends = [i + n for i, n in ((block.find(b"\n\n"), 2), (block.find(b"\n\r\n"), 3)) if i != -1]
+    if ends:
+        block = block[:min(ends)]
+    fields = {}
+    name = None
+    for line in block.decode("utf-8", errors="replace").splitlines():
+        if not line.strip():
+            break
+        if line[0] in " \t" and name:
+            fields[name] = f"{fields[name]} {line.strip()}"
+            continue
+        if ":" not in line:
+            name = None
+            continue
+        key, value = line.split(":", 1)
+        key = key.strip().lower()
+        if key in fields:
+            name = None
+            continue
+        fields[key] = value.strip()
+        name = key
+    return fields, len(block)
+
+
+def _scan_flat_mailbox():
+    """遍历平铺布局的收件箱/发件箱文件，生成 mails 表记录"""
+    if not _MAILBOX_DIR.is_dir():
+        return
+    for user_dir in _MAILBOX_DIR.iterdir():
+        if not user_dir.is_dir():
+            continue
+        for folder, folder_dir in (("inbox", user_dir), ("sent", user_dir / "sent")):
+            if not folder_dir.is_dir():
+                continue
+            for mail_file in folder_dir.glob("*.txt"):
+                if not mail_file.is_file():
+                    continue
+                stat = mail_file.stat()
+                headers, _ = _read_headers(mail_file)
+                try:
+                    created_at = datetime.strptime(headers.get("date", ""), "%Y-%m-%d %H:%M:%S")
+                except ValueError:
+                    created_at = datetime.fromtimestamp(stat.st_mtime)
+                yield {
+                    "owner": user_dir.name,
+                    "folder": folder,
+                    "filename": mail_file.name,
+                    "file_path": str(mail_file),
+                    "from_addr": headers.get("from", ""),
+                    "to_addr": headers.get("to", ""),
+                    "subject": headers.get("subject", ""),
+                    "size": stat.st_size,
+                    "created_at": created_at,
+                    "is_deleted": 0,
+                }
+
+
+def _attachment_names(owner: str, filename: str) -> tuple[list[str], set[str]]:
+    """
+    邮件的附件名与内嵌图片名（只读）
+
+    附件在 <用户>/attachments/<邮件名>/，清单为同级的 <邮件名>.json；有清单时以清单为准，否则列出目录中的文件。
+    """
+    attach_root = _MAILBOX_DIR / owner / "attachments"
+    mail_name = filename.replace(".txt", "")
+    manifest = None
+    try:
+        manifest = json.loads((attach_root / f"{mail_name}.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        pass
+    if isinstance(manifest, dict):
+        inline = {part.get("filename") for part in manifest.get("parts", []) if part.get("role") == "inline"}
+        return list(manifest.get("attachments", {})), inline
+    attach_dir = attach_root / mail_name
+    if not attach_dir.is_dir():
+        return [], set()
+    return sorted(f.name for f in attach_dir.iterdir() if f.is_file()), set()
+
+
+def _fts_text(value: str) -> str:
+    """检索分词：汉字串切成重叠二元组（单字输出本身），其余为小写单词"""
+    tokens = []
+    for cjk, word in _TOKEN_RE.findall(value or ""):
+        if cjk:
+            tokens.extend([cjk] if len(cjk) == 1 else (cjk[i:i + 2] for i in range(len(cjk) - 1)))
+        else:
+            tokens.append(word.lower())
+    return " ".join(tokens)
+
+
+def _fts_scope(owner: str, folder: str) -> str:
+    """检索索引中的用户与文件夹范围词"""
+    return "s" + hashlib.sha1(f"{owner}\x00{folder}".encode("utf-8")).hexdigest()[:16]
+
+
+def _m001_initial_tables(conn: Connection):
+    Base.metadata.create_all(bind=conn)
+
+
+def _m002_user_columns(conn: Connection):
+    _add_column_if_missing(conn, "users", "is_disabled", "INTEGER DEFAULT 0")
+    _add_column_if_missing(conn, "users", "phone_number", "VARCHAR(20)")
+    _add_column_if_missing(conn, "users", "email", "VARCHAR(255)")
+
+
+def _m003_mail_indexes(conn: Connection):
+    _create_indexes(
+        conn, Mail, "ix_mails_to_deleted_created", "ix_mails_from_deleted_created", "ix_mails_deleted_created"
+    )
+
+
+def _m004_mail_catalog_columns(conn: Connection):
+    _add_column_if_missing(conn, "mails", "owner", "VARCHAR(100)")
+    _add_column_if_missing(conn, "mails", "folder", "VARCHAR(20) DEFAULT 'inbox'")
+    _add_column_if_missing(conn, "mails", "filename", "VARCHAR(255)")
+    _add_column_if_missing(conn, "mails", "size", "INTEGER DEFAULT 0")
+    _add_column_if_missing(conn, "mails", "deleted_at", "DATETIME")
+    _create_indexes(conn, Mail, "ix_mails_owner_folder_deleted_created", "ux_mails_owner_folder_filename")
+
+
+def _m005_backfill_mail_catalog(conn: Connection):
+    # 将已存在的邮件文件登记到 mails 表（已登记的跳过）
+    existing = {
+        (row.owner, row.folder, row.filename)
+        for row in conn.execute(text("SELECT owner, folder, filename FROM mails"))
+    }
+    rows = [
+        values for values in _scan_flat_mailbox()
+        if (values["owner"], values["folder"], values["filename"]) not in existing
+    ]
+    if rows:
+        # 只插入本步骤给出的列：Mail.__table__ 会带上之后迁移才添加的列的默认值
+        mails = table("mails", *(column(name) for name in rows[0]))
+        conn.execute(mails.insert(), rows)
+        print(f"已登记 {len(rows)} 封历史邮件到 mails 表")
+
+
+def _m006_mailbox_stats(conn: Connection):
+    # 新建统计表与全局浏览索引，并由 mails 表汇总初始值（统计表按最新模型创建，已含 version 列）
+    MailboxStat.__table__.create(conn, checkfirst=True)
+    _create_indexes(conn, Mail, "ix_mails_folder_deleted_created")
+    conn.execute(MailboxStat.__table__.delete())
+    conn.execute(text(
+        "INSERT INTO mailbox_stats (owner, folder, message_count, total_bytes, version) "
+        "SELECT owner, folder, COUNT(*), COALESCE(SUM(size), 0), 0 FROM mails "
+        "WHERE is_deleted = 0 AND owner IS NOT NULL GROUP BY owner, folder"
+    ))
+
+
+def _m007_mail_threads(conn: Connection):
+    # 新增会话索引列，并按时间顺序由邮件头 In-Reply-To 推算历史邮件的会话根
+    _add_column_if_missing(conn, "mails", "in_reply_to", "VARCHAR(255)")
+    _add_column_if_missing(conn, "mails", "thread_root", "VARCHAR(255)")
+    _create_indexes(conn, Mail, "ix_mails_owner_thread_created")
+
+    roots = {}
+    rows = conn.execute(text(
+        "SELECT id, owner, filename, file_path FROM mails ORDER BY created_at, id"
+    )).all()
+    for row in rows:
+        headers, _ = _read_headers(row.file_path) if row.file_path else ({}, 0)
+        parent = headers.get("in-reply-to") or None
+        root = roots.get((row.owner, parent), row.filename) if parent else row.filename
+        roots.setdefault((row.owner, row.filename), root)
+        conn.execute(
+            text("UPDATE mails SET in_reply_to = :parent, thread_root = :root WHERE id = :id"),
+            {"parent": parent, "root": root, "id": row.id}
+        )
+
+
+def _m008_mail_flags(conn: Connection):
+    _add_column_if_missing(conn, "mails", "flags", "VARCHAR(16) DEFAULT ''")
+
+
+def _m009_imap_sync_state(conn: Connection):
+    ImapSyncState.__table__.create(conn, checkfirst=True)
+
+
+def _m010_imap_accounts(conn: Connection):
+    ImapAccount.__table__.create(conn, checkfirst=True)
+
+
+def _m011_mail_search_index(conn: Connection):
+    # 创建全文检索索引（仅 SQLite FTS5），并为未删除的历史邮件建立索引
+    if conn.dialect.name != "sqlite":
+        return
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS mail_fts USING fts5("
+        "scope, subject, body, addrs, attachments, tokenize = 'unicode61 remove_diacritics 2')"
+    ))
+    rows = conn.execute(text(
+        "SELECT id, owner, folder, filename, file_path, from_addr, to_addr, subject "
+        "FROM mails WHERE is_deleted = 0 AND owner IS NOT NULL"
+    )).all()
+    insert = text(
+        "INSERT INTO mail_fts (rowid, scope, subject, body, addrs, attachments) "
+        "VALUES (:id, :scope, :subject, :body, :addrs, :attachments)"
+    )
+    batch = []
+    for row in rows:
+        body = ""
+        if row.file_path:
+            _, header_bytes = _read_headers(row.file_path)
+            try:
+                with open(row.file_path, "rb") as f:
+                    f.seek(header_bytes)
+                    body = f.read().decode("utf-8", errors="replace")
+            except OSError:
+                pass
+        names, _ = _attachment_names(row.owner, row.filename) if row.filename else ([], set())
+        batch.append({
+            "id": row.id,
+            "scope": _fts_scope(row.owner, row.folder),
+            "subject": _fts_text(row.subject or ""),
+            "body": _fts_text(body[:_FTS_MAX_BODY_CHARS]),
+            "addrs": _fts_text(f"{row.from_addr or ''} {row.to_addr or ''}"),
+            "attachments": _fts_text(" ".join(names)),
+        })
+        if len(batch) >= 500:
+            conn.execute(insert, batch)
+            batch = []
+    if batch:
+        conn.execute(insert, batch)
+
+
+def _m012_mail_query_indexes(conn: Connection):
+    # 附件数列与查询语言所用的复合索引；附件数从已有的附件清单回填（不含内嵌图片）
+    _add_column_if_missing(conn, "mails", "attachment_count", "INTEGER DEFAULT 0")
+    _create_indexes(
+        conn, Mail,
+        "ix_mails_owner_folder_deleted_from_created",
+        "ix_mails_owner_folder_deleted_to_created",
+        "ix_mails_owner_folder_deleted_size",
+        "ix_mails_owner_folder_deleted_created_attach",
+    )
+    rows = conn.execute(text(
+        "SELECT id, owner, filename FROM mails WHERE owner IS NOT NULL AND filename IS NOT NULL"
+    )).all()
+    updates = []
+    for row in rows:
+        names, inline = _attachment_names(row.owner, row.filename)
+        count = sum(1 for name in names if name not in inline)
+        if count:
+            updates.append({"id": row.id, "count": count})
+    if updates:
+        conn.execute(text("UPDATE mails SET attachment_count = :count WHERE id = :id"), updates)
+
+
+def _m013_mailbox_version(conn: Connection):
+    _add_column_if_missing(conn, "mailbox_stats", "version", "INTEGER NOT NULL DEFAULT 0")
+
+
+def _m014_mail_change_journal(conn: Connection):
+    # 以现有邮件的 add 变更作为日志起点，客户端从 since=0 同步即可得到完整邮箱
+    MailChange.__table__.create(conn, checkfirst=True)
+    MailChangeFloor.__table__.create(conn, checkfirst=True)
+    conn.execute(text(
+        "INSERT INTO mail_changes (owner, folder, filename, action, flags, created_at) "
+        "SELECT owner, folder, filename, 'add', COALESCE(flags, ''), :now FROM mails "
+        "WHERE is_deleted = 0 AND owner IS NOT NULL AND filename IS NOT NULL "
+        "ORDER BY created_at, id"
+    ), {"now": datetime.utcnow()})
+
+
+def _m015_encrypt_imap_passwords(conn: Connection):
+    # 外部邮箱密码改为加密保存，已有的明文密码就地加密
+    from app.utils.credential_cipher import encrypt_secret, is_encrypted
+
+    rows = conn.execute(text("SELECT id, password FROM imap_accounts")).all()
+    updates = [
+        {"id": row.id, "password": encrypt_secret(row.password)}
+        for row in rows if row.password and not is_encrypted(row.password)
+    ]
+    if updates:
+        conn.execute(text("UPDATE imap_accounts SET password = :password WHERE id = :id"), updates)
+        print(f"已加密 {len(updates)} 个外部邮箱密码")
+
+
+# 迁移步骤：(版本号, 说明, 执行函数)，版本号严格递增，只追加不修改
+MIGRATIONS = [
+    (1, "初始表结构", _m001_initial_tables),
+    (2, "users 表补充 is_disabled/phone_number/email 列", _m002_user_columns),
+    (3, "mails 表复合索引", _m003_mail_indexes),
+    (4, "mails 表补充 owner/folder/filename/size/deleted_at 列", _m004_mail_catalog_columns),
+    (5, "登记历史邮件文件", _m005_backfill_mail_catalog),
+    (6, "mailbox_stats 统计表与邮件浏览索引", _m006_mailbox_stats),
+    (7, "mails 表会话索引（in_reply_to/thread_root）", _m007_mail_threads),
+    (8, "mails 表邮件标记列（flags）", _m008_mail_flags),
+    (9, "imap_sync_state IMAP 增量同步进度表", _m009_imap_sync_state),
+    (10, "imap_accounts 外部 IMAP 账号表", _m010_imap_accounts),
+    (11, "mail_fts 全文检索索引", _m011_mail_search_index),
+    (12, "mails 表附件数列与查询语言索引", _m012_mail_query_indexes),
+    (13, "mailbox_stats 邮箱版本号列", _m013_mailbox_version),
+    (14, "mail_changes 邮件变更日志（增量同步）", _m014_mail_change_journal),
+    (15, "imap_accounts 外部邮箱密码加密保存", _m015_encrypt_imap_passwords),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(engine: Engine) -> int:
+    """读取当前结构版本（无版本表时视为 0）"""
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except Exception:
+        return 0
+
+
+def run_migrations(engine: Engine) -> int:
+    """执行所有未应用的迁移，返回最终版本号"""
+    current = get_schema_version(engine)
+    if current >= LATEST_VERSION:
+        return current
+
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        # 每个步骤与其版本记录在同一事务中提交
+        with engine.begin() as conn:
+            step(conn)
+            conn.execute(
+                SchemaVersion.__table__.insert().values(
+                    version=version, description=description, applied_at=datetime.utcnow()
+                )
+            )
+        print(f"数据库迁移完成: v{version} {description}")
+    return LATEST_VERSION
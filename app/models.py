@@ -1,7 +1,7 @@
 """
 数据库模型定义 - users、mails 表
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -55,13 +55,128 @@ class Mail(Base):
     subject = Column(String(500))
     body = Column(Text)
     file_path = Column(String(500))  # 邮件存储文件路径
+    owner = Column(String(100))  # 邮件所在邮箱的用户名
+    folder = Column(String(20), default="inbox")  # inbox 收件箱, sent 发件箱
+    filename = Column(String(255))  # 邮箱目录内的文件名
+    size = Column(Integer, default=0)  # 文件字节数
     created_at = Column(DateTime, default=datetime.utcnow)
     is_deleted = Column(Integer, default=0)  # 0 未删除, 1 已删除
+    deleted_at = Column(DateTime, nullable=True)  # 软删除时间，后台清理据此删除文件
+    in_reply_to = Column(String(255), nullable=True)  # 回复的父邮件文件名（同一用户邮箱内）
+    thread_root = Column(String(255), nullable=True)  # 会话根邮件文件名，同一会话的邮件取值相同
+    flags = Column(String(16), default="")  # Maildir 标记字母（S 已读、F 加星、R 已回复等），按字母排序
+    attachment_count = Column(Integer, default=0)  # 附件数（不含内嵌图片），用于 has:attachment 查询
+
+    # 复合索引：按收件人/发件人列出未删除邮件并按时间排序，及全局按时间浏览
+    __table_args__ = (
+        Index("ix_mails_to_deleted_created", "to_addr", "is_deleted", "created_at"),
+        Index("ix_mails_from_deleted_created", "from_addr", "is_deleted", "created_at"),
+        Index("ix_mails_deleted_created", "is_deleted", "created_at"),
+        Index("ix_mails_owner_folder_deleted_created", "owner", "folder", "is_deleted", "created_at"),
+        Index("ix_mails_folder_deleted_created", "folder", "is_deleted", "created_at"),
+        Index("ux_mails_owner_folder_filename", "owner", "folder", "filename", unique=True),
+        Index("ix_mails_owner_thread_created", "owner", "thread_root", "created_at"),
+        # 查询语言（MailQueryPlanner）：用户文件夹内按发件人/收件人/大小过滤，有附件的邮件用部分索引
+        Index("ix_mails_owner_folder_deleted_from_created", "owner", "folder", "is_deleted", "from_addr", "created_at"),
+        Index("ix_mails_owner_folder_deleted_to_created", "owner", "folder", "is_deleted", "to_addr", "created_at"),
+        Index("ix_mails_owner_folder_deleted_size", "owner", "folder", "is_deleted", "size"),
+        Index(
+            "ix_mails_owner_folder_deleted_created_attach", "owner", "folder", "is_deleted", "created_at",
+            sqlite_where=text("attachment_count > 0"),
+            postgresql_where=text("attachment_count > 0")
+        ),
+    )
     
     def __repr__(self):
         return f"<Mail from={self.from_addr} to={self.to_addr}>"
 
 
+class MailboxStat(Base):
+    """邮箱统计表（按用户与文件夹累计未删除邮件数与字节数，随写入/删除增量维护）"""
+    __tablename__ = "mailbox_stats"
+
+    owner = Column(String(100), primary_key=True)
+    folder = Column(String(20), primary_key=True)
+    message_count = Column(Integer, default=0, nullable=False)
+    total_bytes = Column(Integer, default=0, nullable=False)
+    version = Column(Integer, default=0, nullable=False)  # 邮箱版本号，邮件写入/删除/标记变化时递增，用于列表 ETag
+
+    def __repr__(self):
+        return f"<MailboxStat {self.owner}/{self.folder} count={self.message_count}>"
+
+
+class MailChange(Base):
+    """邮件变更日志（只追加）：按用户记录邮件的新增、删除与标记变化，id 即变更序号，供客户端增量同步"""
+    __tablename__ = "mail_changes"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    owner = Column(String(100), nullable=False)
+    folder = Column(String(20), nullable=False)
+    filename = Column(String(255), nullable=False)
+    action = Column(String(10), nullable=False)  # add 新增, delete 删除, flags 标记变化
+    flags = Column(String(16), default="")  # 变更后的标记
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # sqlite_autoincrement：压缩删光日志后序号也不会从头复用，客户端保存的序号始终有效
+    __table_args__ = (
+        Index("ix_mail_changes_owner_id", "owner", "id"),
+        Index("ix_mail_changes_created", "created_at"),
+        {"sqlite_autoincrement": True},
+    )
+
+    def __repr__(self):
+        return f"<MailChange #{self.id} {self.owner}/{self.folder}/{self.filename} {self.action}>"
+
+
+class MailChangeFloor(Base):
+    """变更日志压缩水位：记录每个用户已被清理的最大变更序号，since 低于该值的客户端须全量同步"""
+    __tablename__ = "mail_change_floors"
+
+    owner = Column(String(100), primary_key=True)
+    compacted_seq = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<MailChangeFloor {self.owner} seq={self.compacted_seq}>"
+
+
+class ImapAccount(Base):
+    """外部 IMAP 账号表（用户绑定的外部邮箱，新邮件同步到 owner 的收件箱）"""
+    __tablename__ = "imap_accounts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    owner = Column(String(100), index=True, nullable=False)  # 本地用户名
+    host = Column(String(255), nullable=False)
+    port = Column(Integer, default=993)
+    username = Column(String(255), nullable=False)
+    password = Column(String(512), nullable=False)  # 以服务端密钥加密保存（credential_cipher），接口不返回
+    use_ssl = Column(Integer, default=1)
+    mailbox = Column(String(100), default="INBOX")
+    enabled = Column(Integer, default=1)  # 0 停用, 1 启用
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # 同一外部账号文件夹只能同步到一个本地邮箱（同步进度按 username@host 记录）
+    __table_args__ = (
+        Index("ux_imap_accounts_host_user_mailbox", "host", "username", "mailbox", unique=True),
+    )
+
+    def __repr__(self):
+        return f"<ImapAccount {self.username}@{self.host} -> {self.owner}>"
+
+
+class ImapSyncState(Base):
+    """IMAP 同步进度表（按外部账号与文件夹记录 UIDVALIDITY 与已同步的最大 UID）"""
+    __tablename__ = "imap_sync_state"
+
+    account = Column(String(255), primary_key=True)  # 外部账号，形如 user@host
+    mailbox = Column(String(100), primary_key=True, default="INBOX")
+    uidvalidity = Column(Integer, nullable=True)
+    last_uid = Column(Integer, default=0, nullable=False)
+    last_synced_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<ImapSyncState {self.account}/{self.mailbox} uid={self.last_uid}>"
+
+
 class PasswordResetCode(Base):
     """密码重置验证码表（短信）"""
     __tablename__ = "password_reset_codes"
@@ -80,3 +195,15 @@ class PasswordResetCode(Base):
 
     def __repr__(self):
         return f"<PasswordResetCode user={self.user_id} code={self.code} used={self.used}>"
+
+
+class SchemaVersion(Base):
+    """数据库结构版本表（迁移记录）"""
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True)
+    description = Column(String(255))
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<SchemaVersion {self.version}>"
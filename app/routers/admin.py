@@ -1,22 +1,32 @@
 """
 管理员路由 - 用户管理、群发邮件、过滤管理
 """
-from fastapi import APIRouter, Depends, HTTPException, Header
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Header, Query
+from sqlalchemy import select, or_, and_
 from sqlalchemy.orm import Session
-from app.db import get_db
-from app.models import User
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import get_db, get_async_db
+from app.models import User, Mail, MailboxStat
 from app.schemas import UserResponse, MessageResponse
 from app.services.auth_service import AuthService
+from app.services.mail_cache import MailContentCache
+from app.services.mail_events import MailEventHub
 from app.services.mail_storage import MailStorageService
+from app.services.mail_query import MailQuery, MailQueryError, MailQueryPlanner
+from app.services.search_service import SearchService
 from app.services.filter_service import FilterService
+from app.services.broadcast_service import BroadcastService
+from app.services.layout_migration import LayoutMigrationService
+from app.services.imap_sync_service import ImapSyncService
 from pydantic import BaseModel
 from typing import List, Optional
-from app.config import ADMIN_ACCESS_KEY
+from app.config import ADMIN_ACCESS_KEY, MAIL_DOMAIN
 
 router = APIRouter(prefix="/admin", tags=["管理"])
 
 
-def verify_admin_token(
+async def verify_admin_token(
     authorization: str = Header(None),
     x_admin_key: str = Header(None, alias="X-Admin-Key")
 ) -> dict:
@@ -25,7 +35,7 @@ def verify_admin_token(
         raise HTTPException(status_code=401, detail="缺少认证令牌")
     
     token = authorization.replace("Bearer ", "")
-    user_info = AuthService.verify_token(token)
+    user_info = await AuthService.verify_token_async(token)
     
     if not user_info:
         raise HTTPException(status_code=401, detail="Token 无效或已过期")
@@ -43,12 +53,12 @@ def verify_admin_token(
 
 @router.get("/users", response_model=List[UserResponse])
 async def get_users(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     admin_info: dict = Depends(verify_admin_token)
 ):
     """获取所有用户列表（仅管理员）"""
-    users = db.query(User).all()
-    return users
+    result = await db.execute(select(User))
+    return result.scalars().all()
 
 
 class CreateUserRequest(BaseModel):
@@ -208,46 +218,140 @@ class BroadcastMailRequest(BaseModel):
     """群发邮件请求"""
     subject: str
     body: str
-    from_addr: str = "admin@localhost"
+    from_addr: Optional[str] = None  # 为空时使用管理员自己的本域地址
     user_ids: Optional[List[int]] = None  # 可选的用户ID列表，如果为空或None则发送给所有用户
 
 
 @router.post("/broadcast", response_model=MessageResponse)
 async def broadcast_mail(
     request: BroadcastMailRequest,
-    db: Session = Depends(get_db),
     admin_info: dict = Depends(verify_admin_token)
 ):
-    """群发邮件给指定用户或所有用户（仅管理员）"""
-    # 如果提供了user_ids，则只发送给这些用户；否则发送给所有用户
-    if request.user_ids:
-        users = db.query(User).filter(User.id.in_(request.user_ids)).all()
-    else:
-        users = db.query(User).all()
-    
-    if not users:
+    """创建群发任务，后台分批发送给指定用户或所有用户（仅管理员）"""
+    total = await BroadcastService.count_recipients(request.user_ids)
+    if total == 0:
         raise HTTPException(status_code=404, detail="没有找到任何用户")
-    
-    success_count = 0
-    for user in users:
-        try:
-            to_addr = f"{user.username}@localhost"
-            MailStorageService.save_mail(
-                to_addr=to_addr,
-                from_addr=request.from_addr,
-                subject=request.subject,
-                body=request.body
-            )
-            success_count += 1
-        except Exception as e:
-            print(f"群发邮件失败 {user.username}: {e}")
-    
+
+    from_addr = request.from_addr or f"{admin_info.get('username')}@{MAIL_DOMAIN}"
+    job = BroadcastService.start_job(
+        from_addr=from_addr,
+        subject=request.subject,
+        body=request.body,
+        user_ids=request.user_ids,
+        total=total
+    )
+
     return MessageResponse(
         success=True,
-        message=f"群发成功：已发送 {success_count}/{len(users)} 封邮件"
+        message=f"群发任务已创建：共 {total} 位收件人",
+        data={"job_id": job["job_id"], "total": total}
     )
 
 
+def _broadcast_job_response(job: dict) -> dict:
+    """群发任务状态响应"""
+    return {
+        "success": True,
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "total": job["total"],
+        "sent": job["sent"],
+        "failed": job["failed"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "finished_at": job["finished_at"],
+    }
+
+
+@router.get("/broadcast/{job_id}")
+async def get_broadcast_job(job_id: str, admin_info: dict = Depends(verify_admin_token)):
+    """查询群发任务进度（仅管理员）"""
+    job = BroadcastService.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="群发任务不存在")
+    return _broadcast_job_response(job)
+
+
+@router.post("/broadcast/{job_id}/cancel")
+async def cancel_broadcast_job(job_id: str, admin_info: dict = Depends(verify_admin_token)):
+    """取消群发任务（仅管理员）"""
+    job = BroadcastService.cancel_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="群发任务不存在")
+    return _broadcast_job_response(job)
+
+
+# ============ 邮件目录布局迁移 ============
+
+def _migration_job_response(job: dict) -> dict:
+    """布局迁移任务状态响应"""
+    return {
+        "success": True,
+        "status": job["status"],
+        "layout": job["layout"],
+        "scanned": job["scanned"],
+        "moved": job["moved"],
+        "missing": job["missing"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "finished_at": job["finished_at"],
+    }
+
+
+@router.post("/storage/migrate")
+async def start_storage_migration(admin_info: dict = Depends(verify_admin_token)):
+    """将已有邮件文件在线迁移到当前配置的存储后端与目录布局（MAIL_STORAGE_BACKEND/MAIL_STORAGE_LAYOUT，仅管理员）"""
+    try:
+        job = LayoutMigrationService.start_job()
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _migration_job_response(job)
+
+
+@router.get("/storage/migrate")
+async def get_storage_migration(admin_info: dict = Depends(verify_admin_token)):
+    """查询目录布局迁移进度（仅管理员）"""
+    job = LayoutMigrationService.job
+    if not job:
+        raise HTTPException(status_code=404, detail="没有迁移任务")
+    return _migration_job_response(job)
+
+
+@router.post("/storage/migrate/cancel")
+async def cancel_storage_migration(admin_info: dict = Depends(verify_admin_token)):
+    """取消目录布局迁移（仅管理员）"""
+    job = LayoutMigrationService.cancel_job()
+    if not job:
+        raise HTTPException(status_code=404, detail="没有迁移任务")
+    return _migration_job_response(job)
+
+
+@router.get("/storage/cache")
+async def get_mail_cache_stats(admin_info: dict = Depends(verify_admin_token)):
+    """邮件内容读缓存的命中、未命中、淘汰与失效计数及当前占用（仅管理员）"""
+    return {"success": True, "cache": MailContentCache.get_stats()}
+
+
+@router.get("/mail-events")
+async def get_mail_event_stats(admin_info: dict = Depends(verify_admin_token)):
+    """新邮件推送的在线连接数与发布、送达、丢弃计数（仅管理员）"""
+    return {"success": True, "events": MailEventHub.get_stats()}
+
+
+# ============ 外部 IMAP 同步 ============
+
+@router.get("/imap/accounts")
+async def get_imap_sync_status(admin_info: dict = Depends(verify_admin_token)):
+    """查看所有外部 IMAP 账号的同步延迟、吞吐与调度器状态（仅管理员）"""
+    accounts = ImapSyncService.list_accounts()
+    return {
+        "success": True,
+        "pool": ImapSyncService.pool_status(),
+        "count": len(accounts),
+        "accounts": [ImapSyncService.account_to_dict(a) for a in accounts]
+    }
+
+
 # ============ 修改密码 ============
 
 class ChangePasswordRequest(BaseModel):
@@ -372,31 +476,120 @@ class MailInfo(BaseModel):
     created: str
 
 
+def _encode_mail_cursor(created_at: datetime, mail_id: int) -> str:
+    """分页游标：上一页最后一封邮件的 (created_at, id)"""
+    return f"{created_at.isoformat()}|{mail_id}"
+
+
+def _decode_mail_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created, mail_id = cursor.rsplit("|", 1)
+        return datetime.fromisoformat(created), int(mail_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+
 @router.get("/mails")
-async def get_all_mails(admin_info: dict = Depends(verify_admin_token)):
-    """获取所有用户的邮件列表（仅管理员）"""
-    from pathlib import Path
-    
-    all_mails = []
-    mailbox_dir = Path("mailbox")
-    
-    if not mailbox_dir.exists():
-        return {"success": True, "count": 0, "mails": []}
-    
-    for user_dir in mailbox_dir.iterdir():
-        if user_dir.is_dir():
-            username = user_dir.name
-            for mail_file in sorted(user_dir.glob("*.txt"), reverse=True):
-                from datetime import datetime
-                created_time = datetime.fromtimestamp(mail_file.stat().st_ctime).strftime("%Y-%m-%d %H:%M:%S")
-                all_mails.append({
-                    "username": username,
-                    "filename": mail_file.name,
-                    "size": mail_file.stat().st_size,
-                    "created": created_time
-                })
-    
-    return {"success": True, "count": len(all_mails), "mails": all_mails}
+async def get_all_mails(
+    username: Optional[str] = None,
+    sender: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    min_size: Optional[int] = None,
+    max_size: Optional[int] = None,
+    q: Optional[str] = Query(None, max_length=500),
+    explain: bool = False,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    admin_info: dict = Depends(verify_admin_token)
+):
+    """
+    分页浏览所有用户的收件箱邮件（仅管理员）
+
+    按时间倒序，基于 mails 表索引查询；可按用户、发件人、时间范围与大小过滤，
+    也可用查询语句 q（from:/to:/before:/after:/has:attachment/larger:/smaller: 与关键词），
+    explain=true 时附带执行计划。通过返回的 next_cursor 获取下一页。
+    """
+    query = None
+    if q and q.strip():
+        try:
+            query = MailQuery.parse(q)
+        except MailQueryError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    stmt = select(Mail.id, Mail.owner, Mail.filename, Mail.from_addr, Mail.subject, Mail.size, Mail.created_at).where(
+        Mail.folder == "inbox",
+        Mail.is_deleted == 0
+    )
+    if username:
+        stmt = stmt.where(Mail.owner == username)
+    if sender:
+        stmt = stmt.where(Mail.from_addr == sender)
+    if since:
+        stmt = stmt.where(Mail.created_at >= since)
+    if until:
+        stmt = stmt.where(Mail.created_at < until)
+    if min_size is not None:
+        stmt = stmt.where(Mail.size >= min_size)
+    if max_size is not None:
+        stmt = stmt.where(Mail.size <= max_size)
+    if query is not None:
+        full_text = await db.run_sync(lambda session: SearchService.is_available(session.connection()))
+        stmt = stmt.where(*MailQueryPlanner.conditions(query, owner=username, full_text=full_text))
+    if cursor:
+        cursor_created, cursor_id = _decode_mail_cursor(cursor)
+        stmt = stmt.where(or_(
+            Mail.created_at < cursor_created,
+            and_(Mail.created_at == cursor_created, Mail.id < cursor_id)
+        ))
+
+    # 多取一条用于判断是否还有下一页
+    stmt = stmt.order_by(Mail.created_at.desc(), Mail.id.desc()).limit(limit + 1)
+    rows = (await db.execute(stmt)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    mails = [
+        {
+            "username": row.owner,
+            "filename": row.filename,
+            "from_addr": row.from_addr,
+            "subject": row.subject,
+            "size": row.size,
+            "created": row.created_at.strftime("%Y-%m-%d %H:%M:%S")
+        }
+        for row in rows
+    ]
+    next_cursor = _encode_mail_cursor(rows[-1].created_at, rows[-1].id) if has_more else None
+
+    result = {"success": True, "count": len(mails), "mails": mails, "next_cursor": next_cursor}
+    if explain and query is not None:
+        result["plan"] = await db.run_sync(lambda session: MailQueryPlanner.explain(session.connection(), stmt, query))
+    return result
+
+
+@router.get("/mails/stats")
+async def get_mail_stats(
+    db: AsyncSession = Depends(get_async_db),
+    admin_info: dict = Depends(verify_admin_token)
+):
+    """各用户收件箱的邮件数与字节数统计（仅管理员）"""
+    result = await db.execute(
+        select(MailboxStat).where(MailboxStat.folder == "inbox").order_by(MailboxStat.owner)
+    )
+    users = [
+        {"username": row.owner, "message_count": row.message_count, "total_bytes": row.total_bytes}
+        for row in result.scalars()
+    ]
+
+    return {
+        "success": True,
+        "count": len(users),
+        "total_messages": sum(u["message_count"] for u in users),
+        "total_bytes": sum(u["total_bytes"] for u in users),
+        "users": users
+    }
 
 
 @router.get("/mails/{username}/{filename}")
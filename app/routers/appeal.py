@@ -12,13 +12,13 @@ from typing import List
 router = APIRouter(prefix="/appeal", tags=["申诉"])
 
 
-def verify_admin_token(authorization: str = Header(None)) -> dict:
+async def verify_admin_token(authorization: str = Header(None)) -> dict:
     """验证管理员权限（复用）"""
     if not authorization:
         raise HTTPException(status_code=401, detail="缺少认证令牌")
     
     token = authorization.replace("Bearer ", "")
-    user_info = AuthService.verify_token(token)
+    user_info = await AuthService.verify_token_async(token)
     
     if not user_info:
         raise HTTPException(status_code=401, detail="Token 无效或已过期")
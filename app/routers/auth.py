@@ -91,7 +91,7 @@ async def change_password(
     if not authorization:
         raise HTTPException(status_code=401, detail="缺少认证令牌")
     token = authorization.replace("Bearer ", "")
-    user_info = AuthService.verify_token(token)
+    user_info = await AuthService.verify_token_async(token)
     if not user_info:
         raise HTTPException(status_code=401, detail="Token 无效或已过期")
 
@@ -146,7 +146,7 @@ async def bind_phone(
     if not authorization:
         raise HTTPException(status_code=401, detail="缺少认证令牌")
     token = authorization.replace("Bearer ", "")
-    user_info = AuthService.verify_token(token)
+    user_info = await AuthService.verify_token_async(token)
     if not user_info:
         raise HTTPException(status_code=401, detail="Token 无效或已过期")
 
@@ -166,7 +166,7 @@ async def get_profile(
     if not authorization:
         raise HTTPException(status_code=401, detail="缺少认证令牌")
     token = authorization.replace("Bearer ", "")
-    user_info = AuthService.verify_token(token)
+    user_info = await AuthService.verify_token_async(token)
     if not user_info:
         raise HTTPException(status_code=401, detail="Token 无效或已过期")
     user_id = user_info.get("user_id")
@@ -186,7 +186,7 @@ async def update_profile(
     if not authorization:
         raise HTTPException(status_code=401, detail="缺少认证令牌")
     token = authorization.replace("Bearer ", "")
-    user_info = AuthService.verify_token(token)
+    user_info = await AuthService.verify_token_async(token)
     if not user_info:
         raise HTTPException(status_code=401, detail="Token 无效或已过期")
     user_id = user_info.get("user_id")
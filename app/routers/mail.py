@@ -1,30 +1,56 @@
 """
 邮件路由 - 邮件列表、读取、删除、发送、附件管理
 """
-from fastapi import APIRouter, Depends, HTTPException, Header, UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Header, UploadFile, File, Request, Query
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from app.services.auth_service import AuthService
 from app.services.mail_storage import MailStorageService
+from app.services.mail_query import MailQuery, MailQueryError
+from app.services.mail_events import MailEventHub
 from app.services.smtp_client import SMTPClient
-from app.schemas import MessageResponse, SendMailRequest, SaveDraftRequest, ReplyMailRequest
-from app.config import MAIL_DOMAIN
-from typing import List
+from app.services.upload_service import UploadService
+from app.services.attachment_pipeline import AttachmentPipeline
+from app.services.imap_sync_service import ImapSyncService
+from app.schemas import (
+    MessageResponse,
+    SendMailRequest,
+    SaveDraftRequest,
+    ReplyMailRequest,
+    CreateUploadSessionRequest,
+    UpdateMailFlagsRequest,
+    BatchMailRequest,
+    BatchMailFlagsRequest,
+    BatchMoveMailRequest,
+    BatchReadMailRequest,
+    CreateImapAccountRequest,
+)
+from app.config import MAIL_DOMAIN, UPLOAD_CHUNK_SIZE, MAIL_BATCH_MAX_ITEMS
+from typing import List, Optional
 from app.utils.validators import is_valid_email, extract_username
-from app.db import SessionLocal
+from app.utils.file_response import GzipDecodedFileResponse, RangeFileResponse, accepts_encoding
+from app.utils.http_cache import IMMUTABLE, not_modified, set_cache_headers, version_etag
+from app.utils.message_id import new_mail_filename
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db import get_async_db
 from app.models import User
+import asyncio
 import os
 from pathlib import Path
+from urllib.parse import quote
 
 router = APIRouter(prefix="/mail", tags=["邮件"])
 
+# 邮件存储（SQLite 会话与邮件文件读写）均为阻塞调用，路由中通过 asyncio.to_thread 在线程池中执行，不占用事件循环
 
-def verify_user_token(authorization: str = Header(None)) -> dict:
+
+async def verify_user_token(authorization: str = Header(None)) -> dict:
     """验证用户 Token"""
     if not authorization:
         raise HTTPException(status_code=401, detail="缺少认证令牌")
 
     token = authorization.replace("Bearer ", "")
-    user_info = AuthService.verify_token(token)
+    user_info = await AuthService.verify_token_async(token)
 
     if not user_info:
         raise HTTPException(status_code=401, detail="Token 无效或已过期")
@@ -37,7 +63,7 @@ def verify_user_token(authorization: str = Header(None)) -> dict:
 async def list_drafts(user_info: dict = Depends(verify_user_token)):
     """获取当前用户的草稿列表"""
     username = user_info.get("username")
-    drafts = MailStorageService.list_drafts(username)
+    drafts = await asyncio.to_thread(MailStorageService.list_drafts, username)
 
     return {
         "success": True,
@@ -50,7 +76,7 @@ async def list_drafts(user_info: dict = Depends(verify_user_token)):
 async def read_draft(filename: str, user_info: dict = Depends(verify_user_token)):
     """读取草稿内容"""
     username = user_info.get("username")
-    content = MailStorageService.read_draft(username, filename)
+    content = await asyncio.to_thread(MailStorageService.read_draft, username, filename)
 
     if not content:
         raise HTTPException(status_code=404, detail="草稿不存在")
@@ -69,13 +95,17 @@ async def save_draft(
 ):
     """保存草稿"""
     username = user_info.get("username")
-    filename = MailStorageService.save_draft(
-        username=username,
-        to_addr=request.to_addr,
-        subject=request.subject,
-        body=request.body,
-        filename=request.filename
-    )
+    try:
+        filename = await asyncio.to_thread(
+            MailStorageService.save_draft,
+            username=username,
+            to_addr=request.to_addr,
+            subject=request.subject,
+            body=request.body,
+            filename=request.filename
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     return {
         "success": True,
@@ -88,7 +118,7 @@ async def save_draft(
 async def delete_draft(filename: str, user_info: dict = Depends(verify_user_token)):
     """删除草稿"""
     username = user_info.get("username")
-    success = MailStorageService.delete_draft(username, filename)
+    success = await asyncio.to_thread(MailStorageService.delete_draft, username, filename)
 
     if not success:
         raise HTTPException(status_code=404, detail="草稿不存在")
@@ -96,71 +126,285 @@ async def delete_draft(filename: str, user_info: dict = Depends(verify_user_toke
     return MessageResponse(success=True, message=f"草稿 {filename} 已删除")
 
 @router.get("/list")
-async def list_mails(user_info: dict = Depends(verify_user_token)):
-    """获取当前用户的邮件列表"""
+async def list_mails(
+    request: Request,
+    response: Response,
+    q: Optional[str] = Query(None, max_length=500),
+    explain: bool = False,
+    user_info: dict = Depends(verify_user_token)
+):
+    """
+    获取当前用户的邮件列表
+
+    q 为查询语句，如 "from:boss@corp.com after:2026-01-01 has:attachment larger:1M 报告"；
+    explain=true 时附带生成的 SQL 与执行计划。
+    响应带邮箱版本 ETag，客户端以 If-None-Match 轮询，邮箱无变化时返回 304。
+    """
     username = user_info.get("username")
-    mails = MailStorageService.list_user_mails(username)
+    # 先取版本号再查询：两者之间有新邮件时 ETag 偏旧，下次轮询会重新获取，不会漏掉变化
+    version = await asyncio.to_thread(MailStorageService.get_mailbox_version, username, "inbox")
+    etag = version_etag("list", username, version, q or "", explain)
+    cached = not_modified(request.headers, etag)
+    if cached is not None:
+        return cached
+
+    plan = None
+    if q and q.strip():
+        try:
+            query = MailQuery.parse(q)
+        except MailQueryError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        mails, plan = await asyncio.to_thread(MailStorageService.query_mails, username, "inbox", query, explain)
+    else:
+        mails = await asyncio.to_thread(MailStorageService.list_user_mails, username)
 
-    return {
+    result = {
         "success": True,
         "count": len(mails),
         "mails": mails
     }
+    if plan is not None:
+        result["plan"] = plan
+    set_cache_headers(response, etag)
+    return result
 
 
-@router.get("/sent/list")
-async def list_sent_mails(user_info: dict = Depends(verify_user_token)):
-    """获取当前用户的已发送邮件列表"""
-    username = user_info.get("username")
-    mails = MailStorageService.list_sent_mails(username)
-
+@router.get("/new")
+async def check_new_mail(user_info: dict = Depends(verify_user_token)):
+    """检查收件箱是否有未读邮件（轻量轮询接口）"""
     return {
         "success": True,
-        "count": len(mails),
-        "mails": mails
+        "has_new": await asyncio.to_thread(MailStorageService.has_new_mail, user_info.get("username"))
     }
 
 
-@router.get("/read/{filename}")
-async def read_mail(filename: str, user_info: dict = Depends(verify_user_token)):
-    """读取邮件内容及附件"""
-    username = user_info.get("username")
-    content = MailStorageService.read_mail(username, filename)
+@router.get("/sync")
+async def sync_mail_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=1000),
+    user_info: dict = Depends(verify_user_token)
+):
+    """
+    增量同步：返回序号 since 之后的邮件变更（add/delete/flags，同一封邮件合并为最终状态）
 
-    if not content:
-        raise HTTPException(status_code=404, detail="邮件不存在")
+    客户端保存返回的 cursor 作为下次的 since；has_more 为 true 时继续拉取。
+    首次同步传 since=0。full_resync 为 true（日志已压缩或序号无效）时，先记下 cursor，再通过
+    /mail/list 与 /mail/sent/list 重新获取完整列表；期间的变更会在下次同步中重复出现，按最终状态应用即可。
+    """
+    result = await asyncio.to_thread(MailStorageService.get_mail_changes, user_info.get("username"), since, limit)
+    return {"success": True, "count": len(result["changes"]), **result}
 
-    # 获取附件信息
-    attachments = MailStorageService.get_attachments(username, filename)
 
+@router.get("/events")
+async def mail_events(user_info: dict = Depends(verify_user_token)):
+    """
+    新邮件推送（Server-Sent Events）
+
+    事件：ready 连接建立；mail 邮件新增/删除/标记变化（action 为 add/delete/flags）；
+    resync 推送队列溢出，客户端应调用 /mail/sync 补齐。无事件时定期发送心跳注释。
+    """
+    try:
+        subscriber = MailEventHub.subscribe(user_info.get("username"))
+    except ValueError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return _MailEventResponse(subscriber)
+
+
+class _MailEventResponse(StreamingResponse):
+    """SSE 响应：订阅在握手时登记（以便返回 429），响应结束时无论数据流是否开始迭代都注销订阅"""
+
+    def __init__(self, subscriber):
+        super().__init__(
+            MailEventHub.stream(subscriber),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+        self.subscriber = subscriber
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # 客户端在首次迭代前断开时数据流生成器不会执行其 finally，这里兜底注销（重复注销无副作用）
+            MailEventHub.unsubscribe(self.subscriber)
+
+
+@router.post("/flags/{filename}")
+async def update_mail_flags(
+    filename: str,
+    request: UpdateMailFlagsRequest,
+    user_info: dict = Depends(verify_user_token)
+):
+    """增删邮件标记（如 add="S" 标为已读，remove="S" 标为未读，add="F" 加星）"""
+    if request.folder not in ("inbox", "sent"):
+        raise HTTPException(status_code=400, detail="文件夹只能是 inbox 或 sent")
+    flags = await asyncio.to_thread(
+        MailStorageService.set_mail_flags,
+        user_info.get("username"), filename, add=request.add, remove=request.remove, folder=request.folder
+    )
+    if flags is None:
+        raise HTTPException(status_code=404, detail="邮件不存在")
     return {
         "success": True,
         "filename": filename,
-        "content": content,
-        "attachments": attachments
+        "flags": flags,
+        "is_read": "S" in flags
     }
 
 
-@router.get("/sent/read/{filename}")
-async def read_sent_mail(filename: str, user_info: dict = Depends(verify_user_token)):
-    """读取已发送邮件内容及附件"""
+@router.get("/search")
+async def search_mails(
+    q: str = Query(..., min_length=1, max_length=200),
+    folder: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    user_info: dict = Depends(verify_user_token)
+):
+    """全文检索邮件（主题、正文、发件人/收件人、附件名），按相关度排序；folder 可选 inbox/sent"""
+    if folder not in (None, "inbox", "sent"):
+        raise HTTPException(status_code=400, detail="文件夹只能是 inbox 或 sent")
+    results, total = await asyncio.to_thread(
+        MailStorageService.search_mails, user_info.get("username"), q, folder, limit, offset
+    )
+    return {
+        "success": True,
+        "query": q,
+        "total": total,
+        "count": len(results),
+        "offset": offset,
+        "mails": results
+    }
+
+
+@router.get("/sent/list")
+async def list_sent_mails(request: Request, response: Response, user_info: dict = Depends(verify_user_token)):
+    """获取当前用户的已发送邮件列表（带邮箱版本 ETag，支持 304）"""
     username = user_info.get("username")
-    content = MailStorageService.read_sent_mail(username, filename)
+    version = await asyncio.to_thread(MailStorageService.get_mailbox_version, username, "sent")
+    etag = version_etag("sent", username, version)
+    cached = not_modified(request.headers, etag)
+    if cached is not None:
+        return cached
+
+    mails = await asyncio.to_thread(MailStorageService.list_sent_mails, username)
+    set_cache_headers(response, etag)
+    return {
+        "success": True,
+        "count": len(mails),
+        "mails": mails
+    }
 
-    if not content:
-        raise HTTPException(status_code=404, detail="邮件不存在")
 
-    # 获取附件信息
-    attachments = MailStorageService.get_attachments(username, filename)
+def _mail_version_etag(username: str, folder: str, filename: str) -> str | None:
+    """读信接口的 ETag：邮件文件与附件清单版本，邮件不存在时为 None（阻塞调用）"""
+    version = MailStorageService.get_mail_version(username, folder, filename)
+    return version_etag("read", folder, filename, *version) if version is not None else None
 
+
+def _mail_detail(username: str, folder: str, filename: str, mark_read: bool = False) -> dict | None:
+    """读取邮件内容、附件信息与收信时记录的 MIME 结构，邮件不存在时返回 None（阻塞调用）"""
+    if folder == "inbox":
+        content = MailStorageService.read_mail(username, filename)
+    else:
+        content = MailStorageService.read_sent_mail(username, filename)
+    if not content:
+        return None
+    if mark_read:
+        MailStorageService.set_mail_flags(username, filename, add="S", folder=folder)
+    parts = MailStorageService.get_mail_parts(username, filename)
     return {
-        "success": True,
         "filename": filename,
         "content": content,
-        "attachments": attachments
+        "attachments": MailStorageService.get_attachments(username, filename),
+        "parts": parts,
+        "has_html": any(p["role"] == "html" for p in parts)
     }
 
 
+@router.get("/read/{filename}")
+async def read_mail(
+    filename: str,
+    request: Request,
+    response: Response,
+    user_info: dict = Depends(verify_user_token)
+):
+    """读取邮件内容及附件（读取后标记为已读；带 ETag，内容未变时返回 304）"""
+    username = user_info.get("username")
+    etag = await asyncio.to_thread(_mail_version_etag, username, "inbox", filename)
+    if etag is not None:
+        cached = not_modified(request.headers, etag)
+        if cached is not None:
+            await asyncio.to_thread(MailStorageService.set_mail_flags, username, filename, add="S")
+            return cached
+
+    detail = await asyncio.to_thread(_mail_detail, username, "inbox", filename, True)
+    if detail is None:
+        raise HTTPException(status_code=404, detail="邮件不存在")
+
+    if etag is not None:
+        set_cache_headers(response, etag)
+    return {"success": True, **detail}
+
+
+def _html_body_response(request: Request, username: str, folder: str, filename: str) -> Response:
+    """
+    返回收信保存的 HTML 正文；以沙箱方式展示，禁止脚本与外部资源（阻塞调用）
+
+    正文按邮件 ID 寻址、保存后不再改变，允许客户端长期缓存。
+    """
+    etag = _mail_version_etag(username, folder, filename)
+    if etag is None:
+        raise HTTPException(status_code=404, detail="邮件不存在")
+    cached = not_modified(request.headers, etag, IMMUTABLE)
+    if cached is not None:
+        return cached
+    html = MailStorageService.read_mail_html(username, filename)
+    if html is None:
+        raise HTTPException(status_code=404, detail="邮件没有 HTML 正文")
+    return HTMLResponse(html, headers={
+        "Content-Security-Policy": "sandbox; default-src 'none'; img-src data: cid:; style-src 'unsafe-inline'",
+        "X-Content-Type-Options": "nosniff",
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE,
+    })
+
+
+@router.get("/read/{filename}/html")
+async def read_mail_html(filename: str, request: Request, user_info: dict = Depends(verify_user_token)):
+    """读取收件箱邮件的 HTML 正文"""
+    return await asyncio.to_thread(_html_body_response, request, user_info.get("username"), "inbox", filename)
+
+
+@router.get("/sent/read/{filename}")
+async def read_sent_mail(
+    filename: str,
+    request: Request,
+    response: Response,
+    user_info: dict = Depends(verify_user_token)
+):
+    """读取已发送邮件内容及附件（带 ETag，内容未变时返回 304）"""
+    username = user_info.get("username")
+    etag = await asyncio.to_thread(_mail_version_etag, username, "sent", filename)
+    if etag is not None:
+        cached = not_modified(request.headers, etag)
+        if cached is not None:
+            return cached
+
+    detail = await asyncio.to_thread(_mail_detail, username, "sent", filename)
+    if detail is None:
+        raise HTTPException(status_code=404, detail="邮件不存在")
+
+    if etag is not None:
+        set_cache_headers(response, etag)
+    return {"success": True, **detail}
+
+
+@router.get("/sent/read/{filename}/html")
+async def read_sent_mail_html(filename: str, request: Request, user_info: dict = Depends(verify_user_token)):
+    """读取已发送邮件的 HTML 正文"""
+    return await asyncio.to_thread(_html_body_response, request, user_info.get("username"), "sent", filename)
+
+
 @router.get("/original-subject")
 async def get_original_mail_subject(
     in_reply_to: str,
@@ -168,7 +412,7 @@ async def get_original_mail_subject(
 ):
     """根据In-Reply-To获取原邮件的主题"""
     username = user_info.get("username")
-    subject = MailStorageService.get_original_mail_subject(username, in_reply_to)
+    subject = await asyncio.to_thread(MailStorageService.get_original_mail_subject, username, in_reply_to)
 
     return {
         "success": True,
@@ -182,7 +426,7 @@ async def get_reply_chain(
 ):
     """获取邮件的完整回复链（从原邮件到当前邮件的所有邮件）"""
     username = user_info.get("username")
-    chain = MailStorageService.get_reply_chain(username, filename)
+    chain = await asyncio.to_thread(MailStorageService.get_reply_chain, username, filename)
 
     return {
         "success": True,
@@ -190,11 +434,43 @@ async def get_reply_chain(
     }
 
 
+@router.get("/thread/{filename}")
+async def get_thread(
+    filename: str,
+    user_info: dict = Depends(verify_user_token)
+):
+    """获取邮件所在会话的所有邮件（含父子关系）"""
+    username = user_info.get("username")
+    thread = await asyncio.to_thread(MailStorageService.get_thread, username, filename)
+
+    if not thread:
+        raise HTTPException(status_code=404, detail="邮件不存在")
+
+    return {
+        "success": True,
+        "count": len(thread),
+        "thread": thread
+    }
+
+
+@router.get("/threads")
+async def list_threads(user_info: dict = Depends(verify_user_token)):
+    """按会话分组的邮件列表"""
+    username = user_info.get("username")
+    threads = await asyncio.to_thread(MailStorageService.list_threads, username)
+
+    return {
+        "success": True,
+        "count": len(threads),
+        "threads": threads
+    }
+
+
 @router.delete("/delete/{filename}", response_model=MessageResponse)
 async def delete_mail(filename: str, user_info: dict = Depends(verify_user_token)):
     """删除邮件"""
     username = user_info.get("username")
-    success = MailStorageService.delete_mail(username, filename)
+    success = await asyncio.to_thread(MailStorageService.delete_mail, username, filename)
 
     if not success:
         raise HTTPException(status_code=404, detail="邮件不存在")
@@ -202,9 +478,114 @@ async def delete_mail(filename: str, user_info: dict = Depends(verify_user_token
     return MessageResponse(success=True, message=f"邮件 {filename} 已删除")
 
 
+def _check_batch_request(request: BatchMailRequest) -> list:
+    """校验批量请求的文件夹与邮件数，返回去重后的文件名列表"""
+    if request.folder not in ("inbox", "sent"):
+        raise HTTPException(status_code=400, detail="文件夹只能是 inbox 或 sent")
+    filenames = list(dict.fromkeys(request.filenames))
+    if not filenames:
+        raise HTTPException(status_code=400, detail="邮件列表不能为空")
+    if len(filenames) > MAIL_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单次最多操作 {MAIL_BATCH_MAX_ITEMS} 封邮件")
+    return filenames
+
+
+def _batch_response(results: list) -> dict:
+    """批量操作响应：逐项结果与成功/失败计数"""
+    succeeded = sum(1 for item in results if item["success"])
+    return {
+        "success": True,
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
+    }
+
+
+@router.post("/batch/delete")
+async def batch_delete_mails(request: BatchMailRequest, user_info: dict = Depends(verify_user_token)):
+    """批量删除邮件（同一事务），返回每封邮件的结果"""
+    filenames = _check_batch_request(request)
+    deleted = await asyncio.to_thread(MailStorageService.delete_mails, user_info.get("username"), filenames, request.folder)
+    return _batch_response([
+        {"filename": name, "success": True} if deleted[name]
+        else {"filename": name, "success": False, "error": "邮件不存在"}
+        for name in filenames
+    ])
+
+
+@router.post("/batch/flags")
+async def batch_update_mail_flags(request: BatchMailFlagsRequest, user_info: dict = Depends(verify_user_token)):
+    """批量增删标记（如 add="S" 批量标为已读），返回每封邮件更新后的标记"""
+    filenames = _check_batch_request(request)
+    flags = await asyncio.to_thread(
+        MailStorageService.set_mails_flags,
+        user_info.get("username"), filenames, add=request.add, remove=request.remove, folder=request.folder
+    )
+    return _batch_response([
+        {"filename": name, "success": True, "flags": flags[name], "is_read": "S" in flags[name]}
+        if flags[name] is not None
+        else {"filename": name, "success": False, "error": "邮件不存在"}
+        for name in filenames
+    ])
+
+
+@router.post("/batch/move")
+async def batch_move_mails(request: BatchMoveMailRequest, user_info: dict = Depends(verify_user_token)):
+    """批量移动邮件到另一文件夹（inbox/sent），返回每封邮件的结果"""
+    filenames = _check_batch_request(request)
+    if request.target_folder not in ("inbox", "sent"):
+        raise HTTPException(status_code=400, detail="目标文件夹只能是 inbox 或 sent")
+    if request.target_folder == request.folder:
+        raise HTTPException(status_code=400, detail="目标文件夹与当前文件夹相同")
+    moved = await asyncio.to_thread(
+        MailStorageService.move_mails, user_info.get("username"), filenames, request.folder, request.target_folder
+    )
+    errors = {"not_found": "邮件不存在", "conflict": "目标文件夹已有同名邮件"}
+    return _batch_response([
+        {"filename": name, "success": True, "folder": request.target_folder} if moved[name] == "moved"
+        else {"filename": name, "success": False, "error": errors[moved[name]]}
+        for name in filenames
+    ])
+
+
+@router.post("/batch/read")
+async def batch_read_mails(request: BatchReadMailRequest, user_info: dict = Depends(verify_user_token)):
+    """批量读取邮件内容及附件信息；mark_read 为真时在同一事务中把读到的邮件标为已读"""
+    filenames = _check_batch_request(request)
+    results = await asyncio.to_thread(
+        _batch_read_mails, user_info.get("username"), filenames, request.folder, request.mark_read
+    )
+    return _batch_response(results)
+
+
+def _batch_read_mails(username: str, filenames: list, folder: str, mark_read: bool) -> list:
+    """批量读取的逐项结果（阻塞调用）：内容一次查询后逐个读取，已读标记在同一事务中提交"""
+    contents = MailStorageService.read_mails(username, filenames, folder)
+    found = [name for name in filenames if contents[name]]
+    if mark_read and found:
+        MailStorageService.set_mails_flags(username, found, add="S", folder=folder)
+
+    results = []
+    for name in filenames:
+        if not contents[name]:
+            results.append({"filename": name, "success": False, "error": "邮件不存在"})
+            continue
+        parts = MailStorageService.get_mail_parts(username, name)
+        results.append({
+            "filename": name,
+            "success": True,
+            "content": contents[name],
+            "attachments": MailStorageService.get_attachments(username, name),
+            "parts": parts,
+            "has_html": any(p["role"] == "html" for p in parts)
+        })
+    return results
+
+
 @router.post("/send", response_model=MessageResponse)
 async def send_mail(
     request: SendMailRequest,
+    db: AsyncSession = Depends(get_async_db),
     user_info: dict = Depends(verify_user_token)
 ):
     """
@@ -219,44 +600,43 @@ async def send_mail(
         raise HTTPException(status_code=400, detail="收件人邮箱格式无效")
 
     # 允许发送到外部邮箱：仅当收件人为本域时才校验存在性
-    db = SessionLocal()
     username = extract_username(request.to_addr)
     domain = request.to_addr.split("@")[-1].lower() if "@" in request.to_addr else ""
-    user = None
     if domain == MAIL_DOMAIN:
-        user = db.query(User).filter(User.username == username).first()
-        if not user:
-            db.close()
+        result = await db.execute(select(User.id).where(User.username == username))
+        if result.first() is None:
             raise HTTPException(status_code=404, detail="收件人不存在")
-    db.close()
 
     from app.config import SMTP_USER
     sender_username = user_info.get("username")
     
-    # 优先使用客户端传入的文件名（用于附件绑定）；若未传入，尝试从最近上传的附件目录推断
-    mail_filename = request.mail_filename or MailStorageService.find_recent_attachment_mail_filename(sender_username)
+    # 客户端传入的文件名只用于定位已上传的附件；若未传入，尝试从最近上传的附件目录推断。
+    # 邮件本身总是使用服务端生成的邮件 ID，不复用客户端文件名，避免覆盖已有邮件
+    mail_filename = request.mail_filename or await asyncio.to_thread(
+        MailStorageService.find_recent_attachment_mail_filename, sender_username
+    )
+    if mail_filename:
+        _check_mail_filename(mail_filename)
+
+    # 附件拷贝到新邮件 ID 下，发件箱中的邮件与附件保持同名；来源目录保持不变（可能属于已有邮件）
+    saved_filename = new_mail_filename()
+    if mail_filename:
+        await asyncio.to_thread(
+            MailStorageService.copy_attachments, sender_username, mail_filename, sender_username, saved_filename
+        )
 
     # 准备附件（若存在）
-    attachments = MailStorageService.get_attachment_filepaths(sender_username, mail_filename) if mail_filename else []
+    attachments = await asyncio.to_thread(MailStorageService.get_attachment_filepaths, sender_username, saved_filename)
 
     # 根据收件人域名选择发送方式
     if domain == MAIL_DOMAIN:
         # 内部邮箱：直接保存到接收者邮箱目录
         from_addr = f"{sender_username}@{MAIL_DOMAIN}"
         
-        # 直接使用 MailStorageService 保存邮件，文件名可与附件保持一致
-        filepath = MailStorageService.save_mail(
-            to_addr=request.to_addr,
-            from_addr=from_addr,
-            subject=request.subject,
-            body=request.body,
-            filename=mail_filename
-        )
-        saved_filename = Path(filepath).name
-
-        # 将附件拷贝到收件人目录
+        # 先将附件拷贝到收件人目录，邮件登记时附件已就绪（附件数与附件名随之入索引）
         try:
-            MailStorageService.copy_attachments(
+            await asyncio.to_thread(
+                MailStorageService.copy_attachments,
                 src_username=sender_username,
                 src_mail_filename=saved_filename,
                 dst_username=username,
@@ -266,8 +646,19 @@ async def send_mail(
             # 附件拷贝失败不影响正文发送
             pass
 
+        # 直接使用 MailStorageService 保存邮件，文件名与附件保持一致
+        await asyncio.to_thread(
+            MailStorageService.save_mail,
+            to_addr=request.to_addr,
+            from_addr=from_addr,
+            subject=request.subject,
+            body=request.body,
+            filename=saved_filename
+        )
+
         # 记录发件箱
-        MailStorageService.save_sent_mail(
+        await asyncio.to_thread(
+            MailStorageService.save_sent_mail,
             from_addr=from_addr,
             to_addrs=[request.to_addr],
             subject=request.subject,
@@ -279,7 +670,8 @@ async def send_mail(
         
         return MessageResponse(
             success=True,
-            message=f"邮件已发送到 {request.to_addr}"
+            message=f"邮件已发送到 {request.to_addr}",
+            data={"filename": saved_filename}
         )
     else:
         # 外部邮箱：使用 SMTP 发送
@@ -301,23 +693,26 @@ async def send_mail(
             raise HTTPException(status_code=500, detail="邮件发送失败")
 
         # 记录发件箱
-        MailStorageService.save_sent_mail(
+        await asyncio.to_thread(
+            MailStorageService.save_sent_mail,
             from_addr=from_addr,
             to_addrs=[request.to_addr],
             subject=request.subject,
             body=request.body,
-            filename=mail_filename
+            filename=saved_filename
         )
 
         return MessageResponse(
             success=True,
-            message=f"邮件已通过 SMTP 协议发送到 {request.to_addr}"
+            message=f"邮件已通过 SMTP 协议发送到 {request.to_addr}",
+            data={"filename": saved_filename}
         )
 
 
 @router.post("/reply", response_model=MessageResponse)
 async def reply_mail(
     request: ReplyMailRequest,
+    db: AsyncSession = Depends(get_async_db),
     user_info: dict = Depends(verify_user_token)
 ):
     """
@@ -329,16 +724,12 @@ async def reply_mail(
         raise HTTPException(status_code=400, detail="收件人邮箱格式无效")
 
     # 允许回复到外部邮箱：仅当本域地址才校验存在性
-    db = SessionLocal()
     username = extract_username(request.to_addr)
     domain = request.to_addr.split("@")[-1].lower() if "@" in request.to_addr else ""
-    user = None
     if domain == MAIL_DOMAIN:
-        user = db.query(User).filter(User.username == username).first()
-        if not user:
-            db.close()
+        result = await db.execute(select(User.id).where(User.username == username))
+        if result.first() is None:
             raise HTTPException(status_code=404, detail="收件人不存在")
-    db.close()
 
     from app.config import SMTP_USER
     current_username = user_info.get("username")
@@ -361,7 +752,9 @@ async def reply_mail(
         # 收件箱邮件：直接使用文件名
         reply_to_filename = request.reply_to_filename
         # 尝试获取原邮件的主题（去掉"Re: "前缀）
-        original_subject = MailStorageService.get_original_mail_subject(current_username, reply_to_filename)
+        original_subject = await asyncio.to_thread(
+            MailStorageService.get_original_mail_subject, current_username, reply_to_filename
+        )
         if original_subject:
             # 如果找到了原主题，使用原主题（不添加"Re: "）
             pass  # original_subject已经是去掉"Re: "的主题
@@ -376,13 +769,25 @@ async def reply_mail(
         # 内部邮箱：直接保存到接收者邮箱
         from_addr = f"{current_username}@{MAIL_DOMAIN}"
         
-        filepath = MailStorageService.save_mail(
+        filepath = await asyncio.to_thread(
+            MailStorageService.save_mail,
             to_addr=request.to_addr,
             from_addr=from_addr,
             subject=original_subject,
             body=request.body,
             reply_to_filename=reply_to_filename
         )
+
+        # 记录发件箱（与收件人邮件同名，保证双方会话都能串联）
+        await asyncio.to_thread(
+            MailStorageService.save_sent_mail,
+            from_addr=from_addr,
+            to_addrs=[request.to_addr],
+            subject=original_subject,
+            body=request.body,
+            reply_to_filename=reply_to_filename,
+            filename=Path(filepath).name
+        )
         
         return MessageResponse(
             success=True,
@@ -413,87 +818,253 @@ async def reply_mail(
 
 # ==================== 附件相关 API ====================
 
+def _check_mail_filename(mail_filename: str) -> None:
+    """附件相关接口的邮件文件名只能是单层文件名，避免拼接出邮箱目录之外的路径"""
+    if not MailStorageService.is_valid_mail_filename(mail_filename):
+        raise HTTPException(status_code=400, detail="非法的邮件文件名")
+
+
+async def _check_attachment_target(username: str, mail_filename: str) -> None:
+    """上传附件的目标邮件名：合法，且已登记时必须是当前用户的邮件"""
+    _check_mail_filename(mail_filename)
+    if not await asyncio.to_thread(MailStorageService.is_attachment_target, username, mail_filename):
+        raise HTTPException(status_code=404, detail="邮件不存在")
+
+
+async def _iter_upload_file(file: UploadFile, chunk_size: int = 64 * 1024):
+    """按块读取上传文件"""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
 @router.post("/attachment/upload/{mail_filename}")
 async def upload_attachment(
     mail_filename: str,
     file: UploadFile = File(...),
     user_info: dict = Depends(verify_user_token)
 ):
-    """上传邮件附件（在发送邮件前上传，保存到临时目录）"""
+    """上传邮件附件（在发送邮件前上传；流式写入临时文件，完成后原子移入附件目录）"""
     username = user_info.get("username")
-    
-    # 限制文件大小：10MB
-    MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-    content = await file.read()
-    
-    if len(content) > MAX_FILE_SIZE:
-        raise HTTPException(status_code=413, detail=f"文件过大，最大限制 {MAX_FILE_SIZE / 1024 / 1024}MB")
-    
-    # 保存附件
+    await _check_attachment_target(username, mail_filename)
+
     try:
-        success = MailStorageService.save_attachment(
+        attachment = await UploadService.save_stream(
             username=username,
             mail_filename=mail_filename,
-            file_content=content,
-            original_filename=file.filename
+            original_filename=file.filename,
+            chunks=_iter_upload_file(file)
         )
-        
-        if not success:
-            raise Exception("保存失败")
-        
-        return {
-            "success": True,
-            "message": "附件已上传",
-            "filename": file.filename,
-            "size": len(content)
-        }
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"附件上传失败: {str(e)}")
 
+    AttachmentPipeline.submit(username, mail_filename, attachment["filename"])
+    return {
+        "success": True,
+        "message": "附件已上传",
+        "filename": attachment["filename"],
+        "size": attachment["size"],
+        "content_type": attachment["content_type"],
+        "sha256": attachment["sha256"]
+    }
+
+
+def _upload_session_response(session: dict) -> dict:
+    """续传会话状态响应"""
+    return {
+        "success": True,
+        "upload_id": session["upload_id"],
+        "mail_filename": session["mail_filename"],
+        "filename": session["filename"],
+        "size": session["total_size"],
+        "offset": session["offset"],
+        "chunk_size": UPLOAD_CHUNK_SIZE
+    }
+
+
+@router.post("/attachment/upload-session")
+async def create_upload_session(
+    request: CreateUploadSessionRequest,
+    user_info: dict = Depends(verify_user_token)
+):
+    """创建可续传的附件上传会话"""
+    username = user_info.get("username")
+    await _check_attachment_target(username, request.mail_filename)
+    try:
+        session = await asyncio.to_thread(UploadService.create_session, username, request.mail_filename, request.filename, request.size)
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return _upload_session_response(session)
+
+
+@router.get("/attachment/upload-session/{upload_id}")
+async def get_upload_session(upload_id: str, user_info: dict = Depends(verify_user_token)):
+    """查询上传会话（断线后据 offset 续传）"""
+    session = await asyncio.to_thread(UploadService.get_session, user_info.get("username"), upload_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="上传会话不存在")
+    return _upload_session_response(session)
+
+
+@router.put("/attachment/upload-session/{upload_id}")
+async def upload_session_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    user_info: dict = Depends(verify_user_token)
+):
+    """上传一个分块（请求体为原始字节），offset 必须等于服务端已接收的字节数"""
+    username = user_info.get("username")
+    try:
+        session, accepted = await UploadService.append_chunk(username, upload_id, offset, request.stream())
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    if not session:
+        raise HTTPException(status_code=404, detail="上传会话不存在")
+    if not accepted:
+        raise HTTPException(
+            status_code=409,
+            detail=f"偏移不一致，服务端已接收 {session['offset']} 字节",
+            headers={"Upload-Offset": str(session["offset"])}
+        )
+    return _upload_session_response(session)
+
+
+@router.post("/attachment/upload-session/{upload_id}/finalize")
+async def finalize_upload_session(upload_id: str, user_info: dict = Depends(verify_user_token)):
+    """完成上传：校验大小并原子移入附件目录"""
+    username = user_info.get("username")
+    try:
+        session = await asyncio.to_thread(UploadService.finalize_session, username, upload_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not session:
+        raise HTTPException(status_code=404, detail="上传会话不存在")
+    AttachmentPipeline.submit(username, session["mail_filename"], session["filename"])
+    return {
+        "success": True,
+        "message": "附件已上传",
+        "filename": session["filename"],
+        "size": session["total_size"],
+        "content_type": session["content_type"],
+        "sha256": session["sha256"]
+    }
+
+
+@router.delete("/attachment/upload-session/{upload_id}", response_model=MessageResponse)
+async def abort_upload_session(upload_id: str, user_info: dict = Depends(verify_user_token)):
+    """取消上传会话"""
+    if not await asyncio.to_thread(UploadService.abort_session, user_info.get("username"), upload_id):
+        raise HTTPException(status_code=404, detail="上传会话不存在")
+    return MessageResponse(success=True, message="上传已取消")
+
 
 @router.get("/attachment/{mail_filename}/{attachment_filename}")
 async def download_attachment(
     mail_filename: str,
     attachment_filename: str,
+    request: Request,
+    inline: bool = False,
     user_info: dict = Depends(verify_user_token)
 ):
-    """下载邮件附件"""
+    """
+    下载邮件附件（支持 Range 断点续传与 ETag/If-Modified-Since 条件请求）
+
+    Content-Type 取自上传时识别并记录在附件清单中的类型；inline=true 时供浏览器直接预览。
+    压缩存储的附件对接受 gzip 的客户端原样返回并带 Content-Encoding，否则边读边解压（同样支持 Range 与条件请求）。
+    """
+    _check_mail_filename(mail_filename)
     username = user_info.get("username")
-    
-    # 读取附件
-    content = MailStorageService.read_attachment(
+
+    filepath = await asyncio.to_thread(
+        MailStorageService.get_attachment_path,
         username=username,
         mail_filename=mail_filename,
         attachment_filename=attachment_filename
     )
-    
-    if not content:
+    if not filepath:
         raise HTTPException(status_code=404, detail="附件不存在")
-    
-    # 返回文件
-    attach_dir = MailStorageService.get_attachment_dir(username, mail_filename)
-    filepath = attach_dir / attachment_filename
-    
-    return FileResponse(
+
+    info = await asyncio.to_thread(MailStorageService.get_attachment_info, username, mail_filename, attachment_filename)
+    media_type = info["content_type"] if info else "application/octet-stream"
+    disposition = "inline" if inline else "attachment"
+    stat_result = await asyncio.to_thread(filepath.stat)
+    encoding = MailStorageService.stored_encoding(info, stat_result.st_size)
+
+    if encoding == "gzip" and not accepts_encoding(request.headers.get("accept-encoding"), encoding):
+        return GzipDecodedFileResponse(
+            path=filepath,
+            request_headers=request.headers,
+            stat_result=stat_result,
+            decoded_size=info["size"],
+            media_type=media_type,
+            headers={
+                "Content-Disposition": f"{disposition}; filename*=utf-8''{quote(attachment_filename)}",
+                "Vary": "Accept-Encoding"
+            }
+        )
+
+    headers = {"Content-Encoding": encoding, "Vary": "Accept-Encoding"} if encoding else None
+    return RangeFileResponse(
         path=filepath,
+        request_headers=request.headers,
+        stat_result=stat_result,
         filename=attachment_filename,
-        media_type="application/octet-stream"
+        media_type=media_type,
+        headers=headers,
+        content_disposition_type=disposition
+    )
+
+
+@router.get("/attachment/{mail_filename}/{attachment_filename}/preview")
+async def preview_attachment(
+    mail_filename: str,
+    attachment_filename: str,
+    request: Request,
+    user_info: dict = Depends(verify_user_token)
+):
+    """获取图片附件的缩略图（JPEG），上传后由后台生成，尚未生成或非图片时返回 404"""
+    _check_mail_filename(mail_filename)
+    username = user_info.get("username")
+    info = await asyncio.to_thread(MailStorageService.get_attachment_info, username, mail_filename, attachment_filename)
+    preview_path = MailStorageService.get_attachment_preview_path(username, mail_filename, attachment_filename)
+    if not info or not info.get("preview") or not preview_path.is_file():
+        raise HTTPException(status_code=404, detail="附件预览不存在")
+
+    return RangeFileResponse(
+        path=preview_path,
+        request_headers=request.headers,
+        stat_result=preview_path.stat(),
+        media_type="image/jpeg"
     )
 
 
 @router.get("/attachments/{mail_filename}")
 async def get_attachments(
     mail_filename: str,
+    request: Request,
+    response: Response,
     user_info: dict = Depends(verify_user_token)
 ):
-    """获取邮件的所有附件信息"""
+    """获取邮件的所有附件信息（带附件清单版本 ETag，支持 304）"""
+    _check_mail_filename(mail_filename)
     username = user_info.get("username")
-    
-    attachments = MailStorageService.get_attachments(
-        username=username,
-        mail_filename=mail_filename
-    )
-    
+    version = await asyncio.to_thread(MailStorageService.get_attachments_version, username, mail_filename)
+    etag = version_etag("attachments", mail_filename, version)
+    cached = not_modified(request.headers, etag)
+    if cached is not None:
+        return cached
+
+    attachments = await asyncio.to_thread(MailStorageService.get_attachments, username, mail_filename)
+    # 旧附件目录首次访问时才生成清单，此时版本随之变化
+    version = await asyncio.to_thread(MailStorageService.get_attachments_version, username, mail_filename)
+    etag = version_etag("attachments", mail_filename, version)
+    set_cache_headers(response, etag)
     return {
         "success": True,
         "filename": mail_filename,
@@ -506,7 +1077,7 @@ async def get_attachments(
 async def get_pop3_filename(index: int, user_info: dict = Depends(verify_user_token)):
     """将 POP3 序号映射为当前用户的实际文件名（用于前端加载附件）"""
     username = user_info.get("username")
-    mails = MailStorageService.list_user_mails(username)
+    mails = await asyncio.to_thread(MailStorageService.list_user_mails, username)
     if index <= 0 or index > len(mails):
         raise HTTPException(status_code=404, detail="邮件不存在")
     filename = mails[index - 1]["filename"]
@@ -515,3 +1086,55 @@ async def get_pop3_filename(index: int, user_info: dict = Depends(verify_user_to
         "filename": filename
     }
 
+
+# ============ 外部 IMAP 邮箱 ============
+
+@router.get("/imap-accounts")
+async def list_imap_accounts(user_info: dict = Depends(verify_user_token)):
+    """列出当前用户绑定的外部 IMAP 邮箱及同步状态"""
+    accounts = await asyncio.to_thread(ImapSyncService.list_accounts, user_info.get("username"))
+    return {
+        "success": True,
+        "count": len(accounts),
+        "accounts": [ImapSyncService.account_to_dict(a) for a in accounts]
+    }
+
+
+@router.post("/imap-accounts")
+async def add_imap_account(request: CreateImapAccountRequest, user_info: dict = Depends(verify_user_token)):
+    """绑定外部 IMAP 邮箱，新邮件将同步到当前用户的收件箱（服务器地址校验含 DNS 解析，在线程中执行）"""
+    try:
+        account = await asyncio.to_thread(
+            ImapSyncService.add_account,
+            owner=user_info.get("username"),
+            host=request.host,
+            username=request.username,
+            password=request.password,
+            port=request.port,
+            use_ssl=request.use_ssl,
+            mailbox=request.mailbox,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "success": True,
+        "account": ImapSyncService.account_to_dict(account)
+    }
+
+
+@router.delete("/imap-accounts/{account_id}", response_model=MessageResponse)
+async def delete_imap_account(account_id: int, user_info: dict = Depends(verify_user_token)):
+    """解绑外部 IMAP 邮箱（已同步的邮件保留）"""
+    if not await asyncio.to_thread(ImapSyncService.delete_account, account_id, owner=user_info.get("username")):
+        raise HTTPException(status_code=404, detail="外部邮箱不存在")
+    return MessageResponse(success=True, message="外部邮箱已解绑")
+
+
+@router.post("/imap-accounts/{account_id}/sync", response_model=MessageResponse)
+async def sync_imap_account(account_id: int, user_info: dict = Depends(verify_user_token)):
+    """立即同步外部 IMAP 邮箱（在下一次调度时执行）"""
+    owned = {a.id for a in await asyncio.to_thread(ImapSyncService.list_accounts, user_info.get("username"))}
+    if account_id not in owned:
+        raise HTTPException(status_code=404, detail="外部邮箱不存在")
+    ImapSyncService.request_sync(account_id)
+    return MessageResponse(success=True, message="已加入同步队列")
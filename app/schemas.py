@@ -3,7 +3,7 @@ Pydantic 数据模型 - 请求/响应数据结构
 """
 from pydantic import BaseModel
 from pydantic import EmailStr
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 
 
@@ -101,6 +101,13 @@ class AttachmentInfo(BaseModel):
     content_type: str
 
 
+class CreateUploadSessionRequest(BaseModel):
+    """创建续传上传会话请求"""
+    mail_filename: str
+    filename: str
+    size: int  # 文件总字节数
+
+
 class MailDetailResponse(BaseModel):
     """邮件详情响应（含附件）"""
     success: bool
@@ -119,6 +126,45 @@ class ReplyMailRequest(BaseModel):
     reply_to_filename: str  # 回复的原始邮件文件名（收件箱邮件）或mailId（POP3邮件）
     is_pop3_mail: bool = False  # 是否是POP3邮件（通过mailId标识）
 
+class UpdateMailFlagsRequest(BaseModel):
+    """更新邮件标记请求（Maildir 标记字母：S 已读、F 加星、R 已回复等）"""
+    add: str = ""
+    remove: str = ""
+    folder: str = "inbox"  # inbox 或 sent
+
+
+class BatchMailRequest(BaseModel):
+    """批量操作请求（邮件文件名列表）"""
+    filenames: List[str]
+    folder: str = "inbox"  # inbox 或 sent
+
+
+class BatchMailFlagsRequest(BatchMailRequest):
+    """批量更新标记请求（add="S" 批量标为已读）"""
+    add: str = ""
+    remove: str = ""
+
+
+class BatchMoveMailRequest(BatchMailRequest):
+    """批量移动邮件请求"""
+    target_folder: str
+
+
+class BatchReadMailRequest(BatchMailRequest):
+    """批量读取邮件请求"""
+    mark_read: bool = True  # 与 /mail/read 一致，读取后标为已读
+
+
+class CreateImapAccountRequest(BaseModel):
+    """绑定外部 IMAP 邮箱请求"""
+    host: str
+    username: str
+    password: str
+    port: int = 993
+    use_ssl: bool = True
+    mailbox: str = "INBOX"
+
+
 class SaveDraftRequest(BaseModel):
     """保存草稿请求"""
     to_addr: str
@@ -0,0 +1,104 @@
+"""
+附件后处理 - 上传完成后在线程池中压缩存储可压缩附件、生成图片缩略图
+
+处理结果通过附件清单登记（encoding/stored_size/preview），不阻塞上传请求。
+"""
+import gzip
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from app.config import ATTACHMENT_PIPELINE_WORKERS, ATTACHMENT_COMPRESS_MIN_BYTES, ATTACHMENT_THUMBNAIL_SIZE
+from app.services.log_service import LogService
+from app.services.mail_storage import MailStorageService
+from app.services.upload_service import UploadService
+
+# Pillow 已列入 requirements.txt；未安装时不生成缩略图（启动时记录日志）
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class AttachmentPipeline:
+    """附件后处理服务"""
+
+    COMPRESSIBLE_TYPES = {
+        "application/json",
+        "application/xml",
+        "application/javascript",
+        "application/x-yaml",
+        "image/svg+xml",
+    }
+    PREVIEW_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp", "image/bmp"}
+    # 压缩后至少节省的比例，达不到时保留原文件
+    MIN_SAVING_RATIO = 0.1
+
+    _executor = ThreadPoolExecutor(max_workers=ATTACHMENT_PIPELINE_WORKERS, thread_name_prefix="attachment")
+
+    @staticmethod
+    def is_compressible(content_type: str) -> bool:
+        """文本类（text/*、JSON、XML 等）附件可压缩存储"""
+        return content_type.startswith("text/") or content_type in AttachmentPipeline.COMPRESSIBLE_TYPES
+
+    @staticmethod
+    def previews_enabled() -> bool:
+        """是否能生成图片缩略图（Pillow 已安装）"""
+        return Image is not None
+
+    @staticmethod
+    def submit(username: str, mail_filename: str, attachment_filename: str) -> None:
+        """提交附件后处理任务（立即返回）"""
+        AttachmentPipeline._executor.submit(AttachmentPipeline.process, username, mail_filename, attachment_filename)
+
+    @staticmethod
+    def process(username: str, mail_filename: str, attachment_filename: str) -> None:
+        """处理单个附件：图片生成缩略图，文本类附件压缩存储"""
+        try:
+            info = MailStorageService.get_attachment_info(username, mail_filename, attachment_filename)
+            if not info or info.get("encoding"):
+                return
+            if info["content_type"] in AttachmentPipeline.PREVIEW_TYPES:
+                AttachmentPipeline._make_preview(username, mail_filename, info)
+            elif AttachmentPipeline.is_compressible(info["content_type"]) and info["size"] >= ATTACHMENT_COMPRESS_MIN_BYTES:
+                AttachmentPipeline._compress(username, mail_filename, info)
+        except Exception as e:
+            LogService.log_system(f"附件后处理失败: {username}/{mail_filename}/{attachment_filename}, 错误: {e}")
+
+    @staticmethod
+    def _compress(username: str, mail_filename: str, info: dict) -> None:
+        """gzip 压缩到临时文件，节省足够空间时替换原附件"""
+        filepath = MailStorageService.get_attachment_dir(username, mail_filename) / info["filename"]
+        temp_path = UploadService.ensure_upload_dir(username) / f"{uuid.uuid4().hex}.gz"
+        try:
+            with open(filepath, "rb") as src, gzip.open(temp_path, "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst)
+            stored_size = temp_path.stat().st_size
+            if stored_size > info["size"] * (1 - AttachmentPipeline.MIN_SAVING_RATIO):
+                return
+            MailStorageService.replace_attachment_content(
+                username, mail_filename, info["filename"], info["sha256"], temp_path,
+                {"encoding": "gzip", "stored_size": stored_size}
+            )
+        finally:
+            temp_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _make_preview(username: str, mail_filename: str, info: dict) -> None:
+        """生成 JPEG 缩略图（最长边不超过 ATTACHMENT_THUMBNAIL_SIZE）"""
+        if Image is None:
+            return
+        filepath = MailStorageService.get_attachment_dir(username, mail_filename) / info["filename"]
+        preview_path = MailStorageService.get_attachment_preview_path(username, mail_filename, info["filename"])
+        preview_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = preview_path.with_name(f".{uuid.uuid4().hex}.tmp")
+        try:
+            with Image.open(filepath) as img:
+                img.thumbnail((ATTACHMENT_THUMBNAIL_SIZE, ATTACHMENT_THUMBNAIL_SIZE))
+                img.convert("RGB").save(temp_path, "JPEG", quality=80)
+            temp_path.replace(preview_path)
+            if not MailStorageService.replace_attachment_content(
+                username, mail_filename, info["filename"], info["sha256"], None, {"preview": True}
+            ):
+                preview_path.unlink(missing_ok=True)
+        finally:
+            temp_path.unlink(missing_ok=True)
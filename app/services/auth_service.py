@@ -3,6 +3,7 @@
 """
 import uuid
 from typing import Optional
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from app.models import User
 from app.schemas import TokenResponse
@@ -121,26 +122,54 @@ class AuthService:
             role=user.role
         )
     
+    @staticmethod
+    def _decode_token(token: str) -> dict:
+        """解码 JWT 并返回载荷中的用户信息（签名/过期校验失败时抛出异常）"""
+        decoded = jwt.decode(token, TOKEN_SECRET, algorithms=[TOKEN_ALGORITHM])
+        return {
+            "user_id": int(decoded.get("sub")),
+            "username": decoded.get("username"),
+            "role": decoded.get("role"),
+        }
+
     @staticmethod
     def verify_token(token: str) -> Optional[dict]:
         """验证 JWT Token：签名、过期与用户状态"""
         try:
-            decoded = jwt.decode(token, TOKEN_SECRET, algorithms=[TOKEN_ALGORITHM])
-            user_id = int(decoded.get("sub"))
-            username = decoded.get("username")
-            role = decoded.get("role")
+            user_info = AuthService._decode_token(token)
 
             # 验证用户状态（禁用/删除）
             from app.db import SessionLocal
             db = SessionLocal()
             try:
-                user = db.query(User).filter(User.id == user_id).first()
+                user = db.query(User).filter(User.id == user_info["user_id"]).first()
                 if not user or user.is_disabled == 1:
                     return None
             finally:
                 db.close()
 
-            return {"user_id": user_id, "username": username, "role": role}
+            return user_info
+        except jwt.ExpiredSignatureError:
+            return None
+        except Exception:
+            return None
+
+    @staticmethod
+    async def verify_token_async(token: str) -> Optional[dict]:
+        """验证 JWT Token（异步版本，用户状态查询走异步会话，不阻塞事件循环）"""
+        try:
+            user_info = AuthService._decode_token(token)
+
+            from app.db import AsyncSessionLocal
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(User.is_disabled).where(User.id == user_info["user_id"])
+                )
+                row = result.first()
+            if row is None or row.is_disabled == 1:
+                return None
+
+            return user_info
         except jwt.ExpiredSignatureError:
             return None
         except Exception:
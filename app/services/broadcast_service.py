@@ -0,0 +1,137 @@
+"""
+群发服务 - 后台分批投递群发邮件，支持进度查询与取消
+"""
+import asyncio
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import select, func
+from app.config import MAIL_DOMAIN, BROADCAST_CHUNK_SIZE, BROADCAST_WORKERS
+from app.db import AsyncSessionLocal
+from app.models import User
+from app.services.log_service import LogService
+from app.services.mail_storage import MailStorageService
+
+
+class BroadcastService:
+    """群发服务"""
+
+    # 群发任务状态（内存级，按 job_id）
+    jobs: dict[str, dict] = {}
+    # 持有运行中的任务引用，防止被回收
+    _tasks: dict[str, asyncio.Task] = {}
+    _executor = ThreadPoolExecutor(max_workers=BROADCAST_WORKERS, thread_name_prefix="broadcast")
+
+    @staticmethod
+    def _user_filter(stmt, user_ids: Optional[list[int]]):
+        """按指定用户ID过滤（为空时表示所有用户）"""
+        if user_ids:
+            stmt = stmt.where(User.id.in_(user_ids))
+        return stmt
+
+    @staticmethod
+    async def count_recipients(user_ids: Optional[list[int]] = None) -> int:
+        """统计群发收件人数量"""
+        stmt = BroadcastService._user_filter(select(func.count(User.id)), user_ids)
+        async with AsyncSessionLocal() as db:
+            return (await db.execute(stmt)).scalar() or 0
+
+    @staticmethod
+    async def _iter_username_chunks(user_ids: Optional[list[int]]):
+        """按用户ID分批读取用户名（键集分页，不一次性加载所有用户）"""
+        last_id = 0
+        while True:
+            stmt = BroadcastService._user_filter(
+                select(User.id, User.username).where(User.id > last_id), user_ids
+            ).order_by(User.id).limit(BROADCAST_CHUNK_SIZE)
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(stmt)).all()
+            if not rows:
+                return
+            last_id = rows[-1].id
+            yield [row.username for row in rows]
+
+    @staticmethod
+    def _deliver_chunk(to_addrs: list[str], from_addr: str, subject: str, body: str) -> tuple[int, int]:
+        """投递一批邮件（在线程池中执行），返回 (成功数, 失败数)"""
+        try:
+            sent = MailStorageService.save_mail_batch(to_addrs, from_addr, subject, body)
+            return sent, len(to_addrs) - sent
+        except Exception as e:
+            LogService.log_system(f"群发批次投递失败（{len(to_addrs)} 封）: {e}")
+            return 0, len(to_addrs)
+
+    @staticmethod
+    def start_job(from_addr: str, subject: str, body: str, user_ids: Optional[list[int]], total: int) -> dict:
+        """创建并在后台启动群发任务"""
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": "pending",  # pending, running, completed, cancelled, failed
+            "total": total,
+            "sent": 0,
+            "failed": 0,
+            "cancel_requested": False,
+            "error": None,
+            "created_at": datetime.now(),
+            "finished_at": None,
+        }
+        BroadcastService.jobs[job_id] = job
+        BroadcastService._tasks[job_id] = asyncio.create_task(
+            BroadcastService._run_job(job, from_addr, subject, body, user_ids)
+        )
+        return job
+
+    @staticmethod
+    async def _run_job(job: dict, from_addr: str, subject: str, body: str, user_ids: Optional[list[int]]):
+        """后台执行群发：分批读取用户，最多 BROADCAST_WORKERS 个批次并行写入"""
+        loop = asyncio.get_running_loop()
+        pending = set()
+
+        def collect(done):
+            for future in done:
+                sent, failed = future.result()
+                job["sent"] += sent
+                job["failed"] += failed
+
+        job["status"] = "running"
+        try:
+            async for usernames in BroadcastService._iter_username_chunks(user_ids):
+                if job["cancel_requested"]:
+                    break
+                to_addrs = [f"{username}@{MAIL_DOMAIN}" for username in usernames]
+                pending.add(loop.run_in_executor(
+                    BroadcastService._executor,
+                    BroadcastService._deliver_chunk, to_addrs, from_addr, subject, body
+                ))
+                if len(pending) >= BROADCAST_WORKERS:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    collect(done)
+            # 等待已提交的批次完成（取消时不再提交新批次）
+            if pending:
+                done, pending = await asyncio.wait(pending)
+                collect(done)
+            job["status"] = "cancelled" if job["cancel_requested"] else "completed"
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+        finally:
+            job["finished_at"] = datetime.now()
+            BroadcastService._tasks.pop(job["job_id"], None)
+            LogService.log_system(
+                f"群发任务 {job['job_id']} {job['status']}: 成功 {job['sent']}, 失败 {job['failed']}, 共 {job['total']}"
+            )
+
+    @staticmethod
+    def get_job(job_id: str) -> Optional[dict]:
+        """获取群发任务状态"""
+        return BroadcastService.jobs.get(job_id)
+
+    @staticmethod
+    def cancel_job(job_id: str) -> Optional[dict]:
+        """请求取消群发任务（已提交的批次会完成，之后不再投递）"""
+        job = BroadcastService.jobs.get(job_id)
+        if job and job["status"] in ("pending", "running"):
+            job["cancel_requested"] = True
+        return job
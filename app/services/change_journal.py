@@ -0,0 +1,108 @@
+"""
+邮件变更日志 - 客户端增量同步（/mail/sync?since=N）
+
+MailStorageService 在写入、删除、修改标记的同一事务中追加日志，变更序号即 mail_changes.id
+（全局递增，对每个用户也单调递增）。客户端保存上次同步返回的 cursor，下次只取之后的变更，
+刷新代价与变更数成正比，与邮箱大小无关。
+
+日志在建表时以现有邮件的 add 变更作为起点，since=0 即从头同步。超过保留期的日志由后台任务压缩，
+并记录每个用户已清理到的序号（水位）；since 低于水位或超出当前最大序号时，客户端须全量同步（重新获取列表）。
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app.db import SessionLocal
+from app.models import MailChange, MailChangeFloor
+
+
+class ChangeJournal:
+    """邮件变更日志"""
+
+    ACTIONS = ("add", "delete", "flags")
+
+    @staticmethod
+    def record(db, owner: str, folder: str, filename: str, action: str, flags: str = "") -> None:
+        """在当前事务中追加一条变更，调用方负责提交"""
+        ChangeJournal.record_many(db, [(owner, folder, filename, action, flags)])
+
+    @staticmethod
+    def record_many(db, changes: list[tuple]) -> None:
+        """批量追加变更：[(owner, folder, filename, action, flags)]"""
+        if not changes:
+            return
+        now = datetime.utcnow()
+        db.execute(MailChange.__table__.insert(), [
+            {
+                "owner": owner,
+                "folder": folder,
+                "filename": filename,
+                "action": action,
+                "flags": flags or "",
+                "created_at": now,
+            }
+            for owner, folder, filename, action, flags in changes
+        ])
+
+    @staticmethod
+    def changes_since(owner: str, since: int, limit: int = 500) -> dict:
+        """
+        读取 since 之后的变更，同一封邮件的多次变更合并为最终状态（按最后一次变更的序号排序）
+
+        合并规则：新增后又修改标记仍为 add；最后一次为删除则为 delete；否则为 flags。
+
+        Returns:
+            {"full_resync": bool, "cursor": int, "has_more": bool, "changes": [{seq, action, folder, filename, flags}]}
+            full_resync 为 True 时 cursor 为当前最大序号，客户端应先记下 cursor 再重新获取列表
+        """
+        with SessionLocal() as db:
+            head = db.query(func.max(MailChange.id)).scalar() or 0
+            floor = db.query(MailChangeFloor.compacted_seq).filter(MailChangeFloor.owner == owner).scalar() or 0
+            if since < floor or since > head:
+                return {"full_resync": True, "cursor": head, "has_more": False, "changes": []}
+
+            rows = db.query(MailChange).filter(
+                MailChange.owner == owner,
+                MailChange.id > since
+            ).order_by(MailChange.id).limit(limit + 1).all()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        merged = {}
+        for row in rows:
+            key = (row.folder, row.filename)
+            action = row.action
+            previous = merged.pop(key, None)
+            if action == "flags" and previous is not None and previous["action"] == "add":
+                action = "add"
+            merged[key] = {
+                "seq": row.id,
+                "action": action,
+                "folder": row.folder,
+                "filename": row.filename,
+                "flags": row.flags or "",
+            }
+        # 没有本用户的变更时游标推进到全局最大序号，之后的变更序号都更大
+        cursor = rows[-1].id if rows else max(since, head)
+        return {"full_resync": False, "cursor": cursor, "has_more": has_more, "changes": list(merged.values())}
+
+    @staticmethod
+    def compact(retention_days: int) -> int:
+        """清理早于保留期的变更并抬高各用户水位，返回清理条数"""
+        cutoff = datetime.utcnow() - timedelta(days=retention_days)
+        deleted = 0
+        with SessionLocal() as db:
+            floors = db.query(MailChange.owner, func.max(MailChange.id)).filter(
+                MailChange.created_at < cutoff
+            ).group_by(MailChange.owner).all()
+            for owner, seq in floors:
+                floor = db.get(MailChangeFloor, owner)
+                if floor is None:
+                    db.add(MailChangeFloor(owner=owner, compacted_seq=seq))
+                else:
+                    floor.compacted_seq = max(floor.compacted_seq, seq)
+                # 按序号删除，与水位保持一致
+                deleted += db.query(MailChange).filter(
+                    MailChange.owner == owner,
+                    MailChange.id <= seq
+                ).delete(synchronize_session=False)
+            db.commit()
+        return deleted
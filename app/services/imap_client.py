@@ -1,9 +1,20 @@
 """
 IMAP 客户端 - 从外部邮箱（如163）同步邮件到本地
+
+按 UID 增量同步：imap_sync_state 表记录每个账号文件夹的 UIDVALIDITY 与已同步的最大 UID，
+每次只 UID SEARCH 一次取得新邮件 UID，再按 IMAP_SYNC_BATCH_SIZE 分批 UID FETCH，
+使用 BODY.PEEK[] 不改变服务器上的已读状态。UIDVALIDITY 变化时从头重新同步。
+
+客户端可保持连接（keep_alive），供支持 IDLE 的服务器在同步后进入 IDLE 等待新邮件。
 """
 import imaplib
-import email
-from email.header import decode_header
+import ipaddress
+import re
+import select
+import socket
+import ssl
+import threading
+import time
 from datetime import datetime
 from app.config import (
     IMAP_HOST,
@@ -11,34 +22,206 @@ from app.config import (
     IMAP_USER,
     IMAP_PASS,
     IMAP_USE_SSL,
-    IMAP_SYNC_ENABLED,
     IMAP_SYNC_TO_USER,
+    IMAP_SYNC_BATCH_SIZE,
+    IMAP_ALLOWED_HOSTS,
+    IMAP_ALLOWED_PORTS,
+    MAIL_DOMAIN,
 )
+from app.db import SessionLocal
+from app.models import ImapSyncState
 from app.services.log_service import LogService
-from app.services.mail_storage import MailStorageService
+from app.services.mime_ingest import MimeParser, MimeIngestService
+from app.utils.credential_cipher import decrypt_secret
+
+_UID_RE = re.compile(rb"UID (\d+)")
+
+
+def check_imap_endpoint(host: str, port: int) -> None:
+    """
+    校验外部 IMAP 服务器地址，不允许时抛出 ValueError（防止借同步功能访问内网服务）
+
+    .env 中配置的服务器（IMAP_HOST）由管理员指定，直接放行；其余服务器端口须在 IMAP_ALLOWED_PORTS 内。
+    配置了 IMAP_ALLOWED_HOSTS 时只允许白名单内的服务器，否则域名解析出的所有地址都必须是公网地址。
+    """
+    host = (host or "").strip().lower()
+    if not host:
+        raise ValueError("服务器地址不能为空")
+    if IMAP_HOST and host == IMAP_HOST.strip().lower():
+        return
+    if port not in IMAP_ALLOWED_PORTS:
+        raise ValueError(f"不允许的端口: {port}")
+    if IMAP_ALLOWED_HOSTS:
+        if host not in IMAP_ALLOWED_HOSTS:
+            raise ValueError("该服务器不在允许的外部邮箱服务器列表中")
+        return
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        raise ValueError("无法解析服务器地址")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            raise ValueError("不允许连接内网、回环或保留地址")
 
 
 class IMAPClient:
-    """IMAP 客户端 - 用于从外部邮箱同步邮件"""
+    """IMAP 客户端 - 用于从外部邮箱同步邮件（默认使用 .env 中配置的账号）"""
+
+    # IDLE 等待期间检查停止信号的间隔（秒）
+    IDLE_POLL_SECONDS = 1
+
+    def __init__(
+        self,
+        host: str = None,
+        port: int = None,
+        user: str = None,
+        password: str = None,
+        use_ssl: bool = None,
+        to_user: str = None,
+        mailbox: str = "INBOX",
+    ):
+        self.host = host or IMAP_HOST
+        self.port = port or IMAP_PORT or 993
+        self.user = user or IMAP_USER
+        self.password = password or IMAP_PASS
+        self.use_ssl = IMAP_USE_SSL if use_ssl is None else use_ssl
+        self.to_user = to_user or IMAP_SYNC_TO_USER
+        self.mailbox = mailbox or "INBOX"
+        self.batch_size = max(1, IMAP_SYNC_BATCH_SIZE)
+        self.last_error = None
+        self._conn = None
+        self._capabilities = ()
+
+    @classmethod
+    def from_account(cls, account) -> "IMAPClient":
+        """由 imap_accounts 表记录创建客户端"""
+        return cls(
+            host=account.host,
+            port=account.port,
+            user=account.username,
+            password=decrypt_secret(account.password),
+            use_ssl=bool(account.use_ssl),
+            to_user=account.owner,
+            mailbox=account.mailbox,
+        )
+
+    @property
+    def account(self) -> str:
+        return f"{self.user}@{self.host}"
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None
+
+    @property
+    def supports_idle(self) -> bool:
+        """已连接的服务器是否支持 IDLE（RFC 2177）"""
+        return self._conn is not None and "IDLE" in self._capabilities
+
+    def _load_state(self) -> tuple[int | None, int]:
+        """读取同步进度 (UIDVALIDITY, 已同步的最大 UID)"""
+        with SessionLocal() as db:
+            state = db.get(ImapSyncState, (self.account, self.mailbox))
+            if state is None:
+                return None, 0
+            return state.uidvalidity, state.last_uid or 0
+
+    def _save_state(self, uidvalidity: int, last_uid: int) -> None:
+        """保存同步进度"""
+        with SessionLocal() as db:
+            state = db.get(ImapSyncState, (self.account, self.mailbox))
+            if state is None:
+                state = ImapSyncState(account=self.account, mailbox=self.mailbox)
+                db.add(state)
+            state.uidvalidity = uidvalidity
+            state.last_uid = last_uid
+            state.last_synced_at = datetime.now()
+            db.commit()
+
+    def _connect(self):
+        """连接并登录 IMAP 服务器（已有可用连接时直接复用）"""
+        if self._conn is not None:
+            try:
+                if self._conn.noop()[0] == "OK":
+                    return self._conn
+            except (imaplib.IMAP4.error, OSError):
+                pass
+            self.close()
+
+        # 连接前按当时的解析结果再校验一次（域名可能在绑定后改指向内网地址）
+        try:
+            check_imap_endpoint(self.host, self.port)
+        except ValueError as e:
+            raise imaplib.IMAP4.error(str(e))
+        if self.use_ssl:
+            mail = imaplib.IMAP4_SSL(self.host, self.port)
+        else:
+            mail = imaplib.IMAP4(self.host, self.port)
+        try:
+            mail.login(self.user, self.password)
+            # 部分服务器登录后才公布完整能力列表
+            status, data = mail.capability()
+            if status == "OK" and data and data[0]:
+                self._capabilities = tuple(data[0].decode("ascii", "ignore").upper().split())
+            else:
+                self._capabilities = tuple(mail.capabilities)
+        except BaseException:
+            try:
+                mail.shutdown()
+            except Exception:
+                pass
+            raise
+        self._conn = mail
+        return mail
 
-    def __init__(self):
-        self.host = IMAP_HOST
-        self.port = IMAP_PORT or 993
-        self.user = IMAP_USER
-        self.password = IMAP_PASS
-        self.use_ssl = IMAP_USE_SSL
+    def close(self) -> None:
+        """登出并关闭连接"""
+        mail, self._conn = self._conn, None
+        if mail is None:
+            return
+        try:
+            mail.logout()
+        except Exception:
+            pass
 
-    def sync_new_mails(self) -> tuple[int, int]:
+    @staticmethod
+    def _parse_fetch(msg_data: list) -> list[tuple[int, bytes]]:
         """
-        同步新邮件到本地用户收件箱
-        
-        Returns:
-            (成功数, 失败数)
+        解析 UID FETCH (UID BODY.PEEK[]) 的响应，返回 [(UID, 原始邮件)]
+
+        服务器返回的 UID 可能在字面量之前（"1 (UID 5 BODY[] {n}"）或之后（" UID 5)"）
         """
-        if not IMAP_SYNC_ENABLED:
-            return 0, 0
+        messages = []
+        for i, item in enumerate(msg_data):
+            if not isinstance(item, tuple):
+                continue
+            match = _UID_RE.search(item[0])
+            if match is None and i + 1 < len(msg_data) and isinstance(msg_data[i + 1], bytes):
+                match = _UID_RE.search(msg_data[i + 1])
+            if match:
+                messages.append((int(match.group(1)), item[1]))
+        return messages
+
+    def _save_message(self, raw_email: bytes) -> str:
+        """解析原始邮件（正文、HTML、附件）并保存到本地用户收件箱，返回主题"""
+        parsed = MimeParser.parse_bytes(raw_email)
+        MimeIngestService.save_inbox(parsed, f"{self.to_user}@{MAIL_DOMAIN}", parsed.from_addr)
+        return parsed.subject
 
+    def sync_new_mails(self, keep_alive: bool = False) -> tuple[int, int]:
+        """
+        增量同步新邮件到本地用户收件箱（阻塞调用，异步环境中应在线程中执行）
+
+        Args:
+            keep_alive: 同步后保持连接（用于随后进入 IDLE），否则登出
+
+        Returns:
+            (成功数, 失败数)；连接或协议错误记录在 last_error 中
+        """
+        self.last_error = None
         if not all([self.host, self.user, self.password]):
+            self.last_error = "配置不完整"
             LogService.log_system("IMAP同步: 配置不完整，跳过")
             return 0, 0
 
@@ -46,150 +229,137 @@ class IMAPClient:
         fail_count = 0
 
         try:
-            # 连接 IMAP 服务器
-            if self.use_ssl:
-                mail = imaplib.IMAP4_SSL(self.host, self.port)
-            else:
-                mail = imaplib.IMAP4(self.host, self.port)
-
-            # 登录
-            mail.login(self.user, self.password)
-            LogService.log_system(f"IMAP登录成功: {self.user}@{self.host}")
+            mail = self._connect()
+        except (imaplib.IMAP4.error, OSError) as e:
+            self.last_error = f"连接/认证失败: {e}"
+            LogService.log_system(f"IMAP连接/认证失败: {self.account}, {e}")
+            return 0, 0
 
-            # 选择收件箱（必须在login后执行）
-            status, _ = mail.select("INBOX")
+        try:
+            # 只读方式选择文件夹，同步不影响服务器上的邮件状态
+            status, _ = mail.select(self.mailbox, readonly=True)
             if status != "OK":
-                LogService.log_system("IMAP选择收件箱失败")
-                mail.logout()
+                self.last_error = f"选择文件夹 {self.mailbox} 失败"
+                LogService.log_system(f"IMAP选择文件夹失败: {self.account}/{self.mailbox}")
                 return 0, 0
 
-            # 搜索未读邮件（UNSEEN）
-            status, message_ids = mail.search(None, "UNSEEN")
+            _, data = mail.response("UIDVALIDITY")
+            uidvalidity = int(data[0]) if data and data[0] else 0
+            stored_validity, last_uid = self._load_state()
+            if stored_validity is not None and stored_validity != uidvalidity:
+                LogService.log_system(
+                    f"IMAP同步: {self.account} UIDVALIDITY 变化（{stored_validity} -> {uidvalidity}），重新同步"
+                )
+                last_uid = 0
+
+            # "n:*" 在没有更大 UID 时仍会返回最后一封，需再过滤一次
+            status, data = mail.uid("SEARCH", None, f"UID {last_uid + 1}:*")
             if status != "OK":
-                LogService.log_system("IMAP搜索失败")
-                mail.logout()
+                self.last_error = "搜索失败"
+                LogService.log_system(f"IMAP搜索失败: {self.account}")
                 return 0, 0
-
-            # 获取邮件ID列表
-            mail_ids = message_ids[0].split()
-            if not mail_ids:
-                LogService.log_system("IMAP同步: 无新邮件")
-                mail.logout()
+            uids = sorted(uid for uid in map(int, data[0].split()) if uid > last_uid)
+            if not uids:
+                self._save_state(uidvalidity, last_uid)
                 return 0, 0
 
-            LogService.log_system(f"IMAP同步: 发现 {len(mail_ids)} 封新邮件")
+            LogService.log_system(f"IMAP同步: {self.account} 发现 {len(uids)} 封新邮件")
 
-            # 处理每封邮件
-            for mail_id in mail_ids:
-                try:
-                    # 获取邮件内容
-                    status, msg_data = mail.fetch(mail_id, "(RFC822)")
-                    if status != "OK":
-                        fail_count += 1
-                        continue
-
-                    # 解析邮件
-                    raw_email = msg_data[0][1]
-                    msg = email.message_from_bytes(raw_email)
-
-                    # 提取发件人
-                    from_header = msg.get("From", "")
-                    from_addr = self._decode_header(from_header)
-
-                    # 提取主题
-                    subject_header = msg.get("Subject", "")
-                    subject = self._decode_header(subject_header)
+            for i in range(0, len(uids), self.batch_size):
+                batch = uids[i:i + self.batch_size]
+                status, msg_data = mail.uid("FETCH", ",".join(map(str, batch)), "(UID BODY.PEEK[])")
+                if status != "OK":
+                    self.last_error = f"批量获取失败: UID {batch[0]}-{batch[-1]}"
+                    LogService.log_system(f"IMAP批量获取失败: {self.account}, UID {batch[0]}-{batch[-1]}")
+                    break
 
-                    # 提取正文
-                    body = self._get_email_body(msg)
-
-                    # 保存到本地用户收件箱
-                    MailStorageService.save_mail(
-                        username=IMAP_SYNC_TO_USER,
-                        from_addr=from_addr,
-                        subject=subject,
-                        body=body
-                    )
-
-                    success_count += 1
-                    LogService.log_system(
-                        f"IMAP同步成功: {from_addr} -> {IMAP_SYNC_TO_USER}, 主题: {subject}"
-                    )
+                fetched = self._parse_fetch(msg_data)
+                for uid, raw_email in fetched:
+                    try:
+                        subject = self._save_message(raw_email)
+                        success_count += 1
+                        LogService.log_system(
+                            f"IMAP同步成功: {self.account} UID {uid} -> {self.to_user}, 主题: {subject}"
+                        )
+                    except Exception as e:
+                        # 单封解析/保存失败不阻塞后续邮件，进度照常前进，避免每轮重复拉取
+                        fail_count += 1
+                        LogService.log_system(f"IMAP同步邮件失败: {self.account} UID {uid}, 错误: {e}")
 
-                except Exception as e:
-                    fail_count += 1
-                    LogService.log_system(f"IMAP同步邮件失败: {e}")
+                # 本批已处理（包括期间被服务器删除、未返回的 UID），推进进度
+                last_uid = batch[-1]
+                self._save_state(uidvalidity, last_uid)
 
-            # 登出
-            mail.logout()
             LogService.log_system(
-                f"IMAP同步完成: 成功 {success_count}, 失败 {fail_count}"
+                f"IMAP同步完成: {self.account} 成功 {success_count}, 失败 {fail_count}"
             )
 
-        except imaplib.IMAP4.error as e:
-            LogService.log_system(f"IMAP连接/认证失败: {e}")
-            return success_count, fail_count
+        except (imaplib.IMAP4.error, OSError) as e:
+            # 连接已不可用，丢弃以便下次重连
+            self.last_error = str(e)
+            LogService.log_system(f"IMAP同步失败: {self.account}, {e}")
+            self.close()
         except Exception as e:
-            LogService.log_system(f"IMAP同步异常: {e}")
-            return success_count, fail_count
+            self.last_error = str(e)
+            LogService.log_system(f"IMAP同步异常: {self.account}, {e}")
+            self.close()
+        finally:
+            if not keep_alive:
+                self.close()
 
         return success_count, fail_count
 
-    def _decode_header(self, header_value: str) -> str:
-        """解码邮件头（处理编码）"""
-        if not header_value:
-            return ""
-        
-        decoded_parts = []
-        for part, encoding in decode_header(header_value):
-            if isinstance(part, bytes):
-                try:
-                    decoded_parts.append(part.decode(encoding or "utf-8", errors="ignore"))
-                except Exception:
-                    decoded_parts.append(part.decode("utf-8", errors="ignore"))
-            else:
-                decoded_parts.append(str(part))
-        
-        return "".join(decoded_parts)
-
-    def _get_email_body(self, msg) -> str:
-        """提取邮件正文（优先纯文本）"""
-        body = ""
-        
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                content_disposition = str(part.get("Content-Disposition", ""))
-
-                # 跳过附件
-                if "attachment" in content_disposition:
-                    continue
-
-                # 获取纯文本
-                if content_type == "text/plain":
-                    try:
-                        payload = part.get_payload(decode=True)
-                        charset = part.get_content_charset() or "utf-8"
-                        body = payload.decode(charset, errors="ignore")
-                        break
-                    except Exception:
-                        pass
-                
-                # 如果没有纯文本，尝试HTML
-                if not body and content_type == "text/html":
-                    try:
-                        payload = part.get_payload(decode=True)
-                        charset = part.get_content_charset() or "utf-8"
-                        body = payload.decode(charset, errors="ignore")
-                    except Exception:
-                        pass
-        else:
-            # 非multipart邮件
-            try:
-                payload = msg.get_payload(decode=True)
-                charset = msg.get_content_charset() or "utf-8"
-                body = payload.decode(charset, errors="ignore")
-            except Exception:
-                body = str(msg.get_payload())
+    def idle_wait(self, timeout: float, stop_event: threading.Event = None) -> bool:
+        """
+        在已选择的文件夹上执行 IDLE，直到服务器推送新邮件（EXISTS）、超时或收到停止信号
+
+        imaplib 不支持 IDLE，这里直接在连接上收发命令；等待期间按 IDLE_POLL_SECONDS 检查停止信号，
+        避免关闭服务时线程长时间阻塞。出错时关闭连接并抛出异常。
+
+        Returns:
+            是否有新邮件
+        """
+        mail = self._conn
+        if mail is None:
+            raise imaplib.IMAP4.error("未连接")
+
+        try:
+            tag = mail._new_tag()
+            mail.send(tag + b" IDLE\r\n")
+            line = mail.readline()
+            if not line.startswith(b"+"):
+                raise imaplib.IMAP4.error(f"IDLE 被拒绝: {line.strip()!r}")
+
+            sock = mail.socket()
+            has_new = False
+            deadline = time.monotonic() + timeout
+            while not has_new and time.monotonic() < deadline:
+                if stop_event is not None and stop_event.is_set():
+                    break
+                # SSL 层可能已缓存解密后的数据，select 感知不到
+                pending = isinstance(sock, ssl.SSLSocket) and sock.pending()
+                if not pending:
+                    readable, _, _ = select.select([sock], [], [], self.IDLE_POLL_SECONDS)
+                    if not readable:
+                        continue
+                line = mail.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("IDLE 期间连接被关闭")
+                if line.startswith(b"*") and line.rstrip().upper().endswith(b"EXISTS"):
+                    has_new = True
 
-        return body.strip()
+            mail.send(b"DONE\r\n")
+            while True:
+                line = mail.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("IDLE 结束时连接被关闭")
+                if line.startswith(tag):
+                    if not line[len(tag):].strip().upper().startswith(b"OK"):
+                        raise imaplib.IMAP4.error(f"IDLE 结束失败: {line.strip()!r}")
+                    break
+                if line.startswith(b"*") and line.rstrip().upper().endswith(b"EXISTS"):
+                    has_new = True
+            return has_new
+        except BaseException:
+            self.close()
+            raise
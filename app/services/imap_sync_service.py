@@ -0,0 +1,384 @@
+"""
+IMAP 多账号同步调度 - 将 imap_accounts 表中的外部邮箱并发同步到本地用户收件箱
+
+- 同步在专用线程池中执行（IMAP_SYNC_WORKERS），同一服务器同时同步的账号数不超过 IMAP_SYNC_MAX_PER_HOST
+- 轮询账号按 IMAP_SYNC_INTERVAL_MINUTES 加随机抖动调度，避免大量账号同时连接同一服务器
+- 服务器支持 IDLE 时保持长连接，同步后进入 IDLE，有新邮件推送即再次同步（总数受 IMAP_IDLE_MAX_CONNECTIONS 限制）
+- 每个账号的同步延迟与吞吐记录在 metrics 中，供接口查询
+"""
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+from app.config import (
+    IMAP_HOST,
+    IMAP_PORT,
+    IMAP_USER,
+    IMAP_PASS,
+    IMAP_USE_SSL,
+    IMAP_SYNC_ENABLED,
+    IMAP_SYNC_TO_USER,
+    IMAP_SYNC_INTERVAL_MINUTES,
+    IMAP_SYNC_WORKERS,
+    IMAP_SYNC_MAX_PER_HOST,
+    IMAP_SYNC_JITTER,
+    IMAP_IDLE_ENABLED,
+    IMAP_IDLE_MAX_CONNECTIONS,
+    IMAP_IDLE_TIMEOUT_SECONDS,
+)
+from app.db import SessionLocal
+from app.models import ImapAccount, ImapSyncState
+from app.services.imap_client import IMAPClient, check_imap_endpoint
+from app.services.log_service import LogService
+from app.utils.credential_cipher import decrypt_secret, encrypt_secret
+
+
+class ImapSyncService:
+    """IMAP 多账号同步调度服务"""
+
+    # 调度循环检查到期账号的间隔（秒）
+    SCHEDULER_TICK_SECONDS = 5
+    # 外部邮箱密码长度上限（加密后须能放入 imap_accounts.password 列）
+    MAX_PASSWORD_LENGTH = 128
+
+    _sync_executor = ThreadPoolExecutor(max_workers=max(1, IMAP_SYNC_WORKERS), thread_name_prefix="imap-sync")
+    _idle_executor = ThreadPoolExecutor(max_workers=max(1, IMAP_IDLE_MAX_CONNECTIONS), thread_name_prefix="imap-idle")
+
+    # 运行状态（内存级，按账号 ID 索引）
+    _clients: dict[int, IMAPClient] = {}
+    _client_keys: dict[int, tuple] = {}
+    _next_run: dict[int, float] = {}
+    _running: set[int] = set()
+    _idle_accounts: set[int] = set()
+    _host_limits: dict[str, asyncio.Semaphore] = {}
+    _workers: Optional[asyncio.Semaphore] = None
+    _idle_stops: dict[int, threading.Event] = {}
+    metrics: dict[int, dict] = {}
+
+    # ============ 账号管理 ============
+
+    @staticmethod
+    def account_to_dict(account: ImapAccount) -> dict:
+        """账号信息（不含密码）与同步指标"""
+        return {
+            "id": account.id,
+            "owner": account.owner,
+            "host": account.host,
+            "port": account.port,
+            "username": account.username,
+            "use_ssl": bool(account.use_ssl),
+            "mailbox": account.mailbox,
+            "enabled": bool(account.enabled),
+            "created_at": account.created_at,
+            "metrics": ImapSyncService.get_metrics(account.id),
+        }
+
+    @staticmethod
+    def list_accounts(owner: str = None) -> list[ImapAccount]:
+        """列出外部账号（指定 owner 时只列出该用户的）"""
+        with SessionLocal() as db:
+            query = db.query(ImapAccount)
+            if owner is not None:
+                query = query.filter(ImapAccount.owner == owner)
+            return query.order_by(ImapAccount.id).all()
+
+    @staticmethod
+    def add_account(
+        owner: str,
+        host: str,
+        username: str,
+        password: str,
+        port: int = 993,
+        use_ssl: bool = True,
+        mailbox: str = "INBOX",
+    ) -> ImapAccount:
+        """绑定外部账号，服务器地址不允许或同一外部账号文件夹已被绑定时抛出 ValueError（密码加密保存）"""
+        host = host.strip().lower()
+        mailbox = mailbox or "INBOX"
+        if not password or len(password) > ImapSyncService.MAX_PASSWORD_LENGTH:
+            raise ValueError(f"密码长度应为 1-{ImapSyncService.MAX_PASSWORD_LENGTH} 个字符")
+        check_imap_endpoint(host, port)
+        with SessionLocal() as db:
+            exists = db.query(ImapAccount).filter(
+                ImapAccount.host == host,
+                ImapAccount.username == username,
+                ImapAccount.mailbox == mailbox
+            ).first()
+            if exists:
+                raise ValueError("该外部邮箱已被绑定")
+            account = ImapAccount(
+                owner=owner,
+                host=host,
+                port=port,
+                username=username,
+                password=encrypt_secret(password),
+                use_ssl=1 if use_ssl else 0,
+                mailbox=mailbox,
+                enabled=1,
+            )
+            db.add(account)
+            db.commit()
+            db.refresh(account)
+        ImapSyncService._next_run[account.id] = 0
+        return account
+
+    @staticmethod
+    def delete_account(account_id: int, owner: str = None) -> bool:
+        """删除外部账号及其同步进度（指定 owner 时只能删除自己的账号）"""
+        with SessionLocal() as db:
+            account = db.get(ImapAccount, account_id)
+            if account is None or (owner is not None and account.owner != owner):
+                return False
+            db.query(ImapSyncState).filter(
+                ImapSyncState.account == f"{account.username}@{account.host}",
+                ImapSyncState.mailbox == account.mailbox
+            ).delete()
+            db.delete(account)
+            db.commit()
+        ImapSyncService._stop_idle(account_id)
+        ImapSyncService._next_run.pop(account_id, None)
+        ImapSyncService.metrics.pop(account_id, None)
+        return True
+
+    @staticmethod
+    def request_sync(account_id: int) -> None:
+        """让账号在下一次调度时立即同步（IDLE 中的账号会在服务器推送时自行同步）"""
+        ImapSyncService._next_run[account_id] = 0
+
+    @staticmethod
+    def ensure_env_account() -> None:
+        """将 .env 中配置的单个 IMAP 账号（IMAP_SYNC_ENABLED）登记到 imap_accounts 表"""
+        if not IMAP_SYNC_ENABLED or not all([IMAP_HOST, IMAP_USER, IMAP_PASS]):
+            return
+        with SessionLocal() as db:
+            account = db.query(ImapAccount).filter(
+                ImapAccount.host == IMAP_HOST,
+                ImapAccount.username == IMAP_USER,
+                ImapAccount.mailbox == "INBOX"
+            ).first()
+            if account is None:
+                account = ImapAccount(host=IMAP_HOST, username=IMAP_USER, mailbox="INBOX", enabled=1)
+                db.add(account)
+            account.owner = IMAP_SYNC_TO_USER
+            account.port = IMAP_PORT or 993
+            # 每次加密结果不同，密码未变时不改写，避免无谓地重建连接
+            try:
+                unchanged = account.password is not None and decrypt_secret(account.password) == IMAP_PASS
+            except ValueError:
+                unchanged = False
+            if not unchanged:
+                account.password = encrypt_secret(IMAP_PASS)
+            account.use_ssl = 1 if IMAP_USE_SSL else 0
+            db.commit()
+
+    # ============ 指标 ============
+
+    @staticmethod
+    def _metrics_for(account_id: int) -> dict:
+        return ImapSyncService.metrics.setdefault(account_id, {
+            "mode": "poll",  # poll 轮询, idle 长连接
+            "runs": 0,
+            "synced_total": 0,
+            "failed_total": 0,
+            "last_synced": 0,
+            "last_duration_ms": None,
+            "last_throughput": None,  # 最近一次同步的邮件数/秒
+            "last_sync_at": None,
+            "last_success_at": None,
+            "last_error": None,
+            "next_run_at": None,
+        })
+
+    @staticmethod
+    def get_metrics(account_id: int) -> dict:
+        """账号同步指标；lag_seconds 为距最近一次成功同步的秒数（IDLE 等待中视为 0）"""
+        metrics = dict(ImapSyncService._metrics_for(account_id))
+        if metrics["mode"] == "idle" and account_id in ImapSyncService._idle_accounts:
+            metrics["lag_seconds"] = 0
+        elif metrics["last_success_at"]:
+            metrics["lag_seconds"] = round((datetime.now() - metrics["last_success_at"]).total_seconds(), 1)
+        else:
+            metrics["lag_seconds"] = None
+        return metrics
+
+    @staticmethod
+    def pool_status() -> dict:
+        """调度器整体状态"""
+        return {
+            "workers": IMAP_SYNC_WORKERS,
+            "max_per_host": IMAP_SYNC_MAX_PER_HOST,
+            "running": len(ImapSyncService._running - ImapSyncService._idle_accounts),
+            "idle_connections": len(ImapSyncService._idle_accounts),
+            "idle_max_connections": IMAP_IDLE_MAX_CONNECTIONS if IMAP_IDLE_ENABLED else 0,
+            "open_connections": sum(1 for c in ImapSyncService._clients.values() if c.connected),
+        }
+
+    # ============ 调度 ============
+
+    @staticmethod
+    def _interval() -> float:
+        """带随机抖动的轮询间隔（秒）"""
+        base = IMAP_SYNC_INTERVAL_MINUTES * 60
+        return base * random.uniform(1 - IMAP_SYNC_JITTER, 1 + IMAP_SYNC_JITTER)
+
+    @staticmethod
+    def _host_limit(host: str) -> asyncio.Semaphore:
+        limit = ImapSyncService._host_limits.get(host)
+        if limit is None:
+            limit = asyncio.Semaphore(max(1, IMAP_SYNC_MAX_PER_HOST))
+            ImapSyncService._host_limits[host] = limit
+        return limit
+
+    @staticmethod
+    def _get_client(account: ImapAccount) -> IMAPClient:
+        """取得账号的客户端（复用长连接；账号配置变化时重建）"""
+        key = (account.host, account.port, account.username, account.password,
+               account.use_ssl, account.owner, account.mailbox)
+        client = ImapSyncService._clients.get(account.id)
+        if client is None or ImapSyncService._client_keys.get(account.id) != key:
+            if client is not None:
+                client.close()
+            client = IMAPClient.from_account(account)
+            ImapSyncService._clients[account.id] = client
+            ImapSyncService._client_keys[account.id] = key
+        return client
+
+    @staticmethod
+    def _stop_idle(account_id: int) -> None:
+        """让账号的 IDLE 等待尽快结束（账号被删除、停用或服务关闭时）"""
+        stop = ImapSyncService._idle_stops.get(account_id)
+        if stop is not None:
+            stop.set()
+
+    @staticmethod
+    def _drop_client(account_id: int) -> None:
+        client = ImapSyncService._clients.pop(account_id, None)
+        ImapSyncService._client_keys.pop(account_id, None)
+        ImapSyncService._idle_accounts.discard(account_id)
+        ImapSyncService._idle_stops.pop(account_id, None)
+        if client is not None:
+            client.close()
+
+    @staticmethod
+    async def run() -> None:
+        """调度循环：定期加载启用的账号，将到期的账号交给同步线程池"""
+        ImapSyncService._workers = asyncio.Semaphore(max(1, IMAP_SYNC_WORKERS))
+        ImapSyncService._host_limits = {}
+        await asyncio.to_thread(ImapSyncService.ensure_env_account)
+        tasks = set()
+        try:
+            while True:
+                try:
+                    accounts = await asyncio.to_thread(
+                        lambda: [a for a in ImapSyncService.list_accounts() if a.enabled]
+                    )
+                except Exception as e:
+                    LogService.log_system(f"IMAP同步调度: 加载账号失败: {e}")
+                    accounts = []
+
+                now = time.monotonic()
+                active_ids = {a.id for a in accounts}
+                for account_id in list(ImapSyncService._clients):
+                    if account_id in active_ids:
+                        continue
+                    if account_id in ImapSyncService._running:
+                        ImapSyncService._stop_idle(account_id)
+                    else:
+                        await asyncio.to_thread(ImapSyncService._drop_client, account_id)
+
+                for account in accounts:
+                    if account.id in ImapSyncService._running:
+                        continue
+                    next_run = ImapSyncService._next_run.get(account.id)
+                    if next_run is None:
+                        # 首次调度分散到一个抖动窗口内，避免启动时所有账号同时连接
+                        next_run = now + random.uniform(0, min(ImapSyncService._interval() * IMAP_SYNC_JITTER, 60))
+                        ImapSyncService._next_run[account.id] = next_run
+                    if next_run > now:
+                        continue
+                    ImapSyncService._running.add(account.id)
+                    task = asyncio.create_task(ImapSyncService._run_account(account))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+                await asyncio.sleep(ImapSyncService.SCHEDULER_TICK_SECONDS)
+        finally:
+            # 通知 IDLE 线程退出并关闭所有连接
+            for account_id in list(ImapSyncService._idle_stops):
+                ImapSyncService._stop_idle(account_id)
+            for task in tasks:
+                task.cancel()
+            for account_id in list(ImapSyncService._clients):
+                ImapSyncService._drop_client(account_id)
+            ImapSyncService._running.clear()
+            ImapSyncService._idle_accounts.clear()
+
+    @staticmethod
+    async def _run_account(account: ImapAccount) -> None:
+        """同步一个账号；服务器支持 IDLE 且有空闲名额时随后进入 IDLE 等待"""
+        loop = asyncio.get_running_loop()
+        metrics = ImapSyncService._metrics_for(account.id)
+        try:
+            client = ImapSyncService._get_client(account)
+            # 先占用 IDLE 名额，避免并发同步的账号同时判断有空位而超出上限
+            want_idle = IMAP_IDLE_ENABLED and (
+                account.id in ImapSyncService._idle_accounts
+                or len(ImapSyncService._idle_accounts) < IMAP_IDLE_MAX_CONNECTIONS
+            )
+            if want_idle:
+                ImapSyncService._idle_accounts.add(account.id)
+
+            async with ImapSyncService._workers, ImapSyncService._host_limit(account.host):
+                started = time.monotonic()
+                success, fail = await loop.run_in_executor(
+                    ImapSyncService._sync_executor, client.sync_new_mails, want_idle
+                )
+                duration = time.monotonic() - started
+
+            metrics["runs"] += 1
+            metrics["synced_total"] += success
+            metrics["failed_total"] += fail
+            metrics["last_synced"] = success
+            metrics["last_duration_ms"] = round(duration * 1000, 1)
+            metrics["last_throughput"] = round(success / duration, 1) if duration > 0 else None
+            metrics["last_sync_at"] = datetime.now()
+            metrics["last_error"] = client.last_error
+            if client.last_error is None:
+                metrics["last_success_at"] = metrics["last_sync_at"]
+
+            if want_idle and client.last_error is None and client.supports_idle:
+                metrics["mode"] = "idle"
+                metrics["next_run_at"] = None
+                stop = ImapSyncService._idle_stops.setdefault(account.id, threading.Event())
+                stop.clear()
+                try:
+                    await loop.run_in_executor(
+                        ImapSyncService._idle_executor,
+                        client.idle_wait, IMAP_IDLE_TIMEOUT_SECONDS, stop
+                    )
+                    # 有新邮件或 IDLE 超时：立即再次同步（复用连接）
+                    ImapSyncService._next_run[account.id] = 0
+                    return
+                except Exception as e:
+                    metrics["last_error"] = f"IDLE 失败: {e}"
+                    ImapSyncService._idle_accounts.discard(account.id)
+            else:
+                ImapSyncService._idle_accounts.discard(account.id)
+                client.close()
+
+            metrics["mode"] = "poll"
+            interval = ImapSyncService._interval()
+            ImapSyncService._next_run[account.id] = time.monotonic() + interval
+            metrics["next_run_at"] = datetime.fromtimestamp(time.time() + interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics["last_error"] = str(e)
+            ImapSyncService._idle_accounts.discard(account.id)
+            ImapSyncService._next_run[account.id] = time.monotonic() + ImapSyncService._interval()
+            LogService.log_system(f"IMAP同步调度异常: {account.username}@{account.host}, {e}")
+        finally:
+            ImapSyncService._running.discard(account.id)
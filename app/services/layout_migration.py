@@ -0,0 +1,130 @@
+"""
+邮件目录布局迁移 - 在线将已有邮件文件移动到当前配置的存储后端与目录布局
+
+服务不停机：按 mails 表主键分批迁移，每批移动文件后更新 file_path；
+迁移期间读取通过 MailStorageService.locate_mail 同时兼容新旧位置。
+"""
+import asyncio
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from app.db import SessionLocal
+from app.models import Mail
+from app.services.log_service import LogService
+from app.services.mail_cache import MailContentCache
+from app.services.mail_storage import MailStorageService
+from app.utils.durable_file import sync_directories
+
+
+class LayoutMigrationService:
+    """邮件目录布局迁移服务"""
+
+    BATCH_SIZE = 500
+
+    # 同一时间只允许一个迁移任务（内存级）
+    job: Optional[dict] = None
+    _task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _migrate_batch(after_id: int) -> tuple[int, int, int, int]:
+        """
+        迁移一批邮件（在线程中执行）
+
+        Returns:
+            (本批最后的邮件ID, 检查数, 移动数, 文件缺失数)；检查数为 0 表示已迁移完毕
+        """
+        moved = missing = 0
+        touched_dirs = set()
+        touched_mailboxes = set()
+        with SessionLocal() as db:
+            rows = db.query(Mail).filter(
+                Mail.id > after_id,
+                Mail.folder.in_(("inbox", "sent"))
+            ).order_by(Mail.id).limit(LayoutMigrationService.BATCH_SIZE).all()
+            if not rows:
+                return after_id, 0, 0, 0
+
+            for row in rows:
+                flags = row.flags or ""
+                target = MailStorageService.get_mail_path(row.owner, row.folder, row.filename, flags)
+                current = Path(row.file_path) if row.file_path else None
+                if current is None or not current.is_file():
+                    current = MailStorageService.locate_mail(row.owner, row.folder, row.filename, flags)
+                if current is None:
+                    missing += 1
+                    continue
+                if current != target:
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(current, target)
+                    MailContentCache.move(current, target)
+                    touched_dirs.update((current.parent, target.parent))
+                    touched_mailboxes.add((row.owner, row.folder))
+                    moved += 1
+                row.file_path = str(target)
+
+            # 列表中包含文件路径，递增涉及邮箱的版本号使列表 ETag 失效
+            for owner, folder in touched_mailboxes:
+                MailStorageService.touch_mailbox(db, owner, folder)
+
+            # 先让 rename 落盘，再提交新路径
+            sync_directories(touched_dirs)
+            db.commit()
+            return rows[-1].id, len(rows), moved, missing
+
+    @staticmethod
+    def start_job() -> dict:
+        """启动迁移任务（目标为当前配置的存储后端与布局），已有任务运行时抛出 ValueError"""
+        job = LayoutMigrationService.job
+        if job and job["status"] in ("pending", "running"):
+            raise ValueError("已有迁移任务正在运行")
+
+        job = {
+            "status": "pending",  # pending, running, completed, cancelled, failed
+            "layout": MailStorageService.backend.name,
+            "scanned": 0,
+            "moved": 0,
+            "missing": 0,
+            "last_id": 0,
+            "cancel_requested": False,
+            "error": None,
+            "created_at": datetime.now(),
+            "finished_at": None,
+        }
+        LayoutMigrationService.job = job
+        LayoutMigrationService._task = asyncio.create_task(LayoutMigrationService._run_job(job))
+        return job
+
+    @staticmethod
+    async def _run_job(job: dict):
+        """后台逐批迁移，批次之间让出事件循环"""
+        job["status"] = "running"
+        try:
+            while not job["cancel_requested"]:
+                last_id, scanned, moved, missing = await asyncio.to_thread(
+                    LayoutMigrationService._migrate_batch, job["last_id"]
+                )
+                if scanned == 0:
+                    break
+                job["last_id"] = last_id
+                job["scanned"] += scanned
+                job["moved"] += moved
+                job["missing"] += missing
+            job["status"] = "cancelled" if job["cancel_requested"] else "completed"
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+        finally:
+            job["finished_at"] = datetime.now()
+            LayoutMigrationService._task = None
+            LogService.log_system(
+                f"邮件目录迁移（{job['layout']}）{job['status']}: 检查 {job['scanned']}, 移动 {job['moved']}, 缺失 {job['missing']}"
+            )
+
+    @staticmethod
+    def cancel_job() -> Optional[dict]:
+        """请求取消迁移任务（当前批次完成后停止，已迁移的文件保持在新位置）"""
+        job = LayoutMigrationService.job
+        if job and job["status"] in ("pending", "running"):
+            job["cancel_requested"] = True
+        return job
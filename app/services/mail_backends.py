@@ -0,0 +1,202 @@
+"""
+邮件文件存储后端 - 可插拔的邮件文件布局
+
+MailStorageService 负责业务与 mails 表索引，邮件文件的路径计算、投递与标记由后端完成：
+- FileLayoutBackend: 原有的 .txt 文件布局（flat/date/hash）
+- MaildirBackend: 标准 Maildir（tmp/new/cur，标记写在文件名中），可直接用 mutt、Dovecot 等工具读取
+
+邮件在 API 与 mails 表中始终以 <邮件ID>.txt 标识，与后端无关。
+"""
+import hashlib
+import os
+import re
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Iterator
+from app.utils.durable_file import write_text_atomic
+
+# Maildir 标准标记：D 草稿、F 加星、P 已转发、R 已回复、S 已读、T 待删除
+MAILDIR_FLAGS = "DFPRST"
+
+
+def normalize_flags(flags: str) -> str:
+    """标记去重并按 ASCII 排序（Maildir 规范要求）"""
+    return "".join(sorted(set(flags or "") & set(MAILDIR_FLAGS)))
+
+
+class MailStoreBackend(ABC):
+    """邮件文件存储后端接口"""
+
+    name = ""
+
+    def __init__(self, base_dir: str):
+        self.base_dir = Path(base_dir)
+
+    @abstractmethod
+    def path_for(self, username: str, folder: str, filename: str, flags: str = "") -> Path:
+        """计算邮件文件路径（不访问文件系统）"""
+
+    @abstractmethod
+    def deliver(self, username: str, folder: str, filename: str, content: str, sync_dir: bool = True) -> Path:
+        """原子写入一封新邮件，返回文件路径"""
+
+    def locate(self, username: str, folder: str, filename: str, flags: str = "") -> Path | None:
+        """查找邮件文件，不存在时返回 None"""
+        filepath = self.path_for(username, folder, filename, flags)
+        return filepath if filepath.is_file() else None
+
+    def set_flags(self, filepath: Path, username: str, folder: str, filename: str, flags: str) -> Path:
+        """更新邮件标记，返回更新后的文件路径（默认不在文件中记录标记，仅由 mails 表保存）"""
+        return filepath
+
+    @classmethod
+    @abstractmethod
+    def scan(cls, user_dir: Path) -> Iterator[tuple[str, Path, str]]:
+        """遍历用户目录中该后端格式的邮件文件，产出 (文件夹, 路径, 邮件文件名)"""
+
+
+class FileLayoutBackend(MailStoreBackend):
+    """
+    .txt 文件布局
+
+    - flat: mailbox/<user>/<file>、mailbox/<user>/sent/<file>
+    - date: mailbox/<user>/inbox/2026/10/<file>，按文件名中的日期前缀分目录
+    - hash: mailbox/<user>/inbox/3f/<file>，按文件名 SHA-1 前两位分桶
+    """
+
+    LAYOUTS = ("flat", "date", "hash")
+    _DATE_PREFIX_RE = re.compile(r"^(\d{4})(\d{2})\d{2}_")
+
+    def __init__(self, base_dir: str, layout: str = "flat"):
+        super().__init__(base_dir)
+        self.layout = layout if layout in self.LAYOUTS else "flat"
+        self.name = f"file:{self.layout}"
+
+    def path_for(self, username: str, folder: str, filename: str, flags: str = "") -> Path:
+        user_dir = self.base_dir / username
+        if folder == "sent":
+            root = user_dir / "sent"
+        else:
+            root = user_dir if self.layout == "flat" else user_dir / "inbox"
+
+        if self.layout == "date":
+            match = self._DATE_PREFIX_RE.match(filename)
+            return root / match.group(1) / match.group(2) / filename if match else root / "misc" / filename
+        if self.layout == "hash":
+            return root / hashlib.sha1(filename.encode("utf-8")).hexdigest()[:2] / filename
+        return root / filename
+
+    def deliver(self, username: str, folder: str, filename: str, content: str, sync_dir: bool = True) -> Path:
+        filepath = self.path_for(username, folder, filename)
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        write_text_atomic(filepath, content, sync_dir)
+        return filepath
+
+    @classmethod
+    def scan(cls, user_dir: Path) -> Iterator[tuple[str, Path, str]]:
+        # 平铺布局的收件箱文件 + 分目录布局（inbox/、sent/ 下任意层级）的文件
+        sources = (
+            ("inbox", user_dir, "*.txt"),
+            ("inbox", user_dir / "inbox", "**/*.txt"),
+            ("sent", user_dir / "sent", "**/*.txt"),
+        )
+        for folder, folder_dir, pattern in sources:
+            if not folder_dir.is_dir():
+                continue
+            for mail_file in folder_dir.glob(pattern):
+                if mail_file.is_file():
+                    yield folder, mail_file, mail_file.name
+
+
+class MaildirBackend(MailStoreBackend):
+    """
+    Maildir 布局：mailbox/<user>/Maildir/{tmp,new,cur}，发件箱为 Maildir++ 子目录 .Sent
+
+    投递先写 tmp/ 再 rename 到 new/，无需加锁；按是否已读（S）选择目录：已读邮件位于 cur/<id>:2,<标记>，
+    未读邮件留在 new/，带其他标记（如仅 F）时文件名同样附带 :2,<标记>，去掉 S 标记时移回 new/。
+    软删除的邮件在清理前仍留在原目录，"是否有新邮件"由 mails 表判断。
+    """
+
+    name = "maildir"
+    # Windows 文件名不允许冒号，按常见约定改用 "!"
+    INFO_SEP = "!" if os.name == "nt" else ":"
+
+    def _root(self, username: str, folder: str) -> Path:
+        root = self.base_dir / username / "Maildir"
+        return root / ".Sent" if folder == "sent" else root
+
+    @staticmethod
+    def _unique_name(filename: str) -> str:
+        return filename[:-4] if filename.endswith(".txt") else filename
+
+    def path_for(self, username: str, folder: str, filename: str, flags: str = "") -> Path:
+        root = self._root(username, folder)
+        unique = self._unique_name(filename)
+        flags = normalize_flags(flags)
+        sub = "cur" if "S" in flags else "new"
+        if not flags:
+            return root / sub / unique
+        return root / sub / f"{unique}{self.INFO_SEP}2,{flags}"
+
+    def _ensure_dirs(self, root: Path) -> None:
+        for sub in ("tmp", "new", "cur"):
+            (root / sub).mkdir(parents=True, exist_ok=True)
+
+    def deliver(self, username: str, folder: str, filename: str, content: str, sync_dir: bool = True) -> Path:
+        root = self._root(username, folder)
+        self._ensure_dirs(root)
+        filepath = root / "new" / self._unique_name(filename)
+        write_text_atomic(filepath, content, sync_dir, temp_dir=root / "tmp")
+        return filepath
+
+    def locate(self, username: str, folder: str, filename: str, flags: str = "") -> Path | None:
+        filepath = self.path_for(username, folder, filename, flags)
+        if filepath.is_file():
+            return filepath
+        root = self._root(username, folder)
+        unique = self._unique_name(filename)
+        new_path = root / "new" / unique
+        if new_path.is_file():
+            return new_path
+        # 标记被外部工具修改、或文件仍按旧规则存放（有任意标记即在 cur/）时才需要扫描
+        for sub in ("cur", "new"):
+            sub_dir = root / sub
+            if sub_dir.is_dir():
+                for candidate in sub_dir.glob(f"{unique}{self.INFO_SEP}*"):
+                    return candidate
+        return None
+
+    def set_flags(self, filepath: Path, username: str, folder: str, filename: str, flags: str) -> Path:
+        target = self.path_for(username, folder, filename, flags)
+        if target != filepath:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(filepath, target)
+        return target
+
+    @classmethod
+    def scan(cls, user_dir: Path) -> Iterator[tuple[str, Path, str]]:
+        for folder, root in (("inbox", user_dir / "Maildir"), ("sent", user_dir / "Maildir" / ".Sent")):
+            for sub in ("new", "cur"):
+                sub_dir = root / sub
+                if not sub_dir.is_dir():
+                    continue
+                for mail_file in sub_dir.iterdir():
+                    if mail_file.is_file() and not mail_file.name.startswith("."):
+                        yield folder, mail_file, f"{mail_file.name.split(cls.INFO_SEP)[0]}.txt"
+
+
+def create_backend(base_dir: str, backend: str, layout: str = "flat") -> MailStoreBackend:
+    """按配置创建存储后端（maildir 或 file）"""
+    if backend == "maildir":
+        return MaildirBackend(base_dir)
+    return FileLayoutBackend(base_dir, layout)
+
+
+def lookup_backends(current: MailStoreBackend) -> list[MailStoreBackend]:
+    """查找邮件文件时依次尝试的后端：当前后端优先，其余布局用于兼容迁移前的文件"""
+    others = [FileLayoutBackend(str(current.base_dir), layout) for layout in FileLayoutBackend.LAYOUTS]
+    others.append(MaildirBackend(str(current.base_dir)))
+    return [current] + [b for b in others if b.name != current.name]
+
+
+SCANNERS = (FileLayoutBackend, MaildirBackend)
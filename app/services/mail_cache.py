@@ -0,0 +1,108 @@
+"""
+邮件内容缓存 - 按字节数限制容量的 LRU 读缓存，HTTP 读信与 POP3 RETR 共用
+
+以文件路径为键，条目记录写入时的 (mtime_ns, 文件大小, inode)；读取时先 stat，
+文件被改写或原子替换后版本不一致即视为未命中。MailStorageService 在写入、移动、
+删除邮件文件时主动失效对应路径，及时释放内存。
+"""
+import os
+import threading
+from collections import OrderedDict
+from app.config import MAIL_CACHE_MAX_BYTES, MAIL_CACHE_MAX_ENTRY_BYTES
+
+
+class MailContentCache:
+    """邮件内容 LRU 缓存"""
+
+    # 路径 -> ((mtime_ns, 文件大小, inode), 内容)；容量按文件字节数计
+    _entries: "OrderedDict[str, tuple[tuple, str]]" = OrderedDict()
+    _bytes = 0
+    _lock = threading.Lock()
+
+    stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def _version(stat: os.stat_result) -> tuple:
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    @staticmethod
+    def read(filepath) -> str:
+        """读取邮件文件（UTF-8），命中缓存时不打开文件；文件不存在时抛出 FileNotFoundError"""
+        key = str(filepath)
+        stat = os.stat(key)
+        version = MailContentCache._version(stat)
+        with MailContentCache._lock:
+            entry = MailContentCache._entries.get(key)
+            if entry is not None and entry[0] == version:
+                MailContentCache._entries.move_to_end(key)
+                MailContentCache.stats["hits"] += 1
+                return entry[1]
+            MailContentCache.stats["misses"] += 1
+
+        with open(key, "r", encoding="utf-8") as f:
+            # 以打开后的 fstat 为准：stat 与 open 之间文件被替换时，缓存的是实际读到的版本
+            version = MailContentCache._version(os.fstat(f.fileno()))
+            content = f.read()
+        MailContentCache._store(key, version, content)
+        return content
+
+    @staticmethod
+    def _store(key: str, version: tuple, content: str) -> None:
+        size = version[1]
+        if MAIL_CACHE_MAX_BYTES <= 0 or size > MAIL_CACHE_MAX_ENTRY_BYTES:
+            return
+        with MailContentCache._lock:
+            old = MailContentCache._entries.pop(key, None)
+            if old is not None:
+                MailContentCache._bytes -= old[0][1]
+            MailContentCache._entries[key] = (version, content)
+            MailContentCache._bytes += size
+            while MailContentCache._bytes > MAIL_CACHE_MAX_BYTES and MailContentCache._entries:
+                _, (evicted_version, _) = MailContentCache._entries.popitem(last=False)
+                MailContentCache._bytes -= evicted_version[1]
+                MailContentCache.stats["evictions"] += 1
+
+    @staticmethod
+    def invalidate(*paths) -> None:
+        """失效指定路径的缓存（写入、移动或删除邮件文件后调用）"""
+        with MailContentCache._lock:
+            for path in paths:
+                if path is None:
+                    continue
+                entry = MailContentCache._entries.pop(str(path), None)
+                if entry is not None:
+                    MailContentCache._bytes -= entry[0][1]
+                    MailContentCache.stats["invalidations"] += 1
+
+    @staticmethod
+    def move(old_path, new_path) -> None:
+        """文件被重命名（Maildir 标记变化、布局迁移）：rename 不改变 mtime 与 inode，缓存条目随之改挂到新路径"""
+        old_key, new_key = str(old_path), str(new_path)
+        if old_key == new_key:
+            return
+        with MailContentCache._lock:
+            entry = MailContentCache._entries.pop(old_key, None)
+            stale = MailContentCache._entries.pop(new_key, None)
+            if stale is not None:
+                MailContentCache._bytes -= stale[0][1]
+            if entry is not None:
+                MailContentCache._entries[new_key] = entry
+
+    @staticmethod
+    def clear() -> None:
+        with MailContentCache._lock:
+            MailContentCache._entries.clear()
+            MailContentCache._bytes = 0
+
+    @staticmethod
+    def get_stats() -> dict:
+        """命中/未命中/淘汰/失效计数与当前占用"""
+        with MailContentCache._lock:
+            stats = dict(MailContentCache.stats)
+            stats["entries"] = len(MailContentCache._entries)
+            stats["bytes"] = MailContentCache._bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["max_bytes"] = MAIL_CACHE_MAX_BYTES
+        stats["max_entry_bytes"] = MAIL_CACHE_MAX_ENTRY_BYTES
+        return stats
@@ -0,0 +1,103 @@
+"""
+新邮件推送 - 进程内发布/订阅中心，按用户扇出到 SSE 连接
+
+MailStorageService 在邮件登记（SMTP 收信、/mail/send、群发、IMAP 同步）、删除、标记变化提交后发布事件；
+发布可能来自任意线程，统一通过 call_soon_threadsafe 交给事件循环扇出。
+每个订阅者有一个有界队列，客户端读取过慢导致队列满时丢弃后续事件并标记溢出，
+之后先推送一次 resync 事件，由客户端调用 /mail/sync 补齐。
+"""
+import asyncio
+import json
+from typing import AsyncIterator, Optional
+from app.config import MAIL_EVENTS_QUEUE_SIZE, MAIL_EVENTS_MAX_PER_USER, MAIL_EVENTS_HEARTBEAT_SECONDS
+
+
+class MailEventSubscriber:
+    """单个推送连接"""
+
+    def __init__(self, username: str, maxsize: int):
+        self.username = username
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+
+class MailEventHub:
+    """新邮件推送中心（订阅、扇出均在事件循环线程中进行，无需加锁）"""
+
+    _loop: Optional[asyncio.AbstractEventLoop] = None
+    _subscribers: dict[str, set[MailEventSubscriber]] = {}
+
+    stats = {"published": 0, "delivered": 0, "dropped": 0}
+
+    @staticmethod
+    def subscribe(username: str) -> MailEventSubscriber:
+        """注册推送连接（须在事件循环中调用），超过单用户连接上限时抛出 ValueError"""
+        MailEventHub._loop = asyncio.get_running_loop()
+        subscribers = MailEventHub._subscribers.setdefault(username, set())
+        if len(subscribers) >= MAIL_EVENTS_MAX_PER_USER:
+            raise ValueError("推送连接数已达上限")
+        subscriber = MailEventSubscriber(username, MAIL_EVENTS_QUEUE_SIZE)
+        subscribers.add(subscriber)
+        return subscriber
+
+    @staticmethod
+    def unsubscribe(subscriber: MailEventSubscriber) -> None:
+        subscribers = MailEventHub._subscribers.get(subscriber.username)
+        if subscribers is None:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            MailEventHub._subscribers.pop(subscriber.username, None)
+
+    @staticmethod
+    def publish(username: str, event: dict) -> None:
+        """发布事件（线程安全）；用户没有推送连接时直接忽略"""
+        loop = MailEventHub._loop
+        if loop is None or loop.is_closed() or username not in MailEventHub._subscribers:
+            return
+        try:
+            loop.call_soon_threadsafe(MailEventHub._fan_out, username, event)
+        except RuntimeError:
+            # 事件循环已关闭（进程退出中）
+            pass
+
+    @staticmethod
+    def _fan_out(username: str, event: dict) -> None:
+        MailEventHub.stats["published"] += 1
+        for subscriber in list(MailEventHub._subscribers.get(username, ())):
+            try:
+                subscriber.queue.put_nowait(event)
+                MailEventHub.stats["delivered"] += 1
+            except asyncio.QueueFull:
+                subscriber.overflowed = True
+                MailEventHub.stats["dropped"] += 1
+
+    @staticmethod
+    def _format(event_type: str, data: dict) -> str:
+        return f"event: {event_type}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+    @staticmethod
+    async def stream(subscriber: MailEventSubscriber) -> AsyncIterator[str]:
+        """SSE 数据流：事件、溢出后的 resync 与定期心跳注释（保持连接并及时发现断开）"""
+        try:
+            yield "retry: 3000\n\n"
+            yield MailEventHub._format("ready", {"username": subscriber.username})
+            while True:
+                if subscriber.overflowed:
+                    subscriber.overflowed = False
+                    yield MailEventHub._format("resync", {})
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), MAIL_EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield MailEventHub._format("mail", event)
+        finally:
+            MailEventHub.unsubscribe(subscriber)
+
+    @staticmethod
+    def get_stats() -> dict:
+        stats = dict(MailEventHub.stats)
+        stats["users"] = len(MailEventHub._subscribers)
+        stats["connections"] = sum(len(s) for s in MailEventHub._subscribers.values())
+        return stats
@@ -0,0 +1,132 @@
+"""
+邮件头解析服务 - 只读取头部（到第一个空行为止），带 LRU 缓存
+"""
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+from app.config import MAIL_HEADER_CACHE_SIZE
+
+
+@dataclass(frozen=True)
+class MailHeaders:
+    """邮件头（不含正文）"""
+    fields: dict = field(default_factory=dict)  # 小写头名 -> 值（同名头取第一个）
+    header_bytes: int = 0  # 头部字节数（含结束空行），正文从该偏移开始
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self.fields.get(name.lower(), default)
+
+    @property
+    def from_addr(self) -> Optional[str]:
+        return self.fields.get("from")
+
+    @property
+    def to_addr(self) -> Optional[str]:
+        return self.fields.get("to")
+
+    @property
+    def subject(self) -> Optional[str]:
+        return self.fields.get("subject")
+
+    @property
+    def date(self) -> Optional[str]:
+        return self.fields.get("date")
+
+    @property
+    def in_reply_to(self) -> Optional[str]:
+        return self.fields.get("in-reply-to") or None
+
+
+class MailHeaderParser:
+    """邮件头解析器"""
+
+    CHUNK_SIZE = 4096  # 每次读取的字节数
+    MAX_HEADER_BYTES = 64 * 1024  # 头部最大读取字节数，超出部分忽略
+
+    # LRU 缓存：(路径, mtime_ns, 文件大小) -> MailHeaders；文件被改写后键自然失效
+    _cache: "OrderedDict[tuple, MailHeaders]" = OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _find_header_end(buf: bytearray, start: int) -> int:
+        """查找头部结束位置（空行之后的偏移），未找到返回 -1"""
+        ends = []
+        lf = buf.find(b"\n\n", start)
+        if lf != -1:
+            ends.append(lf + 2)
+        crlf = buf.find(b"\n\r\n", start)
+        if crlf != -1:
+            ends.append(crlf + 3)
+        return min(ends) if ends else -1
+
+    @staticmethod
+    def _read_header_block(filepath: Path) -> bytes:
+        """分块读取文件头部，遇到空行即停止"""
+        buf = bytearray()
+        with open(filepath, "rb") as f:
+            while len(buf) < MailHeaderParser.MAX_HEADER_BYTES:
+                chunk = f.read(MailHeaderParser.CHUNK_SIZE)
+                if not chunk:
+                    break
+                # 空行可能跨越两个块，从上一块末尾回退几个字节开始查找
+                start = max(0, len(buf) - 2)
+                buf += chunk
+                end = MailHeaderParser._find_header_end(buf, start)
+                if end != -1:
+                    return bytes(buf[:end])
+        return bytes(buf[:MailHeaderParser.MAX_HEADER_BYTES])
+
+    @staticmethod
+    def parse_block(block: bytes) -> MailHeaders:
+        """解析头部字节块（支持折行续写）"""
+        fields = {}
+        name = None
+        for line in block.decode("utf-8", errors="replace").splitlines():
+            if not line.strip():
+                break
+            if line[0] in " \t" and name:
+                # 折行：续接到上一个头
+                fields[name] = f"{fields[name]} {line.strip()}"
+                continue
+            if ":" not in line:
+                name = None
+                continue
+            key, value = line.split(":", 1)
+            key = key.strip().lower()
+            if key in fields:
+                name = None  # 重复的头只保留第一个
+                continue
+            fields[key] = value.strip()
+            name = key
+        return MailHeaders(fields=fields, header_bytes=len(block))
+
+    @staticmethod
+    def parse(filepath) -> Optional[MailHeaders]:
+        """读取并解析邮件头；文件不存在或无法读取时返回 None"""
+        filepath = Path(filepath)
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+
+        key = (str(filepath), stat.st_mtime_ns, stat.st_size)
+        with MailHeaderParser._lock:
+            headers = MailHeaderParser._cache.get(key)
+            if headers is not None:
+                MailHeaderParser._cache.move_to_end(key)
+                return headers
+
+        try:
+            headers = MailHeaderParser.parse_block(MailHeaderParser._read_header_block(filepath))
+        except OSError:
+            return None
+
+        with MailHeaderParser._lock:
+            MailHeaderParser._cache[key] = headers
+            MailHeaderParser._cache.move_to_end(key)
+            while len(MailHeaderParser._cache) > MAIL_HEADER_CACHE_SIZE:
+                MailHeaderParser._cache.popitem(last=False)
+        return headers
@@ -0,0 +1,194 @@
+"""
+邮件查询语言 - 将 from:/to:/before:/after:/has:attachment/larger:/smaller: 等条件解析为基于 mails 表索引的查询
+
+    from:boss@corp.com after:2026-01-01 has:attachment larger:1M 季度报告
+
+- from:/to: 含 @ 时按完整地址精确匹配，否则按地址前缀匹配（均可走 owner/folder/地址 复合索引）
+- after:/before: 日期或 ISO 时间，after 含当天、before 不含当天
+- has:attachment 命中 attachment_count > 0 的部分索引
+- larger:/smaller: 字节数，可带 K/M/G 后缀
+- 其余词语走全文检索索引（mail_fts）；没有全文索引时退化为主题 LIKE
+
+不需要读取任何邮件文件。explain() 输出生成的 SQL 与数据库的执行计划，便于确认条件命中了索引。
+"""
+import re
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import and_, column, literal_column, or_, text
+from sqlalchemy.engine import Connection
+from app.models import Mail
+from app.services.search_service import SearchService, scope_token
+
+
+class MailQueryError(ValueError):
+    """查询语句格式错误"""
+
+
+# key:value、key:"带空格的值"、"带空格的短语"、普通词
+_TERM_RE = re.compile(r'(?:(\w+):(?:"([^"]*)"|(\S+)))|"([^"]*)"|(\S+)')
+_SIZE_RE = re.compile(r"^(\d+(?:\.\d+)?)([kmg]?)b?$", re.IGNORECASE)
+_SIZE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+
+def _parse_date(key: str, value: str) -> datetime:
+    for fmt in ("%Y-%m-%d", "%Y/%m/%d"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise MailQueryError(f"{key}: 日期格式应为 YYYY-MM-DD 或 ISO 时间")
+
+
+def _parse_size(key: str, value: str) -> int:
+    match = _SIZE_RE.match(value)
+    if not match:
+        raise MailQueryError(f"{key}: 大小格式应为字节数或带 K/M/G 后缀")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).lower()])
+
+
+@dataclass
+class MailQuery:
+    """解析后的查询条件"""
+    raw: str = ""
+    from_addrs: list[str] = field(default_factory=list)
+    to_addrs: list[str] = field(default_factory=list)
+    after: Optional[datetime] = None  # created_at >= after
+    before: Optional[datetime] = None  # created_at < before
+    has_attachment: bool = False
+    min_size: Optional[int] = None  # size > min_size
+    max_size: Optional[int] = None  # size < max_size
+    terms: list[str] = field(default_factory=list)
+
+    @staticmethod
+    def parse(raw: str) -> "MailQuery":
+        """解析查询语句，格式错误时抛出 MailQueryError"""
+        query = MailQuery(raw=raw or "")
+        for key, quoted, value, phrase, word in _TERM_RE.findall(query.raw):
+            if not key:
+                text_value = phrase or word
+                if text_value:
+                    query.terms.append(text_value)
+                continue
+            key = key.lower()
+            value = (quoted if quoted else value).strip()
+            if not value:
+                raise MailQueryError(f"{key}: 缺少取值")
+            if key == "from":
+                query.from_addrs.append(value)
+            elif key == "to":
+                query.to_addrs.append(value)
+            elif key == "after":
+                date = _parse_date(key, value)
+                query.after = date if query.after is None else max(query.after, date)
+            elif key == "before":
+                date = _parse_date(key, value)
+                query.before = date if query.before is None else min(query.before, date)
+            elif key == "has":
+                if value.lower() not in ("attachment", "attachments"):
+                    raise MailQueryError("has: 只支持 has:attachment")
+                query.has_attachment = True
+            elif key == "larger":
+                size = _parse_size(key, value)
+                query.min_size = size if query.min_size is None else max(query.min_size, size)
+            elif key == "smaller":
+                size = _parse_size(key, value)
+                query.max_size = size if query.max_size is None else min(query.max_size, size)
+            else:
+                raise MailQueryError(f"不支持的查询条件: {key}:")
+        return query
+
+    def is_empty(self) -> bool:
+        return not (
+            self.from_addrs or self.to_addrs or self.after or self.before or self.has_attachment
+            or self.min_size is not None or self.max_size is not None or self.terms
+        )
+
+    def describe(self) -> dict:
+        """解析结果（用于执行计划输出）"""
+        data = asdict(self)
+        for key in ("after", "before"):
+            if data[key] is not None:
+                data[key] = data[key].isoformat()
+        return data
+
+
+class MailQueryPlanner:
+    """将 MailQuery 转换为 mails 表上的过滤条件"""
+
+    @staticmethod
+    def _address_condition(col, values: list[str]):
+        """完整地址用等值（IN）匹配，其余按前缀区间匹配，均可使用以地址为前缀列的索引"""
+        exact = [v for v in values if "@" in v]
+        clauses = [col.in_(exact)] if exact else []
+        for prefix in (v for v in values if "@" not in v):
+            # 区间比较代替 LIKE 'x%'，SQLite 默认大小写不敏感的 LIKE 无法使用索引
+            clauses.append(and_(col >= prefix, col < prefix + "\uffff"))
+        return or_(*clauses) if len(clauses) > 1 else clauses[0]
+
+    @staticmethod
+    def conditions(
+        query: MailQuery,
+        owner: Optional[str] = None,
+        folders: tuple = ("inbox",),
+        full_text: bool = True
+    ) -> list:
+        """
+        生成过滤条件（不含 owner/folder/is_deleted，由调用方按所用索引前缀添加）
+
+        Args:
+            owner: 邮件所属用户，用于把全文检索限定在该用户的索引范围内
+            full_text: 是否可以使用全文检索索引（SearchService.is_available）
+        """
+        conditions = []
+        if query.from_addrs:
+            conditions.append(MailQueryPlanner._address_condition(Mail.from_addr, query.from_addrs))
+        if query.to_addrs:
+            conditions.append(MailQueryPlanner._address_condition(Mail.to_addr, query.to_addrs))
+        if query.after is not None:
+            conditions.append(Mail.created_at >= query.after)
+        if query.before is not None:
+            conditions.append(Mail.created_at < query.before)
+        if query.has_attachment:
+            # 字面量 0：部分索引 WHERE attachment_count > 0 只在条件文本一致时可用，绑定参数不行
+            conditions.append(Mail.attachment_count > literal_column("0"))
+        if query.min_size is not None:
+            conditions.append(Mail.size > query.min_size)
+        if query.max_size is not None:
+            conditions.append(Mail.size < query.max_size)
+        if query.terms:
+            condition = MailQueryPlanner._terms_condition(query.terms, owner, folders, full_text)
+            if condition is not None:
+                conditions.append(condition)
+        return conditions
+
+    @staticmethod
+    def _terms_condition(terms: list[str], owner: Optional[str], folders: tuple, full_text: bool):
+        """其余词语：全文检索命中的邮件 ID（子查询），无全文索引时按主题 LIKE"""
+        if not full_text:
+            return and_(*(Mail.subject.like(f"%{term}%") for term in terms))
+        match = SearchService.build_match(" ".join(terms))
+        if match is None:
+            return None
+        if owner is not None:
+            scopes = " OR ".join(scope_token(owner, folder) for folder in folders)
+            match = f"scope:({scopes}) AND ({match})"
+        ids = text("SELECT rowid FROM mail_fts WHERE mail_fts MATCH :mail_query_match").bindparams(
+            mail_query_match=match
+        ).columns(column("rowid"))
+        return Mail.id.in_(ids)
+
+    @staticmethod
+    def explain(conn: Connection, stmt, query: MailQuery) -> dict:
+        """生成的 SQL 及执行计划（SQLite 为 EXPLAIN QUERY PLAN 的各步骤）"""
+        compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+        plan = []
+        if conn.dialect.name == "sqlite":
+            params = compiled.construct_params()
+            positional = tuple(params[name] for name in compiled.positiontup)
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", positional).all()
+            plan = [row[-1] for row in rows]
+        return {"filters": query.describe(), "sql": str(compiled), "plan": plan}
@@ -1,16 +1,43 @@
 """
 邮件存储服务 - 邮件文件保存与管理
 """
+import gzip
+import hashlib
+import json
+import mimetypes
 import os
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 from pathlib import Path
-from app.config import MAIL_DOMAIN
+from app.config import MAIL_DOMAIN, MAIL_STORAGE_BACKEND, MAIL_STORAGE_LAYOUT
+from sqlalchemy import select, update, func, or_
+from sqlalchemy.exc import IntegrityError
+from app.db import SessionLocal
+from app.models import Mail, MailboxStat
+from app.services.change_journal import ChangeJournal
+from app.services.log_service import LogService
+from app.services.mail_cache import MailContentCache
+from app.services.mail_events import MailEventHub
+from app.services.mail_headers import MailHeaderParser, MailHeaders
+from app.services.mail_query import MailQuery, MailQueryPlanner
+from app.services.search_service import SearchService
+from app.services.mail_backends import SCANNERS, create_backend, lookup_backends, normalize_flags
+from app.utils.content_type import SNIFF_BYTES, detect_content_type, detect_file_content_type
+from app.utils.durable_file import write_text_atomic, sync_directories
+from app.utils.message_id import new_mail_filename
 
 
 class MailStorageService:
     """邮件存储服务"""
     
     BASE_DIR = "mailbox"
+
+    # 邮件文件存储后端（.txt 文件布局或 Maildir）
+    backend = create_backend(BASE_DIR, MAIL_STORAGE_BACKEND, MAIL_STORAGE_LAYOUT)
+
+    _HASH_BLOCK_SIZE = 1024 * 1024
+    # 附件清单读-改-写（以及附件文件替换）的互斥锁
+    _manifest_lock = threading.RLock()
     
     @staticmethod
     def ensure_user_mailbox(username: str) -> Path:
@@ -19,6 +46,51 @@ class MailStorageService:
         user_dir.mkdir(parents=True, exist_ok=True)
         return user_dir
 
+    @staticmethod
+    def _resolve_filename(filename: str = None) -> str:
+        """
+        确定邮件文件名：未指定时生成新的邮件 ID；指定时补全 .txt 后缀
+
+        指定的文件名只能是单层文件名，不能包含路径，否则抛出 ValueError
+        """
+        if not filename:
+            return new_mail_filename()
+        if not MailStorageService.is_valid_mail_filename(filename):
+            raise ValueError(f"非法的邮件文件名: {filename}")
+        # 兼容传入不带后缀的情况
+        return filename if filename.endswith(".txt") else f"{filename}.txt"
+
+    @staticmethod
+    def is_valid_mail_filename(filename: str) -> bool:
+        """邮件文件名只能是单层文件名：不含路径、不是 . / ..、不以点开头"""
+        return bool(filename) and Path(filename).name == filename and not filename.startswith(".")
+
+    @staticmethod
+    def _attachment_mail_name(mail_filename: str) -> str:
+        """附件目录、清单、HTML 正文与缩略图目录使用的邮件名（去掉 .txt），文件名不合法时抛出 ValueError"""
+        if not MailStorageService.is_valid_mail_filename(mail_filename):
+            raise ValueError(f"非法的邮件文件名: {mail_filename}")
+        return mail_filename.replace(".txt", "")
+
+    @staticmethod
+    def is_attachment_target(username: str, mail_filename: str) -> bool:
+        """
+        附件能否上传到该邮件名下
+
+        附件在发送前上传，邮件名可以是客户端生成、尚未登记的暂存名；
+        已登记的邮件名必须是当前用户邮箱中未删除的邮件。
+        """
+        if not MailStorageService.is_valid_mail_filename(mail_filename):
+            return False
+        db = SessionLocal()
+        try:
+            owners = set(db.execute(
+                select(Mail.owner).where(Mail.filename == mail_filename, Mail.is_deleted == 0)
+            ).scalars())
+        finally:
+            db.close()
+        return not owners or username in owners
+
     @staticmethod
     def ensure_user_draftbox(username: str) -> Path:
         """确保用户草稿箱目录存在"""
@@ -30,21 +102,20 @@ class MailStorageService:
     def save_draft(username: str, to_addr: str, subject: str, body: str, filename: str = None) -> str:
         """保存草稿"""
         draft_dir = MailStorageService.ensure_user_draftbox(username)
-        
-        if not filename:
-            # 如果没有提供文件名，创建新的
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-            filename = f"{timestamp}.txt"
-        
+        # 未提供文件名时创建新草稿，否则覆盖已有草稿
+        filename = MailStorageService._resolve_filename(filename)
         filepath = draft_dir / filename
-        
-        with open(filepath, "w", encoding="utf-8") as f:
-            f.write(f"To: {to_addr}\n")
-            f.write(f"Subject: {subject}\n")
-            f.write(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write("\n")
-            f.write(body)
-            
+
+        content = (
+            f"To: {to_addr}\n"
+            f"Subject: {subject}\n"
+            f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+            "\n"
+            f"{body}"
+        )
+        write_text_atomic(filepath, content)
+        MailContentCache.invalidate(filepath)
+
         return filename
 
     @staticmethod
@@ -57,29 +128,17 @@ class MailStorageService:
         drafts = []
         for draft_file in sorted(draft_dir.glob("*.txt"), reverse=True):
             if draft_file.is_file():
-                # 读取草稿以获取主题和收件人（简单解析）
-                subject = "(无主题)"
-                to_addr = ""
-                try:
-                    with open(draft_file, "r", encoding="utf-8") as f:
-                        lines = f.readlines()
-                        for line in lines:
-                            if line.startswith("Subject:"):
-                                subject = line[8:].strip() or "(无主题)"
-                            elif line.startswith("To:"):
-                                to_addr = line[3:].strip()
-                            if line.strip() == "": # End of headers
-                                break
-                except:
-                    pass
+                # 只解析头部获取主题和收件人
+                headers = MailHeaderParser.parse(draft_file) or MailHeaders()
+                stat = draft_file.stat()
 
                 drafts.append({
                     "filename": draft_file.name,
                     "path": str(draft_file),
-                    "size": draft_file.stat().st_size,
-                    "created": datetime.fromtimestamp(draft_file.stat().st_ctime),
-                    "subject": subject,
-                    "to": to_addr
+                    "size": stat.st_size,
+                    "created": datetime.fromtimestamp(stat.st_ctime),
+                    "subject": headers.subject or "(无主题)",
+                    "to": headers.to_addr or ""
                 })
         return drafts
 
@@ -87,11 +146,10 @@ class MailStorageService:
     def read_draft(username: str, filename: str) -> str:
         """读取草稿内容"""
         filepath = Path(MailStorageService.BASE_DIR) / username / "drafts" / filename
-        if not filepath.exists():
+        try:
+            return MailContentCache.read(filepath)
+        except FileNotFoundError:
             return None
-        
-        with open(filepath, "r", encoding="utf-8") as f:
-            return f.read()
 
     @staticmethod
     def delete_draft(username: str, filename: str) -> bool:
@@ -99,10 +157,44 @@ class MailStorageService:
         filepath = Path(MailStorageService.BASE_DIR) / username / "drafts" / filename
         if filepath.exists():
             filepath.unlink()
+            MailContentCache.invalidate(filepath)
             return True
         return False
 
-    
+
+    @staticmethod
+    def get_mail_path(username: str, folder: str, filename: str, flags: str = "") -> Path:
+        """按当前存储后端计算邮件文件路径（不访问文件系统）"""
+        return MailStorageService.backend.path_for(username, folder, filename, flags)
+
+    @staticmethod
+    def locate_mail(username: str, folder: str, filename: str, flags: str = "") -> Path | None:
+        """
+        查找邮件文件的实际位置：先查当前后端，再查其他布局（兼容迁移中与迁移前的文件）
+
+        每种布局只检查计算出的路径；在线迁移或标记更新可能恰好在两次检查之间移动文件，因此重试一轮。
+        """
+        backends = lookup_backends(MailStorageService.backend)
+        for _ in range(2):
+            for backend in backends:
+                filepath = backend.locate(username, folder, filename, flags)
+                if filepath is not None:
+                    return filepath
+        return None
+
+    @staticmethod
+    def _read_mail_file(username: str, folder: str, filename: str, flags: str = "") -> str | None:
+        """读取邮件文件内容；定位后文件被移走时重新定位一次"""
+        for _ in range(2):
+            filepath = MailStorageService.locate_mail(username, folder, filename, flags)
+            if filepath is None:
+                return None
+            try:
+                return MailContentCache.read(filepath)
+            except FileNotFoundError:
+                continue
+        return None
+
     @staticmethod
     def ensure_user_sentbox(username: str) -> Path:
         """确保用户发件箱目录存在"""
@@ -124,35 +216,89 @@ class MailStorageService:
         # 提取用户名（去掉 @domain 部分）
         username = to_addr.split("@")[0] if "@" in to_addr else to_addr
 
-        # 确保用户邮箱目录存在
-        user_dir = MailStorageService.ensure_user_mailbox(username)
-
         # 生成或使用指定文件名
-        if filename:
-            # 兼容传入不带后缀的情况
-            if not filename.endswith(".txt"):
-                filename = f"{filename}.txt"
-        else:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-            filename = f"{timestamp}.txt"
-
-        filepath = user_dir / filename
+        filename = MailStorageService._resolve_filename(filename)
+        created_at = datetime.now()
 
         # 写入邮件内容（标准RFC格式）
-        with open(filepath, "w", encoding="utf-8") as f:
-            f.write(f"From: {from_addr}\n")
-            f.write(f"To: {to_addr}\n")
-            f.write(f"Subject: {subject}\n")
-            f.write(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            # 如果是回复邮件，添加回复关联头
-            if reply_to_filename:
-                f.write(f"In-Reply-To: {reply_to_filename}\n")
-                f.write(f"References: {reply_to_filename}\n")
-            f.write("\n")
-            f.write(body)
+        content = MailStorageService._format_mail(from_addr, to_addr, subject, body, created_at, reply_to_filename)
+        filepath = MailStorageService.backend.deliver(username, "inbox", filename, content)
+
+        MailStorageService._catalog_mail(
+            owner=username,
+            folder="inbox",
+            filename=filename,
+            filepath=filepath,
+            from_addr=from_addr,
+            to_addr=to_addr,
+            subject=subject,
+            created_at=created_at,
+            in_reply_to=reply_to_filename,
+            body=body
+        )
 
         return str(filepath)
 
+    @staticmethod
+    def save_mail_batch(to_addrs: list, from_addr: str, subject: str, body: str) -> int:
+        """
+        将同一封邮件批量投递到多个收件箱（用于群发）
+
+        文件逐个原子写入，写完后统一 fsync 涉及的目录，再在一个事务中批量插入 mails 表记录；
+        登记失败时删除本批次已写入的文件并抛出异常。
+
+        Returns:
+            投递成功的邮件数
+        """
+        created_at = datetime.now()
+        filename = new_mail_filename()
+        rows = []
+        try:
+            for to_addr in to_addrs:
+                username = to_addr.split("@")[0] if "@" in to_addr else to_addr
+                content = MailStorageService._format_mail(from_addr, to_addr, subject, body, created_at)
+                filepath = MailStorageService.backend.deliver(username, "inbox", filename, content, sync_dir=False)
+                rows.append({
+                    "owner": username,
+                    "folder": "inbox",
+                    "filename": filename,
+                    "file_path": str(filepath),
+                    "from_addr": from_addr,
+                    "to_addr": to_addr,
+                    "subject": subject,
+                    "size": filepath.stat().st_size,
+                    "created_at": created_at,
+                    "is_deleted": 0,
+                    "thread_root": filename,
+                })
+            if rows:
+                sync_directories(Path(row["file_path"]).parent for row in rows)
+                with SessionLocal() as db:
+                    db.execute(Mail.__table__.insert(), rows)
+                    for row in rows:
+                        MailStorageService._bump_stats(db, row["owner"], "inbox", 1, row["size"])
+                    ChangeJournal.record_many(db, [(row["owner"], "inbox", filename, "add", "") for row in rows])
+                    # 群发邮件没有附件，按 (owner, filename) 取回新行 ID 后批量写入检索索引
+                    ids = dict(db.query(Mail.owner, Mail.id).filter(
+                        Mail.folder == "inbox",
+                        Mail.filename == filename,
+                        Mail.owner.in_([row["owner"] for row in rows])
+                    ).all())
+                    SearchService.index_mails(db.connection(), [
+                        {**row, "id": ids[row["owner"]], "body": body}
+                        for row in rows if row["owner"] in ids
+                    ])
+                    db.commit()
+        except Exception:
+            for row in rows:
+                Path(row["file_path"]).unlink(missing_ok=True)
+            raise
+        for row in rows:
+            MailEventHub.publish(row["owner"], MailStorageService._new_mail_event(
+                "inbox", filename, from_addr, subject, row["size"]
+            ))
+        return len(rows)
+
     @staticmethod
     def save_sent_mail(from_addr: str, to_addrs: list, subject: str, body: str, reply_to_filename: str = None, filename: str = None) -> str:
         """
@@ -168,100 +314,663 @@ class MailStorageService:
         # 提取发件人用户名
         username = from_addr.split("@")[0] if "@" in from_addr else from_addr
 
-        # 确保发件箱目录存在
-        sent_dir = MailStorageService.ensure_user_sentbox(username)
-
         # 生成或使用指定文件名
-        if filename:
-            if not filename.endswith(".txt"):
-                filename = f"{filename}.txt"
-        else:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-            filename = f"{timestamp}.txt"
-        filepath = sent_dir / filename
+        filename = MailStorageService._resolve_filename(filename)
+        created_at = datetime.now()
 
         # 写入邮件内容
         to_str = ", ".join(to_addrs)
-        with open(filepath, "w", encoding="utf-8") as f:
-            f.write(f"From: {from_addr}\n")
-            f.write(f"To: {to_str}\n")
-            f.write(f"Subject: {subject}\n")
-            f.write(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            # 如果是回复邮件，添加回复关联头
-            if reply_to_filename:
-                f.write(f"In-Reply-To: {reply_to_filename}\n")
-                f.write(f"References: {reply_to_filename}\n")
-            f.write("\n")
-            f.write(body)
+        content = MailStorageService._format_mail(from_addr, to_str, subject, body, created_at, reply_to_filename)
+        filepath = MailStorageService.backend.deliver(username, "sent", filename, content)
+
+        MailStorageService._catalog_mail(
+            owner=username,
+            folder="sent",
+            filename=filename,
+            filepath=filepath,
+            from_addr=from_addr,
+            to_addr=to_str,
+            subject=subject,
+            created_at=created_at,
+            in_reply_to=reply_to_filename,
+            body=body
+        )
 
         return str(filepath)
 
+    @staticmethod
+    def _format_mail(
+        from_addr: str,
+        to_addr: str,
+        subject: str,
+        body: str,
+        created_at: datetime,
+        reply_to_filename: str = None
+    ) -> str:
+        """按统一格式生成邮件文件内容（由存储后端原子写入，读取方不会看到写了一半的邮件）"""
+        lines = [
+            f"From: {from_addr}\n",
+            f"To: {to_addr}\n",
+            f"Subject: {subject}\n",
+            f"Date: {created_at.strftime('%Y-%m-%d %H:%M:%S')}\n",
+        ]
+        # 如果是回复邮件，添加回复关联头
+        if reply_to_filename:
+            lines.append(f"In-Reply-To: {reply_to_filename}\n")
+            lines.append(f"References: {reply_to_filename}\n")
+        lines.append("\n")
+        lines.append(body)
+        return "".join(lines)
+
+    @staticmethod
+    def _catalog_mail(
+        owner: str,
+        folder: str,
+        filename: str,
+        filepath: Path,
+        from_addr: str,
+        to_addr: str,
+        subject: str,
+        created_at: datetime,
+        in_reply_to: str = None,
+        body: str = ""
+    ) -> None:
+        """
+        将邮件登记到 mails 表，并在同一事务中更新全文检索索引
+
+        与文件写入视为同一操作：登记失败时删除刚写入的文件并抛出异常，
+        保证文件与索引不会出现只有一方的情况。
+        """
+        try:
+            with SessionLocal() as db:
+                row = db.query(Mail).filter(
+                    Mail.owner == owner,
+                    Mail.folder == folder,
+                    Mail.filename == filename
+                ).first()
+                # 统计增量：新邮件计数 +1；覆盖未删除的同名邮件只调整字节数
+                size = filepath.stat().st_size
+                if row is not None and row.is_deleted == 0:
+                    MailStorageService._bump_stats(db, owner, folder, 0, size - (row.size or 0))
+                else:
+                    MailStorageService._bump_stats(db, owner, folder, 1, size)
+                if row is None:
+                    row = Mail(owner=owner, folder=folder, filename=filename)
+                    db.add(row)
+                elif row.file_path and row.file_path != str(filepath):
+                    # 覆盖同名邮件时旧文件位于其他位置（带标记的 Maildir 文件或迁移前的布局）
+                    Path(row.file_path).unlink(missing_ok=True)
+                    MailContentCache.invalidate(row.file_path)
+                row.from_addr = from_addr
+                row.to_addr = to_addr
+                row.subject = subject
+                row.file_path = str(filepath)
+                row.size = size
+                row.created_at = created_at
+                row.is_deleted = 0
+                row.deleted_at = None
+                row.flags = ""
+                row.in_reply_to = in_reply_to
+                row.thread_root = MailStorageService._resolve_thread_root(db, owner, filename, in_reply_to)
+                attachment_names, row.attachment_count = MailStorageService.get_attachment_summary(owner, filename)
+                db.flush()
+                SearchService.index_mail(
+                    db.connection(), row.id, owner, folder, subject, body, from_addr, to_addr, attachment_names
+                )
+                ChangeJournal.record(db, owner, folder, filename, "add")
+                db.commit()
+            MailContentCache.invalidate(filepath)
+        except Exception:
+            filepath.unlink(missing_ok=True)
+            raise
+        MailEventHub.publish(owner, MailStorageService._new_mail_event(folder, filename, from_addr, subject, size))
+
+    @staticmethod
+    def _new_mail_event(folder: str, filename: str, from_addr: str, subject: str, size: int) -> dict:
+        """新邮件推送事件（只含列表展示所需的摘要）"""
+        return {
+            "action": "add",
+            "folder": folder,
+            "filename": filename,
+            "from_addr": from_addr,
+            "subject": subject,
+            "size": size,
+        }
+
+    @staticmethod
+    def _resolve_thread_root(db, owner: str, filename: str, in_reply_to: str = None) -> str:
+        """确定邮件所属会话根：父邮件在本用户邮箱中时继承其会话根，否则自身为根"""
+        if not in_reply_to:
+            return filename
+        parent = db.query(Mail.thread_root).filter(
+            Mail.owner == owner,
+            Mail.filename == in_reply_to
+        ).first()
+        if parent is None:
+            return filename
+        return parent.thread_root or in_reply_to
+
+    @staticmethod
+    def _bump_stats(db, owner: str, folder: str, count_delta: int, bytes_delta: int) -> None:
+        """在当前事务中增量更新邮箱统计并递增邮箱版本号（不存在时创建）；增量为 0 时只递增版本号"""
+        stmt = update(MailboxStat).where(
+            MailboxStat.owner == owner,
+            MailboxStat.folder == folder
+        ).values(
+            message_count=MailboxStat.message_count + count_delta,
+            total_bytes=MailboxStat.total_bytes + bytes_delta,
+            version=MailboxStat.version + 1
+        )
+        if db.execute(stmt).rowcount:
+            return
+        try:
+            with db.begin_nested():
+                db.add(MailboxStat(
+                    owner=owner, folder=folder, message_count=count_delta, total_bytes=bytes_delta, version=1
+                ))
+        except IntegrityError:
+            # 并发创建：另一事务已插入，改为增量更新
+            db.execute(stmt)
+
+    @staticmethod
+    def touch_mailbox(db, owner: str, folder: str) -> None:
+        """在当前事务中递增邮箱版本号（邮件数与字节数不变，但列表内容有变化时调用）"""
+        MailStorageService._bump_stats(db, owner, folder, 0, 0)
+
+    @staticmethod
+    def _mail_row_to_dict(row) -> dict:
+        """mails 表记录转换为列表项"""
+        flags = row.flags or ""
+        return {
+            "filename": row.filename,
+            "path": row.file_path,
+            "size": row.size,
+            "created": row.created_at,
+            "flags": flags,
+            "is_read": "S" in flags
+        }
+
+    @staticmethod
+    def _list_folder(username: str, folder: str) -> list:
+        """按索引列出指定文件夹中未删除的邮件（按时间倒序）"""
+        with SessionLocal() as db:
+            rows = db.query(Mail.filename, Mail.file_path, Mail.size, Mail.created_at, Mail.flags).filter(
+                Mail.owner == username,
+                Mail.folder == folder,
+                Mail.is_deleted == 0
+            ).order_by(Mail.created_at.desc(), Mail.id.desc()).all()
+        return [MailStorageService._mail_row_to_dict(row) for row in rows]
+
+    @staticmethod
+    def query_mails(username: str, folder: str, query: MailQuery, explain: bool = False) -> tuple[list, dict | None]:
+        """
+        按查询语言条件列出文件夹中未删除的邮件（按时间倒序），只查询 mails 表与全文索引
+
+        Returns:
+            (邮件列表, 执行计划)；explain 为 False 时执行计划为 None
+        """
+        with SessionLocal() as db:
+            conn = db.connection()
+            stmt = select(Mail.filename, Mail.file_path, Mail.size, Mail.created_at, Mail.flags).where(
+                Mail.owner == username,
+                Mail.folder == folder,
+                Mail.is_deleted == 0,
+                *MailQueryPlanner.conditions(
+                    query, owner=username, folders=(folder,), full_text=SearchService.is_available(conn)
+                )
+            ).order_by(Mail.created_at.desc(), Mail.id.desc())
+            rows = db.execute(stmt).all()
+            plan = MailQueryPlanner.explain(conn, stmt, query) if explain else None
+        return [MailStorageService._mail_row_to_dict(row) for row in rows], plan
+
+    @staticmethod
+    def get_mail_changes(username: str, since: int, limit: int = 500) -> dict:
+        """
+        增量同步：since 之后的邮件变更（见 ChangeJournal.changes_since）
+
+        新增的邮件附带与列表项相同的元数据；在本页之后已被删除的邮件不返回新增，
+        其删除变更会在后续页中出现。
+        """
+        result = ChangeJournal.changes_since(username, since, limit)
+        added = [c for c in result["changes"] if c["action"] == "add"]
+        if added:
+            with SessionLocal() as db:
+                rows = db.query(
+                    Mail.folder, Mail.filename, Mail.file_path, Mail.size, Mail.created_at, Mail.flags
+                ).filter(
+                    Mail.owner == username,
+                    Mail.filename.in_({c["filename"] for c in added}),
+                    Mail.is_deleted == 0
+                ).all()
+            mails = {(row.folder, row.filename): MailStorageService._mail_row_to_dict(row) for row in rows}
+            changes = []
+            for change in result["changes"]:
+                if change["action"] == "add":
+                    mail = mails.get((change["folder"], change["filename"]))
+                    if mail is None:
+                        continue
+                    change["mail"] = mail
+                    change["flags"] = mail["flags"]
+                changes.append(change)
+            result["changes"] = changes
+        return result
+
+    @staticmethod
+    def get_mailbox_version(username: str, folder: str) -> int:
+        """邮箱版本号（邮件写入、删除、标记变化时递增；从未写入过时为 0）"""
+        with SessionLocal() as db:
+            version = db.query(MailboxStat.version).filter(
+                MailboxStat.owner == username,
+                MailboxStat.folder == folder
+            ).scalar()
+        return version or 0
+
+    @staticmethod
+    def get_mail_version(username: str, folder: str, filename: str) -> tuple | None:
+        """
+        邮件内容版本：邮件文件的 (inode, mtime_ns, 大小) 与附件清单的 mtime_ns，邮件不存在或已删除时返回 None
+
+        Maildir 标记变化只重命名文件，版本不变。
+        """
+        with SessionLocal() as db:
+            row = db.query(Mail.is_deleted, Mail.flags).filter(
+                Mail.owner == username,
+                Mail.folder == folder,
+                Mail.filename == filename
+            ).first()
+        if row is not None and row.is_deleted == 1:
+            return None
+        filepath = MailStorageService.locate_mail(username, folder, filename, row.flags if row else "")
+        if filepath is None:
+            return None
+        try:
+            stat = filepath.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size, MailStorageService.get_attachments_version(username, filename)
+
+    @staticmethod
+    def get_attachments_version(username: str, mail_filename: str) -> int:
+        """附件清单版本（清单文件的 mtime_ns；附件增删与后处理都会重写清单），无清单时为 0"""
+        try:
+            return MailStorageService.get_attachment_manifest_path(username, mail_filename).stat().st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
     @staticmethod
     def list_user_mails(username: str) -> list:
         """列出用户的所有邮件（收件箱）"""
-        user_dir = Path(MailStorageService.BASE_DIR) / username
-        if not user_dir.exists():
-            return []
-
-        mails = []
-        # 只列出根目录下的 .txt 文件，不递归（避免包含 sent 子目录）
-        for mail_file in sorted(user_dir.glob("*.txt"), reverse=True):
-            if mail_file.is_file():
-                mails.append({
-                    "filename": mail_file.name,
-                    "path": str(mail_file),
-                    "size": mail_file.stat().st_size,
-                    "created": datetime.fromtimestamp(mail_file.stat().st_ctime)
-                })
-        return mails
+        return MailStorageService._list_folder(username, "inbox")
 
     @staticmethod
     def list_sent_mails(username: str) -> list:
         """列出用户的所有已发送邮件"""
-        sent_dir = Path(MailStorageService.BASE_DIR) / username / "sent"
-        if not sent_dir.exists():
-            return []
-
-        mails = []
-        for mail_file in sorted(sent_dir.glob("*.txt"), reverse=True):
-            if mail_file.is_file():
-                mails.append({
-                    "filename": mail_file.name,
-                    "path": str(mail_file),
-                    "size": mail_file.stat().st_size,
-                    "created": datetime.fromtimestamp(mail_file.stat().st_ctime)
-                })
-        return mails
+        return MailStorageService._list_folder(username, "sent")
 
     @staticmethod
     def read_mail(username: str, filename: str) -> str:
         """读取邮件内容（收件箱）"""
-        filepath = Path(MailStorageService.BASE_DIR) / username / filename
-        if not filepath.exists():
-            return None
-
-        with open(filepath, "r", encoding="utf-8") as f:
-            return f.read()
+        return MailStorageService._read_folder_mail(username, "inbox", filename)
 
     @staticmethod
     def read_sent_mail(username: str, filename: str) -> str:
         """读取已发送邮件内容"""
-        filepath = Path(MailStorageService.BASE_DIR) / username / "sent" / filename
-        if not filepath.exists():
-            return None
+        return MailStorageService._read_folder_mail(username, "sent", filename)
 
-        with open(filepath, "r", encoding="utf-8") as f:
-            return f.read()
+    @staticmethod
+    def _read_folder_mail(username: str, folder: str, filename: str) -> str | None:
+        """读取指定文件夹中的邮件，已软删除的邮件返回 None（文件在清理前仍在磁盘上）"""
+        with SessionLocal() as db:
+            row = db.query(Mail.is_deleted, Mail.flags).filter(
+                Mail.owner == username,
+                Mail.folder == folder,
+                Mail.filename == filename
+            ).first()
+        if row is not None and row.is_deleted == 1:
+            return None
+        return MailStorageService._read_mail_file(username, folder, filename, row.flags if row else "")
 
 
     @staticmethod
     def delete_mail(username: str, filename: str) -> bool:
-        """删除邮件"""
-        filepath = Path(MailStorageService.BASE_DIR) / username / filename
-        if filepath.exists():
-            filepath.unlink()
-            return True
-        return False
+        """删除邮件（软删除，文件由后台清理任务删除）"""
+        return MailStorageService.delete_mails(username, [filename])[filename]
+
+    @staticmethod
+    def delete_mails(username: str, filenames: list, folder: str = "inbox") -> dict:
+        """
+        批量删除邮件（软删除），统计、全文索引与变更日志在同一事务中更新
+
+        Returns:
+            {文件名: 是否删除}，已删除或不存在的邮件为 False
+        """
+        filenames = list(dict.fromkeys(filenames))
+        results = dict.fromkeys(filenames, False)
+        if not filenames:
+            return results
+        with SessionLocal() as db:
+            rows = db.query(Mail).filter(
+                Mail.owner == username,
+                Mail.folder == folder,
+                Mail.filename.in_(filenames)
+            ).all()
+            registered = {row.filename for row in rows}
+            rows = [row for row in rows if row.is_deleted == 0]
+            # 提交后对象过期，先取出提交后还要用的字段
+            deleted = [(row.filename, row.file_path) for row in rows]
+            if rows:
+                now = datetime.now()
+                for row in rows:
+                    row.is_deleted = 1
+                    row.deleted_at = now
+                MailStorageService._bump_stats(db, username, folder, -len(rows), -sum(row.size or 0 for row in rows))
+                SearchService.remove_mails(db.connection(), [row.id for row in rows])
+                ChangeJournal.record_many(db, [(username, folder, name, "delete", "") for name, _ in deleted])
+                db.commit()
+
+        for filename, file_path in deleted:
+            results[filename] = True
+            MailContentCache.invalidate(file_path)
+            MailEventHub.publish(username, {"action": "delete", "folder": folder, "filename": filename})
+
+        # 未登记的文件直接删除
+        for filename in filenames:
+            if filename in registered:
+                continue
+            filepath = MailStorageService.locate_mail(username, folder, filename)
+            if filepath is not None:
+                filepath.unlink(missing_ok=True)
+                MailContentCache.invalidate(filepath)
+                results[filename] = True
+        return results
+
+    @staticmethod
+    def move_mails(username: str, filenames: list, folder: str, target_folder: str) -> dict:
+        """
+        批量移动邮件到另一文件夹：移动文件并在同一事务中更新记录、两侧统计、全文索引范围与变更日志
+
+        附件目录按邮件文件名存放，与文件夹无关，无需移动。
+
+        目标文件夹中已软删除的同名邮件不算冲突：其记录在同一事务中删除（唯一索引按 owner/folder/filename），
+        文件在提交后删除，避免清理任务日后删掉移入的邮件文件。
+
+        Returns:
+            {文件名: 结果}，结果为 moved / not_found / conflict（目标文件夹已有同名邮件）
+        """
+        filenames = list(dict.fromkeys(filenames))
+        results = dict.fromkeys(filenames, "not_found")
+        if not filenames or folder == target_folder:
+            return results
+        moved = []
+        stale_paths = []
+        # 已完成的文件移动 (原路径, 新路径)：提交前任何一步失败都按相反顺序移回，文件与记录保持一致
+        renamed = []
+        try:
+            with SessionLocal() as db:
+                rows = db.query(Mail).filter(
+                    Mail.owner == username,
+                    Mail.folder == folder,
+                    Mail.filename.in_(filenames),
+                    Mail.is_deleted == 0
+                ).all()
+                target_rows = db.query(Mail).filter(
+                    Mail.owner == username,
+                    Mail.folder == target_folder,
+                    Mail.filename.in_([row.filename for row in rows])
+                ).all() if rows else []
+                conflicts = {row.filename for row in target_rows if row.is_deleted == 0}
+                stale = [row for row in target_rows if row.is_deleted == 1]
+                if stale:
+                    for row in stale:
+                        filepath = MailStorageService.locate_mail(username, target_folder, row.filename, row.flags)
+                        if filepath is not None:
+                            stale_paths.append(filepath)
+                        db.delete(row)
+                    SearchService.remove_mails(db.connection(), [row.id for row in stale])
+                    db.flush()
+
+                for row in rows:
+                    if row.filename in conflicts:
+                        results[row.filename] = "conflict"
+                        continue
+                    flags = row.flags or ""
+                    filepath = MailStorageService.locate_mail(username, folder, row.filename, flags)
+                    if filepath is None:
+                        continue
+                    new_path = MailStorageService.get_mail_path(username, target_folder, row.filename, flags)
+                    new_path.parent.mkdir(parents=True, exist_ok=True)
+                    os.replace(filepath, new_path)
+                    renamed.append((filepath, new_path))
+                    row.folder = target_folder
+                    row.file_path = str(new_path)
+                    moved.append((row.id, row.filename, row.from_addr, row.subject, row.size or 0, flags))
+
+                if moved:
+                    moved_bytes = sum(item[4] for item in moved)
+                    MailStorageService._bump_stats(db, username, folder, -len(moved), -moved_bytes)
+                    MailStorageService._bump_stats(db, username, target_folder, len(moved), moved_bytes)
+                    SearchService.move_mails(db.connection(), username, target_folder, [item[0] for item in moved])
+                    changes = []
+                    for _, filename, _, _, _, flags in moved:
+                        changes.append((username, folder, filename, "delete", ""))
+                        changes.append((username, target_folder, filename, "add", flags))
+                    ChangeJournal.record_many(db, changes)
+                    db.commit()
+        except BaseException:
+            MailStorageService._undo_renames(renamed)
+            raise
+
+        for old_path, new_path in renamed:
+            MailContentCache.move(old_path, new_path)
+        new_paths = {new_path for _, new_path in renamed}
+        for filepath in stale_paths:
+            # 与移入的邮件同一路径时文件已被覆盖，不能删除
+            if filepath not in new_paths:
+                filepath.unlink(missing_ok=True)
+                MailContentCache.invalidate(filepath)
+        for _, filename, from_addr, subject, size, _ in moved:
+            results[filename] = "moved"
+            MailEventHub.publish(username, {"action": "delete", "folder": folder, "filename": filename})
+            MailEventHub.publish(
+                username, MailStorageService._new_mail_event(target_folder, filename, from_addr, subject, size)
+            )
+        return results
+
+    @staticmethod
+    def _undo_renames(renamed: list) -> None:
+        """按相反顺序撤销已完成的文件移动 [(原路径, 新路径)]（事务未提交时调用）"""
+        for old_path, new_path in reversed(renamed):
+            try:
+                os.replace(new_path, old_path)
+            except OSError as e:
+                LogService.log_system(f"邮件文件回滚失败: {new_path} -> {old_path}, 错误: {e}")
+
+    @staticmethod
+    def read_mails(username: str, filenames: list, folder: str = "inbox") -> dict:
+        """
+        批量读取邮件内容：一次查询取得各邮件的删除状态与标记，再逐个读取文件（经内容缓存）
+
+        Returns:
+            {文件名: 内容}，已删除或不存在的邮件为 None
+        """
+        filenames = list(dict.fromkeys(filenames))
+        if not filenames:
+            return {}
+        with SessionLocal() as db:
+            rows = {
+                row.filename: row
+                for row in db.query(Mail.filename, Mail.is_deleted, Mail.flags).filter(
+                    Mail.owner == username,
+                    Mail.folder == folder,
+                    Mail.filename.in_(filenames)
+                )
+            }
+        results = {}
+        for filename in filenames:
+            row = rows.get(filename)
+            if row is not None and row.is_deleted == 1:
+                results[filename] = None
+                continue
+            results[filename] = MailStorageService._read_mail_file(
+                username, folder, filename, row.flags if row else ""
+            )
+        return results
+
+    @staticmethod
+    def purge_deleted_mails(older_than_minutes: int = 0) -> int:
+        """
+        物理删除软删除超过指定时长的邮件文件及其记录，返回清理数量
+
+        附件目录、附件清单、HTML 正文与缩略图按邮件文件名存放，收件箱与发件箱的同名邮件共用；
+        提交后仅在该用户已没有引用同一文件名的记录时删除。
+        """
+        cutoff = datetime.now() - timedelta(minutes=older_than_minutes)
+        with SessionLocal() as db:
+            rows = db.query(Mail).filter(
+                Mail.is_deleted == 1,
+                Mail.deleted_at <= cutoff
+            ).all()
+            for row in rows:
+                # 登记路径可能已被布局迁移改变，按计算路径重新定位
+                filepath = Path(row.file_path) if row.file_path else None
+                if filepath is None or not filepath.exists():
+                    filepath = MailStorageService.locate_mail(row.owner, row.folder, row.filename, row.flags)
+                if filepath is not None:
+                    filepath.unlink(missing_ok=True)
+                    MailContentCache.invalidate(filepath)
+                db.delete(row)
+            SearchService.remove_mails(db.connection(), [row.id for row in rows])
+            purged = {(row.owner, row.filename) for row in rows}
+            db.flush()
+            referenced = set()
+            for owner in {owner for owner, _ in purged}:
+                names = [name for o, name in purged if o == owner]
+                referenced.update(
+                    (owner, name) for (name,) in db.query(Mail.filename).filter(
+                        Mail.owner == owner,
+                        Mail.filename.in_(names)
+                    )
+                )
+            db.commit()
+        for owner, filename in purged - referenced:
+            if MailStorageService.is_valid_mail_filename(filename):
+                MailStorageService.remove_mail_assets(owner, filename)
+        return len(rows)
+
+    @staticmethod
+    def set_mail_flags(username: str, filename: str, add: str = "", remove: str = "", folder: str = "inbox") -> str | None:
+        """
+        更新邮件标记（Maildir 标记字母，如 S 已读、F 加星），返回更新后的标记，邮件不存在时返回 None
+
+        mails 表保存标记供列表查询；Maildir 后端同时把标记写进文件名，供外部工具识别。
+        """
+        return MailStorageService.set_mails_flags(username, [filename], add, remove, folder)[filename]
+
+    @staticmethod
+    def set_mails_flags(username: str, filenames: list, add: str = "", remove: str = "", folder: str = "inbox") -> dict:
+        """
+        批量更新邮件标记，所有变化在同一事务中提交（邮箱版本号只递增一次）
+
+        Returns:
+            {文件名: 更新后的标记}，邮件不存在时为 None
+        """
+        filenames = list(dict.fromkeys(filenames))
+        results = dict.fromkeys(filenames)
+        if not filenames:
+            return results
+        changed = []
+        # Maildir 后端改名后的文件 (原路径, 新路径)：提交前失败时移回
+        renamed = []
+        try:
+            with SessionLocal() as db:
+                rows = db.query(Mail).filter(
+                    Mail.owner == username,
+                    Mail.folder == folder,
+                    Mail.filename.in_(filenames),
+                    Mail.is_deleted == 0
+                ).all()
+                for row in rows:
+                    old_flags = row.flags or ""
+                    new_flags = normalize_flags((set(old_flags) | set(add)) - set(remove))
+                    results[row.filename] = new_flags
+                    if new_flags == old_flags:
+                        continue
+                    filepath = MailStorageService.locate_mail(username, folder, row.filename, old_flags)
+                    if filepath is not None:
+                        new_path = MailStorageService.backend.set_flags(
+                            filepath, username, folder, row.filename, new_flags
+                        )
+                        if new_path != filepath:
+                            renamed.append((filepath, new_path))
+                        row.file_path = str(new_path)
+                    row.flags = new_flags
+                    changed.append((username, folder, row.filename, "flags", new_flags))
+
+                if changed:
+                    # 列表中包含已读状态，标记变化也使列表 ETag 失效
+                    MailStorageService.touch_mailbox(db, username, folder)
+                    ChangeJournal.record_many(db, changed)
+                    db.commit()
+        except BaseException:
+            MailStorageService._undo_renames(renamed)
+            raise
+
+        for old_path, new_path in renamed:
+            MailContentCache.move(old_path, new_path)
+        for _, _, filename, _, flags in changed:
+            MailEventHub.publish(username, {"action": "flags", "folder": folder, "filename": filename, "flags": flags})
+        return results
+
+    @staticmethod
+    def search_mails(username: str, query: str, folder: str = None, limit: int = 20, offset: int = 0) -> tuple[list, int]:
+        """全文检索用户邮件（主题、正文、地址、附件名），folder 为空时检索收件箱与发件箱"""
+        folders = (folder,) if folder else ("inbox", "sent")
+        with SessionLocal() as db:
+            return SearchService.search(db.connection(), username, query, folders, limit, offset)
+
+    @staticmethod
+    def has_new_mail(username: str) -> bool:
+        """收件箱是否有未删除的未读邮件（查询索引；Maildir 的 new/ 中可能还有待清理的软删除邮件）"""
+        with SessionLocal() as db:
+            row = db.query(Mail.id).filter(
+                Mail.owner == username,
+                Mail.folder == "inbox",
+                Mail.is_deleted == 0,
+                or_(Mail.flags.is_(None), ~Mail.flags.contains("S"))
+            ).first()
+        return row is not None
+
+    @staticmethod
+    def scan_mailbox_files():
+        """遍历邮箱目录中的收件箱/发件箱文件，生成 mails 表记录（用于登记历史邮件）"""
+        base_dir = Path(MailStorageService.BASE_DIR)
+        if not base_dir.exists():
+            return
+
+        for user_dir in base_dir.iterdir():
+            if not user_dir.is_dir():
+                continue
+            # 各存储后端格式的文件（.txt 各布局与 Maildir）
+            for scanner in SCANNERS:
+                for folder, mail_file, filename in scanner.scan(user_dir):
+                    stat = mail_file.stat()
+                    headers = MailHeaderParser.parse(mail_file) or MailHeaders()
+                    try:
+                        created_at = datetime.strptime(headers.date or "", "%Y-%m-%d %H:%M:%S")
+                    except ValueError:
+                        created_at = datetime.fromtimestamp(stat.st_mtime)
+                    yield {
+                        "owner": user_dir.name,
+                        "folder": folder,
+                        "filename": filename,
+                        "file_path": str(mail_file),
+                        "from_addr": headers.from_addr or "",
+                        "to_addr": headers.to_addr or "",
+                        "subject": headers.subject or "",
+                        "size": stat.st_size,
+                        "created_at": created_at,
+                        "is_deleted": 0,
+                    }
 
     @staticmethod
     def get_original_mail_subject(username: str, in_reply_to: str) -> str:
@@ -279,26 +988,14 @@ class MailStorageService:
         if in_reply_to.startswith("POP3_MAIL_"):
             return None
 
-        # 尝试从收件箱读取
-        filepath = Path(MailStorageService.BASE_DIR) / username / in_reply_to
-        if not filepath.exists():
-            # 尝试从发件箱读取
-            filepath = Path(MailStorageService.BASE_DIR) / username / "sent" / in_reply_to
+        # 先从收件箱查找，再从发件箱查找
+        filepath = (
+            MailStorageService.locate_mail(username, "inbox", in_reply_to)
+            or MailStorageService.locate_mail(username, "sent", in_reply_to)
+        )
 
-        if not filepath.exists():
-            return None
-
-        try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                content = f.read()
-                lines = content.split("\n")
-                for line in lines:
-                    if line.startswith("Subject:"):
-                        return line[8:].strip()
-        except Exception:
-            pass
-
-        return None
+        headers = MailHeaderParser.parse(filepath) if filepath else None
+        return headers.subject if headers else None
 
     @staticmethod
     def get_reply_info(username: str, filename: str) -> dict:
@@ -314,39 +1011,108 @@ class MailStorageService:
             - in_reply_to: 回复的原始邮件文件名（如果有）
             - is_reply: 是否是回复邮件
         """
-        # 先尝试从收件箱读取
-        filepath = Path(MailStorageService.BASE_DIR) / username / filename
-        if not filepath.exists():
-            # 尝试从发件箱读取
-            filepath = Path(MailStorageService.BASE_DIR) / username / "sent" / filename
+        # 先从收件箱查找，再从发件箱查找
+        filepath = (
+            MailStorageService.locate_mail(username, "inbox", filename)
+            or MailStorageService.locate_mail(username, "sent", filename)
+        )
 
-        if not filepath.exists():
-            return {"in_reply_to": None, "is_reply": False}
+        headers = MailHeaderParser.parse(filepath) if filepath else None
+        in_reply_to = headers.in_reply_to if headers else None
+        return {
+            "in_reply_to": in_reply_to,
+            "is_reply": in_reply_to is not None
+        }
 
-        try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                content = f.read()
-                lines = content.split("\n")
-
-                in_reply_to = None
-                for line in lines:
-                    if line.startswith("In-Reply-To:"):
-                        in_reply_to = line[13:].strip()
-                        break
-
-                return {
-                    "in_reply_to": in_reply_to,
-                    "is_reply": in_reply_to is not None
-                }
-        except Exception:
-            return {"in_reply_to": None, "is_reply": False}
+    @staticmethod
+    def get_thread(username: str, filename: str) -> list:
+        """
+        获取邮件所在会话的全部邮件（收件箱与发件箱，按时间排序）
+
+        通过 thread_root 一次索引查询取得整段会话，每项包含父邮件与子邮件文件名。
+        """
+        with SessionLocal() as db:
+            current = db.query(Mail.thread_root).filter(
+                Mail.owner == username,
+                Mail.filename == filename,
+                Mail.is_deleted == 0
+            ).first()
+            if current is None:
+                return []
+            rows = db.query(Mail).filter(
+                Mail.owner == username,
+                Mail.thread_root == (current.thread_root or filename),
+                Mail.is_deleted == 0
+            ).order_by(Mail.created_at, Mail.id).all()
+
+        thread = {}
+        for row in rows:
+            # 同一文件名同时存在于收件箱和发件箱时（发给自己），保留收件箱那份
+            if row.filename in thread and row.folder != "inbox":
+                continue
+            thread[row.filename] = {
+                "filename": row.filename,
+                "folder": row.folder,
+                "from_addr": row.from_addr,
+                "to_addr": row.to_addr,
+                "subject": row.subject,
+                "size": row.size,
+                "created": row.created_at,
+                "in_reply_to": row.in_reply_to,
+                "children": []
+            }
+        for item in thread.values():
+            parent = thread.get(item["in_reply_to"])
+            if parent is not None:
+                parent["children"].append(item["filename"])
+        return list(thread.values())
+
+    @staticmethod
+    def get_reply_chain(username: str, filename: str) -> list:
+        """获取从会话根邮件到指定邮件的回复链（按回复顺序）"""
+        thread = {item["filename"]: item for item in MailStorageService.get_thread(username, filename)}
+        chain = []
+        current = thread.get(filename)
+        while current is not None and current not in chain:
+            chain.append(current)
+            current = thread.get(current["in_reply_to"])
+        chain.reverse()
+        return [{k: v for k, v in item.items() if k != "children"} for item in chain]
+
+    @staticmethod
+    def list_threads(username: str) -> list:
+        """按会话分组列出邮件：每个会话的根、邮件数与最近活动时间（最近的在前）"""
+        with SessionLocal() as db:
+            groups = db.query(
+                Mail.thread_root,
+                func.count(Mail.id).label("message_count"),
+                func.max(Mail.created_at).label("last_created")
+            ).filter(
+                Mail.owner == username,
+                Mail.is_deleted == 0
+            ).group_by(Mail.thread_root).order_by(func.max(Mail.created_at).desc()).all()
+            roots = [group.thread_root for group in groups]
+            subjects = dict(db.query(Mail.filename, Mail.subject).filter(
+                Mail.owner == username,
+                Mail.filename.in_(roots)
+            ).all()) if roots else {}
+
+        return [
+            {
+                "thread_root": group.thread_root,
+                "subject": subjects.get(group.thread_root),
+                "message_count": group.message_count,
+                "last_created": group.last_created
+            }
+            for group in groups
+        ]
 
     @staticmethod
     def get_attachment_dir(username: str, mail_filename: str) -> Path:
         """获取邮件的附件目录"""
         # 邮件文件名为 20251220_121857_613099.txt
         # 附件目录为 mailbox/username/attachments/20251220_121857_613099/
-        mail_name = mail_filename.replace(".txt", "")
+        mail_name = MailStorageService._attachment_mail_name(mail_filename)
         attach_dir = Path(MailStorageService.BASE_DIR) / username / "attachments" / mail_name
         return attach_dir
 
@@ -357,6 +1123,186 @@ class MailStorageService:
         attach_dir.mkdir(parents=True, exist_ok=True)
         return attach_dir
 
+    @staticmethod
+    def get_attachment_manifest_path(username: str, mail_filename: str) -> Path:
+        """
+        获取邮件附件清单路径
+
+        清单与附件目录同级（attachments/<mail_name>.json），不会被当作附件列出或拷贝
+        """
+        mail_name = MailStorageService._attachment_mail_name(mail_filename)
+        return Path(MailStorageService.BASE_DIR) / username / "attachments" / f"{mail_name}.json"
+
+    @staticmethod
+    def get_mail_html_path(username: str, mail_filename: str) -> Path:
+        """获取收信时保存的 HTML 正文路径（attachments/<mail_name>.html，与附件清单同级）"""
+        mail_name = MailStorageService._attachment_mail_name(mail_filename)
+        return Path(MailStorageService.BASE_DIR) / username / "attachments" / f"{mail_name}.html"
+
+    @staticmethod
+    def store_mime_parts(
+        username: str,
+        mail_filename: str,
+        html_body: str | None,
+        attachments: list[tuple[str, bytes]],
+        parts: list[dict]
+    ) -> list[dict]:
+        """
+        保存收信时解析出的 HTML 正文与附件，并生成附件清单（parts 记录 MIME 结构）
+
+        Args:
+            attachments: [(附件文件名, 内容)]，文件名须已去重且不含路径
+            parts: MIME 叶子部分描述列表
+
+        Returns:
+            附件元数据列表
+        """
+        entries = {}
+        attach_dir = MailStorageService.get_attachment_dir(username, mail_filename)
+        attach_dir.parent.mkdir(parents=True, exist_ok=True)
+        for name, content in attachments:
+            attach_dir.mkdir(exist_ok=True)
+            filepath = attach_dir / name
+            with open(filepath, "wb") as f:
+                f.write(content)
+            entries[name] = MailStorageService._describe_attachment(filepath, hashlib.sha256(content).hexdigest())
+        if html_body is not None:
+            write_text_atomic(MailStorageService.get_mail_html_path(username, mail_filename), html_body, sync_dir=False)
+        manifest_path = MailStorageService.get_attachment_manifest_path(username, mail_filename)
+        with MailStorageService._manifest_lock:
+            MailStorageService._store_manifest(manifest_path, {"attachments": entries, "parts": parts})
+        return list(entries.values())
+
+    @staticmethod
+    def remove_mime_parts(username: str, mail_filename: str) -> None:
+        """删除 store_mime_parts 写入的内容（邮件保存失败时回滚）"""
+        from shutil import rmtree
+
+        rmtree(MailStorageService.get_attachment_dir(username, mail_filename), ignore_errors=True)
+        MailStorageService.get_mail_html_path(username, mail_filename).unlink(missing_ok=True)
+        MailStorageService.get_attachment_manifest_path(username, mail_filename).unlink(missing_ok=True)
+
+    @staticmethod
+    def remove_mail_assets(username: str, mail_filename: str) -> None:
+        """删除邮件的附件目录、附件清单、HTML 正文与缩略图目录（邮件被物理删除时调用）"""
+        from shutil import rmtree
+
+        MailStorageService.remove_mime_parts(username, mail_filename)
+        rmtree(MailStorageService.get_attachment_preview_dir(username, mail_filename), ignore_errors=True)
+
+    @staticmethod
+    def get_mail_parts(username: str, mail_filename: str) -> list:
+        """获取收信时记录的 MIME 结构（无记录时返回空列表）"""
+        manifest = MailStorageService._load_manifest(
+            MailStorageService.get_attachment_manifest_path(username, mail_filename)
+        )
+        return manifest.get("parts", []) if manifest else []
+
+    @staticmethod
+    def read_mail_html(username: str, mail_filename: str) -> str | None:
+        """读取收信时保存的 HTML 正文，不存在时返回 None"""
+        try:
+            return MailStorageService.get_mail_html_path(username, mail_filename).read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _load_manifest(manifest_path: Path) -> dict | None:
+        """读取附件清单，不存在或损坏时返回 None"""
+        try:
+            data = json.loads(manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        return data if isinstance(data.get("attachments"), dict) else None
+
+    @staticmethod
+    def _store_manifest(manifest_path: Path, manifest: dict) -> None:
+        """写临时文件后 rename，读取方不会看到写了一半的清单"""
+        temp_path = manifest_path.with_suffix(".json.tmp")
+        temp_path.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+        os.replace(temp_path, manifest_path)
+
+    @staticmethod
+    def _describe_attachment(filepath: Path, sha256: str | None = None, filename: str | None = None) -> dict:
+        """生成单个附件的元数据（大小、内容类型、SHA-256）；filename 为附件最终文件名"""
+        if sha256 is None:
+            digest = hashlib.sha256()
+            with open(filepath, "rb") as f:
+                for block in iter(lambda: f.read(MailStorageService._HASH_BLOCK_SIZE), b""):
+                    digest.update(block)
+            sha256 = digest.hexdigest()
+        filename = filename or filepath.name
+        return {
+            "filename": filename,
+            "size": filepath.stat().st_size,
+            "content_type": detect_file_content_type(filepath, filename),
+            "sha256": sha256,
+        }
+
+    @staticmethod
+    def _update_manifest(username: str, mail_filename: str, filename: str, entry: dict | None) -> None:
+        """更新清单中的单个附件条目；entry 为 None 时删除该条目"""
+        manifest_path = MailStorageService.get_attachment_manifest_path(username, mail_filename)
+        with MailStorageService._manifest_lock:
+            manifest = MailStorageService._load_manifest(manifest_path)
+            if manifest is None:
+                manifest = MailStorageService._build_manifest(username, mail_filename)
+            if entry is None:
+                manifest["attachments"].pop(filename, None)
+            else:
+                manifest["attachments"][filename] = entry
+            MailStorageService._store_manifest(manifest_path, manifest)
+
+    @staticmethod
+    def _build_manifest(username: str, mail_filename: str) -> dict:
+        """扫描附件目录重建清单（用于没有清单的旧附件目录）"""
+        attach_dir = MailStorageService.get_attachment_dir(username, mail_filename)
+        attachments = {}
+        if attach_dir.exists():
+            for file in attach_dir.glob("*"):
+                if file.is_file():
+                    attachments[file.name] = MailStorageService._describe_stored_attachment(file)
+        return {"attachments": attachments}
+
+    @staticmethod
+    def _describe_stored_attachment(filepath: Path) -> dict:
+        """
+        重建清单时描述磁盘上的附件，识别后处理压缩存储的文件并补回 encoding/stored_size
+
+        判定条件：gzip 魔数、文件名本身不是 .gz 等压缩格式、解压后的内容属于可压缩存储的类型。
+        压缩存储的附件按原始内容记录大小、类型与 SHA-256，与压缩前登记的条目一致。
+        """
+        from app.services.attachment_pipeline import AttachmentPipeline
+
+        with open(filepath, "rb") as f:
+            magic = f.read(2)
+        guessed_type, guessed_encoding = mimetypes.guess_type(filepath.name)
+        if magic != b"\x1f\x8b" or guessed_encoding or guessed_type == "application/gzip":
+            return MailStorageService._describe_attachment(filepath)
+
+        try:
+            with gzip.open(filepath, "rb") as f:
+                head = f.read(SNIFF_BYTES)
+                content_type = detect_content_type(head, filepath.name)
+                if not AttachmentPipeline.is_compressible(content_type):
+                    return MailStorageService._describe_attachment(filepath)
+                digest = hashlib.sha256(head)
+                size = len(head)
+                for block in iter(lambda: f.read(MailStorageService._HASH_BLOCK_SIZE), b""):
+                    digest.update(block)
+                    size += len(block)
+        except (OSError, EOFError):
+            # 不是完整的 gzip 数据，按原样登记
+            return MailStorageService._describe_attachment(filepath)
+        return {
+            "filename": filepath.name,
+            "size": size,
+            "content_type": content_type,
+            "sha256": digest.hexdigest(),
+            "encoding": "gzip",
+            "stored_size": filepath.stat().st_size,
+        }
+
     @staticmethod
     def save_attachment(username: str, mail_filename: str, file_content: bytes, original_filename: str) -> bool:
         """保存附件文件"""
@@ -365,26 +1311,128 @@ class MailStorageService:
             filepath = attach_dir / original_filename
             with open(filepath, "wb") as f:
                 f.write(file_content)
+            entry = MailStorageService._describe_attachment(filepath, hashlib.sha256(file_content).hexdigest())
+            MailStorageService._update_manifest(username, mail_filename, filepath.name, entry)
             return True
         except Exception:
             return False
 
+    @staticmethod
+    def commit_attachment(
+        username: str,
+        mail_filename: str,
+        temp_path: Path,
+        original_filename: str,
+        sha256: str | None = None
+    ) -> dict:
+        """
+        将已写完的临时文件原子地移动到邮件附件目录，并登记到附件清单
+
+        Args:
+            sha256: 上传时边写边算的摘要；未提供时读取文件计算一次
+
+        Returns:
+            附件元数据
+        """
+        attachment_name = Path(original_filename).name
+        if attachment_name in ("", ".", ".."):
+            raise ValueError(f"非法的附件文件名: {original_filename}")
+        attach_dir = MailStorageService.ensure_attachment_dir(username, mail_filename)
+        filepath = attach_dir / attachment_name
+        entry = MailStorageService._describe_attachment(temp_path, sha256, filepath.name)
+        with MailStorageService._manifest_lock:
+            os.replace(temp_path, filepath)
+            MailStorageService.get_attachment_preview_path(username, mail_filename, filepath.name).unlink(missing_ok=True)
+            MailStorageService._update_manifest(username, mail_filename, filepath.name, entry)
+        return entry
+
+    @staticmethod
+    def replace_attachment_content(
+        username: str,
+        mail_filename: str,
+        attachment_filename: str,
+        expected_sha256: str,
+        temp_path: Path | None,
+        changes: dict
+    ) -> bool:
+        """
+        后处理结果回写：附件未被重新上传（SHA-256 未变）时，更新清单条目并可选地替换附件文件
+
+        先写清单再替换文件；读取方以文件实际大小是否等于 stored_size 判断存储编码，
+        因此两步之间的任意时刻读到的内容都是正确的。
+
+        Returns:
+            是否已回写（附件已变化或被删除时返回 False）
+        """
+        manifest_path = MailStorageService.get_attachment_manifest_path(username, mail_filename)
+        filepath = MailStorageService.get_attachment_dir(username, mail_filename) / attachment_filename
+        with MailStorageService._manifest_lock:
+            manifest = MailStorageService._load_manifest(manifest_path)
+            entry = manifest["attachments"].get(attachment_filename) if manifest else None
+            if not entry or entry.get("sha256") != expected_sha256 or not filepath.is_file():
+                return False
+            entry.update(changes)
+            MailStorageService._store_manifest(manifest_path, manifest)
+            if temp_path is not None:
+                os.replace(temp_path, filepath)
+            return True
+
+    @staticmethod
+    def stored_encoding(info: dict | None, stored_size: int) -> str | None:
+        """附件在磁盘上的存储编码（如 gzip）；文件仍为原始内容时返回 None"""
+        if info and info.get("encoding") and stored_size == info.get("stored_size"):
+            return info["encoding"]
+        return None
+
+    @staticmethod
+    def decode_attachment(content: bytes, info: dict | None) -> bytes:
+        """将磁盘上读取的附件内容还原为原始字节"""
+        if MailStorageService.stored_encoding(info, len(content)) == "gzip":
+            return gzip.decompress(content)
+        return content
+
+    @staticmethod
+    def get_attachment_preview_dir(username: str, mail_filename: str) -> Path:
+        """获取邮件附件缩略图目录（mailbox/<user>/previews/<mail_name>/）"""
+        mail_name = MailStorageService._attachment_mail_name(mail_filename)
+        return Path(MailStorageService.BASE_DIR) / username / "previews" / mail_name
+
+    @staticmethod
+    def get_attachment_preview_path(username: str, mail_filename: str, attachment_filename: str) -> Path:
+        """获取附件缩略图路径"""
+        return MailStorageService.get_attachment_preview_dir(username, mail_filename) / f"{attachment_filename}.jpg"
+
     @staticmethod
     def get_attachments(username: str, mail_filename: str) -> list:
-        """获取邮件的所有附件信息"""
-        attach_dir = MailStorageService.get_attachment_dir(username, mail_filename)
-        if not attach_dir.exists():
-            return []
-        
-        attachments = []
-        for file in attach_dir.glob("*"):
-            if file.is_file():
-                attachments.append({
-                    "filename": file.name,
-                    "size": file.stat().st_size,
-                    "content_type": "application/octet-stream"  # 默认二进制
-                })
-        return attachments
+        """获取邮件的所有附件信息（读取附件清单，旧目录首次访问时生成清单）"""
+        manifest_path = MailStorageService.get_attachment_manifest_path(username, mail_filename)
+        manifest = MailStorageService._load_manifest(manifest_path)
+        if manifest is None:
+            attach_dir = MailStorageService.get_attachment_dir(username, mail_filename)
+            if not attach_dir.exists():
+                return []
+            with MailStorageService._manifest_lock:
+                manifest = MailStorageService._build_manifest(username, mail_filename)
+                MailStorageService._store_manifest(manifest_path, manifest)
+        return list(manifest["attachments"].values())
+
+    @staticmethod
+    def get_attachment_summary(username: str, mail_filename: str) -> tuple[list[str], int]:
+        """附件目录中的文件名列表与附件数（附件数不含收信时识别出的内嵌图片）"""
+        names = [a["filename"] for a in MailStorageService.get_attachments(username, mail_filename)]
+        inline = {
+            part.get("filename") for part in MailStorageService.get_mail_parts(username, mail_filename)
+            if part.get("role") == "inline"
+        }
+        return names, sum(1 for name in names if name not in inline)
+
+    @staticmethod
+    def get_attachment_info(username: str, mail_filename: str, attachment_filename: str) -> dict | None:
+        """获取单个附件的元数据，不存在时返回 None"""
+        for attachment in MailStorageService.get_attachments(username, mail_filename):
+            if attachment["filename"] == attachment_filename:
+                return attachment
+        return None
 
     @staticmethod
     def get_attachment_filepaths(username: str, mail_filename: str) -> list:
@@ -393,18 +1441,22 @@ class MailStorageService:
         if not attach_dir.exists():
             return []
 
+        infos = {a["filename"]: a for a in MailStorageService.get_attachments(username, mail_filename)}
         files = []
         for file in attach_dir.glob("*"):
             if file.is_file():
+                info = infos.get(file.name)
                 files.append({
                     "file_path": str(file),
-                    "filename": file.name
+                    "filename": file.name,
+                    "content_type": info["content_type"] if info else "application/octet-stream",
+                    "info": info
                 })
         return files
 
     @staticmethod
     def copy_attachments(src_username: str, src_mail_filename: str, dst_username: str, dst_mail_filename: str) -> None:
-        """拷贝附件到目标用户的附件目录"""
+        """拷贝附件到目标用户的附件目录（附件清单一并拷贝，无需重新计算）"""
         from shutil import copy2
 
         src_dir = MailStorageService.get_attachment_dir(src_username, src_mail_filename)
@@ -416,6 +1468,26 @@ class MailStorageService:
             if file.is_file():
                 copy2(file, dst_dir / file.name)
 
+        src_manifest = MailStorageService.get_attachment_manifest_path(src_username, src_mail_filename)
+        if src_manifest.exists():
+            copy2(src_manifest, MailStorageService.get_attachment_manifest_path(dst_username, dst_mail_filename))
+        src_html = MailStorageService.get_mail_html_path(src_username, src_mail_filename)
+        if src_html.exists():
+            copy2(src_html, MailStorageService.get_mail_html_path(dst_username, dst_mail_filename))
+
+        for file in src_dir.glob("*"):
+            src_preview = MailStorageService.get_attachment_preview_path(src_username, src_mail_filename, file.name)
+            if src_preview.exists():
+                dst_preview = MailStorageService.get_attachment_preview_path(dst_username, dst_mail_filename, file.name)
+                dst_preview.parent.mkdir(parents=True, exist_ok=True)
+                copy2(src_preview, dst_preview)
+
+    @staticmethod
+    def get_attachment_path(username: str, mail_filename: str, attachment_filename: str) -> Path | None:
+        """获取附件文件路径（不读取内容），不存在时返回 None"""
+        filepath = MailStorageService.get_attachment_dir(username, mail_filename) / attachment_filename
+        return filepath if filepath.is_file() else None
+
     @staticmethod
     def read_attachment(username: str, mail_filename: str, attachment_filename: str) -> bytes:
         """读取附件文件"""
@@ -427,7 +1499,9 @@ class MailStorageService:
         
         try:
             with open(filepath, "rb") as f:
-                return f.read()
+                content = f.read()
+            info = MailStorageService.get_attachment_info(username, mail_filename, attachment_filename)
+            return MailStorageService.decode_attachment(content, info)
         except Exception:
             return None
 
@@ -439,7 +1513,10 @@ class MailStorageService:
             filepath = attach_dir / attachment_filename
             
             if filepath.exists():
-                filepath.unlink()
+                with MailStorageService._manifest_lock:
+                    filepath.unlink()
+                    MailStorageService._update_manifest(username, mail_filename, attachment_filename, None)
+                MailStorageService.get_attachment_preview_path(username, mail_filename, attachment_filename).unlink(missing_ok=True)
                 return True
             return False
         except Exception:
@@ -450,22 +1527,28 @@ class MailStorageService:
         """从附件目录中推断最近一次上传所对应的 mail_filename。
 
         用于兼容客户端未传 mail_filename 的情况，避免邮件文件名与附件目录不一致。
+        只考虑尚未登记为邮件的暂存目录（上传或草稿附件），已收发邮件的附件目录即使刚被访问过也不会被选中。
         """
         attach_root = Path(MailStorageService.BASE_DIR) / username / "attachments"
         if not attach_root.exists():
             return None
 
-        now_ts = datetime.now().timestamp()
-        candidates: list[Path] = [p for p in attach_root.glob("*") if p.is_dir()]
+        cutoff = datetime.now().timestamp() - max_age_seconds
+        candidates = sorted(
+            (p for p in attach_root.glob("*") if p.is_dir() and p.stat().st_mtime >= cutoff),
+            key=lambda p: p.stat().st_mtime,
+            reverse=True
+        )
         if not candidates:
             return None
 
-        # 取最近修改的附件目录
-        latest = max(candidates, key=lambda p: p.stat().st_mtime)
-        age = now_ts - latest.stat().st_mtime
-        if age > max_age_seconds:
-            return None
-
         # 目录名是去掉 .txt 的邮件名
-        return f"{latest.name}.txt"
-
+        names = [f"{p.name}.txt" for p in candidates]
+        with SessionLocal() as db:
+            cataloged = {
+                name for (name,) in db.query(Mail.filename).filter(
+                    Mail.owner == username,
+                    Mail.filename.in_(names)
+                )
+            }
+        return next((name for name in names if name not in cataloged), None)
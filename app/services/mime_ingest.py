@@ -0,0 +1,306 @@
+"""
+MIME 收信解析 - SMTP 收信与 IMAP 同步入库时一次性解析 MIME 结构
+
+- 纯文本正文写入邮件文件（只有 HTML 时写入由 HTML 转出的纯文本）
+- HTML 正文保存为 attachments/<mail_name>.html，附件与内嵌图片保存到邮件附件目录
+- 各叶子部分的结构（part 编号、类型、角色、文件名、Content-ID）记录在附件清单的 parts 中
+
+读取邮件时直接使用上述文件，不再解析 MIME。
+"""
+import mimetypes
+import re
+from dataclasses import dataclass, field
+from email import policy
+from email.message import EmailMessage
+from email.parser import BytesFeedParser
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Optional
+from app.services.attachment_pipeline import AttachmentPipeline
+from app.services.mail_storage import MailStorageService
+from app.utils.message_id import new_mail_filename
+
+
+@dataclass
+class MimePart:
+    """MIME 叶子部分"""
+    part_id: str  # 形如 "1"、"2.1"
+    content_type: str
+    role: str  # text 纯文本正文, html HTML 正文, inline 内嵌资源, attachment 附件
+    size: int = 0
+    charset: Optional[str] = None
+    filename: Optional[str] = None  # 保存到附件目录的文件名（text/html 正文为 None）
+    content_id: Optional[str] = None
+    payload: bytes = b""
+
+    def to_dict(self) -> dict:
+        return {
+            "part": self.part_id,
+            "content_type": self.content_type,
+            "role": self.role,
+            "size": self.size,
+            "charset": self.charset,
+            "filename": self.filename,
+            "content_id": self.content_id,
+        }
+
+
+@dataclass
+class ParsedMail:
+    """解析后的邮件"""
+    from_addr: str = ""
+    to_addr: str = ""
+    subject: str = ""
+    in_reply_to: Optional[str] = None
+    text: str = ""
+    html: Optional[str] = None
+    parts: list[MimePart] = field(default_factory=list)
+
+    @property
+    def files(self) -> list[MimePart]:
+        """需要保存到附件目录的部分（附件与内嵌资源）"""
+        return [part for part in self.parts if part.filename]
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """HTML 转纯文本（忽略 script/style，块级标签换行）"""
+
+    BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "table"}
+    SKIP_TAGS = {"script", "style", "head", "title"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._chunks = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip += 1
+        elif tag in self.BLOCK_TAGS:
+            self._chunks.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in self.BLOCK_TAGS:
+            self._chunks.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._chunks.append(data)
+
+    def text(self) -> str:
+        text = re.sub(r"[ \t\r\f\v]+", " ", "".join(self._chunks))
+        return re.sub(r"\n\s*\n+", "\n\n", text).strip()
+
+
+def html_to_text(html: str) -> str:
+    """将 HTML 正文转换为纯文本"""
+    extractor = _HTMLTextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return extractor.text()
+
+
+class MimeParser:
+    """
+    流式 MIME 解析器
+
+    SMTP 收信时按行 feed，不必先拼出完整邮件；结束时 close() 返回 ParsedMail。
+    """
+
+    # 文件名中不允许的字符（路径分隔符、控制字符及 Windows 保留字符）
+    _UNSAFE_FILENAME_RE = re.compile(r'[\x00-\x1f\\/:*?"<>|]')
+
+    def __init__(self):
+        self._parser = BytesFeedParser(policy=policy.default)
+
+    def feed(self, data: bytes) -> None:
+        self._parser.feed(data)
+
+    def close(self) -> ParsedMail:
+        return MimeParser.parse_message(self._parser.close())
+
+    @staticmethod
+    def parse_bytes(raw: bytes) -> ParsedMail:
+        """解析完整的原始邮件"""
+        parser = MimeParser()
+        parser.feed(raw)
+        return parser.close()
+
+    @staticmethod
+    def _header(msg: EmailMessage, name: str) -> str:
+        """读取解码后的邮件头（格式错误时退回原始值）"""
+        try:
+            value = msg.get(name)
+        except Exception:
+            value = next((v for k, v in msg.raw_items() if k.lower() == name.lower()), "")
+        return str(value).strip() if value is not None else ""
+
+    @staticmethod
+    def _walk(part: EmailMessage, part_id: str = ""):
+        """按 IMAP 规则编号遍历叶子部分（message/rfc822 整体视为一个叶子）"""
+        if part.get_content_maintype() == "multipart":
+            for i, sub in enumerate(part.iter_parts(), 1):
+                yield from MimeParser._walk(sub, f"{part_id}.{i}" if part_id else str(i))
+        else:
+            yield part_id or "1", part
+
+    @staticmethod
+    def _payload(part: EmailMessage) -> bytes:
+        """解码后的部分内容（base64/quoted-printable 已解码）"""
+        if part.get_content_type() == "message/rfc822":
+            try:
+                return part.get_payload(0).as_bytes(policy=policy.SMTP)
+            except Exception:
+                return part.as_bytes()
+        payload = part.get_payload(decode=True)
+        return payload if isinstance(payload, bytes) else b""
+
+    @staticmethod
+    def _text(part: EmailMessage, payload: bytes) -> str:
+        """按声明的字符集解码文本部分，字符集未知时按 UTF-8 宽松解码"""
+        charset = part.get_content_charset() or "utf-8"
+        try:
+            text = payload.decode(charset, errors="replace")
+        except LookupError:
+            text = payload.decode("utf-8", errors="replace")
+        return text.replace("\r\n", "\n")
+
+    @staticmethod
+    def _filename(part: EmailMessage, part_id: str, used: set) -> str:
+        """生成安全且不重复的附件文件名"""
+        try:
+            name = part.get_filename() or ""
+        except Exception:
+            name = ""
+        name = MimeParser._UNSAFE_FILENAME_RE.sub("_", Path(name.replace("\\", "/")).name).strip(" .")
+        if not name:
+            if part.get_content_type() == "message/rfc822":
+                ext = ".eml"
+            else:
+                ext = mimetypes.guess_extension(part.get_content_type()) or ".bin"
+            name = f"part-{part_id}{ext}"
+        stem, suffix = Path(name).stem, Path(name).suffix
+        candidate, n = name, 2
+        while candidate.lower() in used:
+            candidate = f"{stem} ({n}){suffix}"
+            n += 1
+        used.add(candidate.lower())
+        return candidate
+
+    @staticmethod
+    def parse_message(msg: EmailMessage) -> ParsedMail:
+        """从已解析的 EmailMessage 提取正文、附件与结构"""
+        parsed = ParsedMail(
+            from_addr=MimeParser._header(msg, "From"),
+            to_addr=MimeParser._header(msg, "To"),
+            subject=MimeParser._header(msg, "Subject"),
+            in_reply_to=MimeParser._header(msg, "In-Reply-To") or None,
+        )
+        used_names = set()
+        text_body = None
+        for part_id, part in MimeParser._walk(msg):
+            content_type = part.get_content_type()
+            disposition = part.get_content_disposition()
+            content_id = MimeParser._header(part, "Content-ID").strip("<>") or None
+            has_filename = bool(part.get_param("filename", header="content-disposition") or part.get_param("name"))
+            payload = MimeParser._payload(part)
+            mime_part = MimePart(
+                part_id=part_id,
+                content_type=content_type,
+                role="attachment",
+                size=len(payload),
+                charset=part.get_content_charset() if part.get_content_maintype() == "text" else None,
+                content_id=content_id,
+            )
+
+            is_body = disposition != "attachment" and not has_filename
+            if is_body and content_type == "text/plain" and text_body is None:
+                mime_part.role = "text"
+                text_body = MimeParser._text(part, payload)
+            elif is_body and content_type == "text/html" and parsed.html is None:
+                mime_part.role = "html"
+                parsed.html = MimeParser._text(part, payload)
+            else:
+                if disposition != "attachment" and content_id:
+                    mime_part.role = "inline"
+                mime_part.filename = MimeParser._filename(part, part_id, used_names)
+                mime_part.payload = payload
+            parsed.parts.append(mime_part)
+
+        if text_body is not None:
+            parsed.text = text_body
+        elif parsed.html is not None:
+            parsed.text = html_to_text(parsed.html)
+        return parsed
+
+
+class MimeIngestService:
+    """将解析后的邮件保存到收件箱/发件箱（正文、HTML、附件与结构清单）"""
+
+    @staticmethod
+    def _store_parts(username: str, mail_filename: str, parsed: ParsedMail) -> None:
+        if not parsed.parts or (parsed.html is None and not parsed.files and len(parsed.parts) == 1):
+            # 单一纯文本正文：邮件文件即全部内容，无需清单
+            return
+        MailStorageService.store_mime_parts(
+            username,
+            mail_filename,
+            parsed.html,
+            [(part.filename, part.payload) for part in parsed.files],
+            [part.to_dict() for part in parsed.parts],
+        )
+
+    @staticmethod
+    def _submit_pipeline(username: str, mail_filename: str, parsed: ParsedMail) -> None:
+        for part in parsed.files:
+            AttachmentPipeline.submit(username, mail_filename, part.filename)
+
+    @staticmethod
+    def save_inbox(parsed: ParsedMail, to_addr: str, from_addr: str, subject: str = None) -> str:
+        """
+        保存到收件人的收件箱：先写附件与 HTML 正文，再写邮件文件并登记，
+        邮件出现在列表中时附件已就绪。
+
+        Returns:
+            邮件文件名
+        """
+        username = to_addr.split("@")[0] if "@" in to_addr else to_addr
+        filename = new_mail_filename()
+        MimeIngestService._store_parts(username, filename, parsed)
+        try:
+            MailStorageService.save_mail(
+                to_addr=to_addr,
+                from_addr=from_addr,
+                subject=parsed.subject if subject is None else subject,
+                body=parsed.text,
+                reply_to_filename=parsed.in_reply_to,
+                filename=filename
+            )
+        except Exception:
+            MailStorageService.remove_mime_parts(username, filename)
+            raise
+        MimeIngestService._submit_pipeline(username, filename, parsed)
+        return filename
+
+    @staticmethod
+    def save_sent(parsed: ParsedMail, from_addr: str, to_addrs: list, subject: str = None) -> str:
+        """保存到发件人的发件箱，返回邮件文件名"""
+        username = from_addr.split("@")[0] if "@" in from_addr else from_addr
+        filename = new_mail_filename()
+        MimeIngestService._store_parts(username, filename, parsed)
+        try:
+            MailStorageService.save_sent_mail(
+                from_addr=from_addr,
+                to_addrs=to_addrs,
+                subject=parsed.subject if subject is None else subject,
+                body=parsed.text,
+                reply_to_filename=parsed.in_reply_to,
+                filename=filename
+            )
+        except Exception:
+            MailStorageService.remove_mime_parts(username, filename)
+            raise
+        MimeIngestService._submit_pipeline(username, filename, parsed)
+        return filename
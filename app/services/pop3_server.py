@@ -6,7 +6,8 @@ from pathlib import Path
 from app.config import POP3_HOST, POP3_PORT
 from app.services.mail_storage import MailStorageService
 from app.services.log_service import LogService
-from app.db import SessionLocal
+from sqlalchemy import select
+from app.db import AsyncSessionLocal
 from app.models import User
 from app.services.auth_service import AuthService
 
@@ -100,25 +101,24 @@ class POP3Server:
             if not args:
                 return "-ERR Missing password"
             
-            # 验证用户名和密码
-            db = SessionLocal()
-            try:
-                user = db.query(User).filter(User.username == session.username).first()
-                
-                if not user or not AuthService.verify_password(args, user.password):
-                    LogService.log_pop3(f"认证失败: {session.username}", client_addr)
-                    return "-ERR Authentication failed"
-                
-                # 认证成功，加载邮件列表
-                session.authenticated = True
-                session.mails = MailStorageService.list_user_mails(session.username)
-                session.deleted_mails = set()
-                
-                LogService.log_pop3(f"认证成功: {session.username}, 邮件数: {len(session.mails)}", client_addr)
-                return f"+OK Mailbox locked and ready, {len(session.mails)} messages"
-            
-            finally:
-                db.close()
+            # 验证用户名和密码（异步查询 + 线程中执行 bcrypt，避免阻塞事件循环）
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(User.password).where(User.username == session.username)
+                )
+                user = result.first()
+
+            if not user or not await asyncio.to_thread(AuthService.verify_password, args, user.password):
+                LogService.log_pop3(f"认证失败: {session.username}", client_addr)
+                return "-ERR Authentication failed"
+
+            # 认证成功，加载邮件列表
+            session.authenticated = True
+            session.mails = await asyncio.to_thread(MailStorageService.list_user_mails, session.username)
+            session.deleted_mails = set()
+
+            LogService.log_pop3(f"认证成功: {session.username}, 邮件数: {len(session.mails)}", client_addr)
+            return f"+OK Mailbox locked and ready, {len(session.mails)} messages"
         
         # 以下命令需要认证
         if not session.authenticated:
@@ -170,7 +170,7 @@ class POP3Server:
                     return "-ERR Message deleted"
                 
                 mail = session.mails[msg_num]
-                content = MailStorageService.read_mail(session.username, mail['filename'])
+                content = await asyncio.to_thread(MailStorageService.read_mail, session.username, mail['filename'])
                 
                 if not content:
                     return "-ERR Cannot read message"
@@ -217,13 +217,14 @@ class POP3Server:
         
         # QUIT - 退出
         elif cmd == "QUIT":
-            # 执行真正的删除
+            # 执行真正的删除（一次事务，在线程中执行）
             deleted_count = 0
-            for msg_num in session.deleted_mails:
-                mail = session.mails[msg_num]
-                if MailStorageService.delete_mail(session.username, mail['filename']):
+            filenames = [session.mails[msg_num]['filename'] for msg_num in sorted(session.deleted_mails)]
+            deleted = await asyncio.to_thread(MailStorageService.delete_mails, session.username, filenames) if filenames else {}
+            for filename in filenames:
+                if deleted[filename]:
                     deleted_count += 1
-                    LogService.log_pop3(f"删除邮件: {mail['filename']}", client_addr)
+                    LogService.log_pop3(f"删除邮件: {filename}", client_addr)
             
             return f"+OK POP3 server signing off ({deleted_count} messages deleted)"
         
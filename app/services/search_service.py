@@ -0,0 +1,242 @@
+"""
+邮件全文检索 - SQLite FTS5 倒排索引，中文按二元组（bigram）切分
+
+索引表 mail_fts 的 rowid 即 mails.id，覆盖主题、正文、发件人/收件人与附件名，
+随邮件保存/删除在同一事务中增量维护。FTS5 的 unicode61 分词器把连续汉字当作一个词，
+因此写入前先在 Python 中把汉字串切成重叠的二元组（"邮件系统" -> "邮件 件系 系统"），
+查询时同样切分并作为短语匹配，即可按任意子串检索中文。
+
+每行还带一个由用户名与文件夹生成的范围词（scope 列），按用户过滤在倒排索引内完成，
+不必先取出全部命中再回表过滤。数据库不是 SQLite 或不支持 FTS5 时退化为主题/地址的 LIKE 查询。
+"""
+import hashlib
+import re
+from sqlalchemy import DateTime, text
+from sqlalchemy.engine import Connection
+from app.config import SEARCH_INDEX_MAX_BODY_CHARS
+
+# 汉字（含扩展 A、兼容汉字）、假名、谚文按二元组切分，其余按字母数字切词
+_CJK_CLASS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_TOKEN_RE = re.compile(f"([{_CJK_CLASS}]+)|([^\\W_{_CJK_CLASS}]+)")
+
+
+def tokenize(value: str) -> list[str]:
+    """切分为索引词：汉字串输出重叠二元组（单字输出本身），其余输出小写单词"""
+    tokens = []
+    for cjk, word in _TOKEN_RE.findall(value or ""):
+        if cjk:
+            if len(cjk) == 1:
+                tokens.append(cjk)
+            else:
+                tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        else:
+            tokens.append(word.lower())
+    return tokens
+
+
+def _index_text(value: str) -> str:
+    return " ".join(tokenize(value))
+
+
+def scope_token(owner: str, folder: str) -> str:
+    """用户与文件夹的范围词（只含字母数字，不受用户名中特殊字符影响）"""
+    return "s" + hashlib.sha1(f"{owner}\x00{folder}".encode("utf-8")).hexdigest()[:16]
+
+
+class SearchService:
+    """全文检索服务"""
+
+    # bm25 列权重：scope, subject, body, addrs, attachments
+    RANK_WEIGHTS = (0.0, 10.0, 1.0, 4.0, 3.0)
+
+    _available = None
+
+    @staticmethod
+    def create_index(conn: Connection) -> bool:
+        """创建 FTS5 索引表（仅 SQLite），返回是否可用"""
+        if conn.dialect.name != "sqlite":
+            return False
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS mail_fts USING fts5("
+            "scope, subject, body, addrs, attachments, tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+        return True
+
+    @staticmethod
+    def is_available(conn: Connection) -> bool:
+        """索引表是否存在（结果缓存）"""
+        if SearchService._available is None:
+            if conn.dialect.name != "sqlite":
+                SearchService._available = False
+            else:
+                SearchService._available = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'mail_fts'"
+                )).first() is not None
+        return SearchService._available
+
+    @staticmethod
+    def index_mail(
+        conn: Connection,
+        mail_id: int,
+        owner: str,
+        folder: str,
+        subject: str,
+        body: str,
+        from_addr: str,
+        to_addr: str,
+        attachment_names: list = ()
+    ) -> None:
+        """写入（或覆盖）一封邮件的索引，调用方负责提交事务"""
+        SearchService.index_mails(conn, [{
+            "id": mail_id,
+            "owner": owner,
+            "folder": folder,
+            "subject": subject,
+            "body": body,
+            "from_addr": from_addr,
+            "to_addr": to_addr,
+            "attachments": attachment_names,
+        }])
+
+    @staticmethod
+    def index_mails(conn: Connection, mails: list[dict]) -> None:
+        """批量写入索引（键：id/owner/folder/subject/body/from_addr/to_addr/attachments）"""
+        if not mails or not SearchService.is_available(conn):
+            return
+        ids = [{"id": m["id"]} for m in mails]
+        conn.execute(text("DELETE FROM mail_fts WHERE rowid = :id"), ids)
+        conn.execute(
+            text(
+                "INSERT INTO mail_fts (rowid, scope, subject, body, addrs, attachments) "
+                "VALUES (:id, :scope, :subject, :body, :addrs, :attachments)"
+            ),
+            [
+                {
+                    "id": m["id"],
+                    "scope": scope_token(m["owner"], m["folder"]),
+                    "subject": _index_text(m.get("subject") or ""),
+                    "body": _index_text((m.get("body") or "")[:SEARCH_INDEX_MAX_BODY_CHARS]),
+                    "addrs": _index_text(f"{m.get('from_addr') or ''} {m.get('to_addr') or ''}"),
+                    "attachments": _index_text(" ".join(m.get("attachments") or ())),
+                }
+                for m in mails
+            ]
+        )
+
+    @staticmethod
+    def remove_mails(conn: Connection, mail_ids: list[int]) -> None:
+        """从索引中删除邮件，调用方负责提交事务"""
+        if not mail_ids or not SearchService.is_available(conn):
+            return
+        conn.execute(text("DELETE FROM mail_fts WHERE rowid = :id"), [{"id": i} for i in mail_ids])
+
+    @staticmethod
+    def move_mails(conn: Connection, owner: str, folder: str, mail_ids: list[int]) -> None:
+        """邮件移动到其他文件夹：只改写范围词，不必重新切分正文，调用方负责提交事务"""
+        if not mail_ids or not SearchService.is_available(conn):
+            return
+        conn.execute(
+            text("UPDATE mail_fts SET scope = :scope WHERE rowid = :id"),
+            [{"scope": scope_token(owner, folder), "id": i} for i in mail_ids]
+        )
+
+    @staticmethod
+    def build_match(query: str) -> str | None:
+        """
+        将用户输入转换为 FTS5 MATCH 表达式：空白分隔的每个词切分后作为短语，各词之间为 AND；
+        最后一个词的末个拉丁词元按前缀匹配，便于边输入边搜索。没有可检索的词时返回 None。
+        """
+        phrases = []
+        words = query.split()
+        for i, word in enumerate(words):
+            tokens = tokenize(word)
+            if not tokens:
+                continue
+            phrase = '"' + " ".join(tokens) + '"'
+            if i == len(words) - 1 and tokens[-1].isascii():
+                phrase += "*"
+            phrases.append(phrase)
+        return " AND ".join(phrases) if phrases else None
+
+    @staticmethod
+    def search(
+        conn: Connection,
+        owner: str,
+        query: str,
+        folders: tuple = ("inbox", "sent"),
+        limit: int = 20,
+        offset: int = 0
+    ) -> tuple[list[dict], int]:
+        """
+        检索用户邮件，按相关度（bm25）排序，同分按时间倒序
+
+        Returns:
+            (当前页结果, 命中总数)
+        """
+        if not SearchService.is_available(conn):
+            return SearchService._search_fallback(conn, owner, query, folders, limit, offset)
+
+        terms = SearchService.build_match(query)
+        if terms is None:
+            return [], 0
+        scopes = " OR ".join(scope_token(owner, folder) for folder in folders)
+        params = {"match": f"scope:({scopes}) AND ({terms})"}
+
+        total = conn.execute(text("SELECT COUNT(*) FROM mail_fts WHERE mail_fts MATCH :match"), params).scalar()
+        if not total:
+            return [], 0
+
+        weights = ", ".join(str(w) for w in SearchService.RANK_WEIGHTS)
+        rows = conn.execute(
+            text(
+                "SELECT m.id, m.folder, m.filename, m.from_addr, m.to_addr, m.subject, m.size, "
+                "m.created_at, m.flags, f.score FROM "
+                f"(SELECT rowid, bm25(mail_fts, {weights}) AS score FROM mail_fts "
+                "WHERE mail_fts MATCH :match) AS f "
+                "JOIN mails AS m ON m.id = f.rowid "
+                "WHERE m.is_deleted = 0 "
+                "ORDER BY f.score, m.created_at DESC, m.id DESC LIMIT :limit OFFSET :offset"
+            ).columns(created_at=DateTime),
+            {**params, "limit": limit, "offset": offset}
+        ).all()
+        return [SearchService._row_to_dict(row, -row.score) for row in rows], total
+
+    @staticmethod
+    def _search_fallback(conn, owner, query, folders, limit, offset) -> tuple[list[dict], int]:
+        """无 FTS5 时按主题与地址做 LIKE 匹配（不含正文与附件名）"""
+        words = query.split()
+        if not words:
+            return [], 0
+        clauses = ["m.owner = :owner", "m.is_deleted = 0",
+                   "m.folder IN (" + ", ".join(f":f{i}" for i in range(len(folders))) + ")"]
+        params = {"owner": owner, **{f"f{i}": f for i, f in enumerate(folders)}}
+        for i, word in enumerate(words):
+            clauses.append(f"(m.subject LIKE :w{i} OR m.from_addr LIKE :w{i} OR m.to_addr LIKE :w{i})")
+            params[f"w{i}"] = f"%{word}%"
+        where = " AND ".join(clauses)
+        total = conn.execute(text(f"SELECT COUNT(*) FROM mails AS m WHERE {where}"), params).scalar()
+        rows = conn.execute(
+            text(
+                "SELECT m.id, m.folder, m.filename, m.from_addr, m.to_addr, m.subject, m.size, "
+                f"m.created_at, m.flags FROM mails AS m WHERE {where} "
+                "ORDER BY m.created_at DESC, m.id DESC LIMIT :limit OFFSET :offset"
+            ).columns(created_at=DateTime),
+            {**params, "limit": limit, "offset": offset}
+        ).all()
+        return [SearchService._row_to_dict(row, None) for row in rows], total
+
+    @staticmethod
+    def _row_to_dict(row, score) -> dict:
+        flags = row.flags or ""
+        return {
+            "filename": row.filename,
+            "folder": row.folder,
+            "from_addr": row.from_addr,
+            "to_addr": row.to_addr,
+            "subject": row.subject,
+            "size": row.size,
+            "created": row.created_at,
+            "flags": flags,
+            "is_read": "S" in flags,
+            "score": round(score, 4) if score is not None else None,
+        }
@@ -15,6 +15,7 @@ from app.config import (
     MAIL_DOMAIN,
 )
 from app.services.log_service import LogService
+from app.services.mail_storage import MailStorageService
 
 
 class SMTPClient:
@@ -63,13 +64,14 @@ class SMTPClient:
                     for att in attachments:
                         try:
                             with open(att["file_path"], "rb") as f:
-                                content = f.read()
-                                msg.add_attachment(
-                                    content,
-                                    maintype="application",
-                                    subtype="octet-stream",
-                                    filename=att["filename"]
-                                )
+                                content = MailStorageService.decode_attachment(f.read(), att.get("info"))
+                            maintype, _, subtype = att.get("content_type", "application/octet-stream").partition("/")
+                            msg.add_attachment(
+                                content,
+                                maintype=maintype,
+                                subtype=subtype,
+                                filename=att["filename"]
+                            )
                         except Exception as e:
                             LogService.log_system(f"添加附件失败: {att['filename']}, 错误: {e}")
 
@@ -7,8 +7,9 @@ from app.config import SMTP_HOST, SMTP_PORT, MAIL_DOMAIN
 from app.services.mail_storage import MailStorageService
 from app.services.log_service import LogService
 from app.services.filter_service import FilterService
-from app.db import get_db
-from app.db import SessionLocal
+from app.services.mime_ingest import MimeParser, MimeIngestService
+from sqlalchemy import select
+from app.db import AsyncSessionLocal
 from app.models import User
 from app.utils.validators import is_valid_email, extract_username
 
@@ -21,7 +22,7 @@ class SMTPSession:
         self.mail_from = None
         self.rcpt_to = []
         self.data_mode = False
-        self.mail_data = []
+        self.mime_parser = None  # DATA 阶段的流式 MIME 解析器
         self.authenticated = False
 
 
@@ -61,10 +62,15 @@ class SMTPServer:
                 if not data:
                     break
                 
-                message = data.decode('utf-8', errors='replace').strip()
-                
-                if not session.data_mode:
+                if session.data_mode:
+                    # DATA 阶段保留原始行（只去掉行尾换行），不破坏头部折行与正文缩进；
+                    # surrogateescape 使非 UTF-8 字节在送入 MIME 解析器时可以原样还原
+                    message = data.rstrip(b"\r\n").decode('utf-8', errors='surrogateescape')
+                    is_quit = False
+                else:
+                    message = data.decode('utf-8', errors='replace').strip()
                     LogService.log_smtp(f"收到命令: {message}", client_addr)
+                    is_quit = message.upper() == "QUIT"
                 
                 # 处理命令
                 response = await self.handle_command(message, session, client_addr)
@@ -73,7 +79,7 @@ class SMTPServer:
                     await self.send_response(writer, response)
                 
                 # 如果是 QUIT 命令，断开连接
-                if message.upper() == "QUIT":
+                if is_quit:
                     break
         
         except Exception as e:
@@ -96,50 +102,39 @@ class SMTPServer:
             if command == ".":
                 # 邮件结束标记
                 session.data_mode = False
-                mail_body = "\n".join(session.mail_data)
-                
-                # 解析邮件头和正文
-                subject = self.extract_subject(mail_body)
-                body = self.extract_body(mail_body)
-                # 提取回复关联信息（In-Reply-To头）
-                reply_to_filename = self.extract_in_reply_to(mail_body)
+                parsed = session.mime_parser.close()
+                session.mime_parser = None
+                subject = parsed.subject or "(无主题)"
 
-                # 保存邮件（为每个收件人保存一份）
+                # 保存邮件（为每个收件人保存一份，附件与 HTML 正文写入各自的附件目录）
                 for rcpt in session.rcpt_to:
                     try:
-                        filepath = MailStorageService.save_mail(
-                            to_addr=rcpt,
-                            from_addr=session.mail_from,
-                            subject=subject,
-                            body=body,
-                            reply_to_filename=reply_to_filename
+                        filename = await asyncio.to_thread(
+                            MimeIngestService.save_inbox, parsed, rcpt, session.mail_from, subject
                         )
-                        LogService.log_smtp(f"邮件已保存: {filepath}", client_addr)
+                        LogService.log_smtp(f"邮件已保存: {rcpt} {filename}", client_addr)
                     except Exception as e:
                         LogService.log_smtp(f"保存邮件失败: {e}", client_addr)
 
                 # 保存邮件到发件人的发件箱
                 try:
-                    sent_path = MailStorageService.save_sent_mail(
-                        from_addr=session.mail_from,
-                        to_addrs=session.rcpt_to,
-                        subject=subject,
-                        body=body,
-                        reply_to_filename=reply_to_filename
+                    sent_filename = await asyncio.to_thread(
+                        MimeIngestService.save_sent, parsed, session.mail_from, session.rcpt_to, subject
                     )
-                    LogService.log_smtp(f"已发送邮件保存: {sent_path}", client_addr)
+                    LogService.log_smtp(f"已发送邮件保存: {sent_filename}", client_addr)
                 except Exception as e:
                     LogService.log_smtp(f"保存已发送邮件失败: {e}", client_addr)
 
                 # 重置会话
                 session.mail_from = None
                 session.rcpt_to = []
-                session.mail_data = []
 
                 return "250 OK: Message accepted for delivery"
             else:
-                # 收集邮件数据
-                session.mail_data.append(command)
+                # 去掉客户端为透明性添加的前导点（RFC 5321 4.5.2），逐行送入解析器
+                if command.startswith("."):
+                    command = command[1:]
+                session.mime_parser.feed(command.encode("utf-8", errors="surrogateescape") + b"\r\n")
                 return None  # DATA 模式不返回响应
 
         # 普通命令模式
@@ -177,13 +172,13 @@ class SMTPServer:
                     LogService.log_smtp(f"收件人格式无效: {rcpt}", client_addr)
                     return "550 Invalid recipient address format"
 
-                # 检查收件人是否存在
-                db = SessionLocal()
+                # 检查收件人是否存在（异步会话，不阻塞其他 SMTP 连接）
                 username = extract_username(rcpt)
-                user = db.query(User).filter(User.username == username).first()
-                db.close()
+                async with AsyncSessionLocal() as db:
+                    result = await db.execute(select(User.id).where(User.username == username))
+                    user = result.first()
 
-                if not user:
+                if user is None:
                     LogService.log_smtp(f"收件人不存在: {rcpt}", client_addr)
                     return "550 Recipient does not exist"
 
@@ -192,27 +187,6 @@ class SMTPServer:
                     LogService.log_smtp(f"收件人被拒绝（黑名单）: {rcpt}", client_addr)
                     return "550 Recipient address rejected"
 
-                # 验证收件人是否存在（提取邮箱用户名部分）
-                if '@' in rcpt:
-                    username = rcpt.split('@')[0]
-                else:
-                    username = rcpt
-
-                # 查询数据库验证用户是否存在
-                db_gen = get_db()
-                db = next(db_gen)
-                try:
-                    user = db.query(User).filter(User.username == username).first()
-                    if not user:
-                        LogService.log_smtp(f"收件人不存在: {rcpt}", client_addr)
-                        return "550 5.1.1 User not found"
-                finally:
-                    db.close()
-                    try:
-                        next(db_gen)
-                    except StopIteration:
-                        pass
-
                 session.rcpt_to.append(rcpt)
                 LogService.log_smtp(f"收件人: {rcpt}", client_addr)
                 return "250 OK"
@@ -227,6 +201,7 @@ class SMTPServer:
                 return "503 Bad sequence: RCPT TO required"
 
             session.data_mode = True
+            session.mime_parser = MimeParser()
             LogService.log_smtp("开始接收邮件数据", client_addr)
             return "354 Start mail input; end with <CRLF>.<CRLF>"
 
@@ -234,7 +209,7 @@ class SMTPServer:
         elif cmd_upper == "RSET":
             session.mail_from = None
             session.rcpt_to = []
-            session.mail_data = []
+            session.mime_parser = None
             session.data_mode = False
             return "250 OK"
 
@@ -250,33 +225,6 @@ class SMTPServer:
         else:
             return "500 Command not recognized"
 
-    @staticmethod
-    def extract_subject(mail_data: str) -> str:
-        """提取邮件主题"""
-        lines = mail_data.split("\n")
-        for line in lines:
-            if line.lower().startswith("subject:"):
-                return line[8:].strip()
-        return "(无主题)"
-
-    @staticmethod
-    def extract_body(mail_data: str) -> str:
-        """提取邮件正文（去掉邮件头）"""
-        # 查找空行，空行后是正文
-        parts = mail_data.split("\n\n", 1)
-        if len(parts) > 1:
-            return parts[1]
-        return mail_data
-
-    @staticmethod
-    def extract_in_reply_to(mail_data: str) -> str:
-        """提取In-Reply-To头（回复关联）"""
-        lines = mail_data.split("\n")
-        for line in lines:
-            if line.lower().startswith("in-reply-to:"):
-                return line[13:].strip()
-        return None
-    
     async def start(self):
         """启动 SMTP 服务"""
         self.server = await asyncio.start_server(
@@ -0,0 +1,187 @@
+"""
+附件上传服务 - 流式写入临时文件、可续传的分块上传会话
+
+临时文件位于 mailbox/<user>/uploads/，与附件目录在同一文件系统，
+完成后通过 rename 原子地移入附件目录，读取方不会看到写了一半的文件。
+"""
+import asyncio
+import hashlib
+import json
+import re
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, Optional
+import anyio
+from app.config import ATTACHMENT_MAX_BYTES, UPLOAD_SESSION_TTL_HOURS
+from app.services.mail_storage import MailStorageService
+
+
+class UploadService:
+    """附件上传服务"""
+
+    UPLOAD_DIR_NAME = "uploads"
+    _UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+    # 每个上传会话一把锁，避免同一会话的分块并发写入
+    _locks: dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def ensure_upload_dir(username: str) -> Path:
+        """确保用户上传临时目录存在"""
+        upload_dir = Path(MailStorageService.BASE_DIR) / username / UploadService.UPLOAD_DIR_NAME
+        upload_dir.mkdir(parents=True, exist_ok=True)
+        return upload_dir
+
+    @staticmethod
+    def _session_paths(username: str, upload_id: str) -> tuple[Path, Path]:
+        """会话元数据文件与数据文件路径"""
+        upload_dir = Path(MailStorageService.BASE_DIR) / username / UploadService.UPLOAD_DIR_NAME
+        return upload_dir / f"{upload_id}.json", upload_dir / f"{upload_id}.part"
+
+    @staticmethod
+    async def _write_chunks(
+        target: Path,
+        chunks: AsyncIterator[bytes],
+        written: int,
+        max_bytes: int,
+        digest=None
+    ) -> int:
+        """
+        将分块追加写入文件，超过上限时抛出 ValueError，返回写入后的总字节数
+
+        提供 digest（hashlib 对象）时边写边更新摘要，无需写完后再读一遍文件
+        """
+        async with await anyio.open_file(target, "ab") as f:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                written += len(chunk)
+                if written > max_bytes:
+                    raise ValueError(f"文件过大，最大限制 {max_bytes / 1024 / 1024}MB")
+                if digest is not None:
+                    digest.update(chunk)
+                await f.write(chunk)
+        return written
+
+    @staticmethod
+    async def save_stream(username: str, mail_filename: str, original_filename: str, chunks: AsyncIterator[bytes]) -> dict:
+        """
+        流式保存附件：边接收边写临时文件并检查大小、计算摘要，完成后原子移入附件目录
+
+        Returns:
+            附件元数据（filename、size、content_type、sha256）
+        """
+        temp_path = UploadService.ensure_upload_dir(username) / f"{uuid.uuid4().hex}.part"
+        digest = hashlib.sha256()
+        try:
+            await UploadService._write_chunks(temp_path, chunks, 0, ATTACHMENT_MAX_BYTES, digest)
+            return MailStorageService.commit_attachment(
+                username, mail_filename, temp_path, original_filename, digest.hexdigest()
+            )
+        finally:
+            temp_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def create_session(username: str, mail_filename: str, original_filename: str, total_size: int) -> dict:
+        """创建续传上传会话（附件目标邮件名须合法，已登记时须为当前用户的邮件，否则抛出 ValueError）"""
+        if not MailStorageService.is_attachment_target(username, mail_filename):
+            raise ValueError(f"非法的邮件文件名: {mail_filename}")
+        if total_size < 0 or total_size > ATTACHMENT_MAX_BYTES:
+            raise ValueError(f"文件过大，最大限制 {ATTACHMENT_MAX_BYTES / 1024 / 1024}MB")
+        UploadService.cleanup_expired_sessions(username)
+
+        upload_id = uuid.uuid4().hex
+        UploadService.ensure_upload_dir(username)
+        meta_path, part_path = UploadService._session_paths(username, upload_id)
+        meta = {
+            "upload_id": upload_id,
+            "mail_filename": mail_filename,
+            "filename": Path(original_filename).name,
+            "total_size": total_size,
+            "created_at": datetime.now().isoformat(),
+        }
+        part_path.touch()
+        meta_path.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        return {**meta, "offset": 0}
+
+    @staticmethod
+    def get_session(username: str, upload_id: str) -> Optional[dict]:
+        """获取上传会话状态；offset 为服务端已持久化的字节数"""
+        if not UploadService._UPLOAD_ID_RE.match(upload_id):
+            return None
+        meta_path, part_path = UploadService._session_paths(username, upload_id)
+        if not meta_path.exists() or not part_path.exists():
+            return None
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        return {**meta, "offset": part_path.stat().st_size}
+
+    @staticmethod
+    async def append_chunk(username: str, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> tuple[Optional[dict], bool]:
+        """
+        在指定偏移处追加分块
+
+        offset 必须等于服务端当前已接收的字节数，否则不写入，
+        由客户端按返回会话中的 offset 重新续传。
+
+        Returns:
+            (会话状态, 是否已写入)；会话不存在时为 (None, False)
+        """
+        lock = UploadService._locks.setdefault(upload_id, asyncio.Lock())
+        async with lock:
+            session = UploadService.get_session(username, upload_id)
+            if session is None or session["offset"] != offset:
+                return session, False
+            _, part_path = UploadService._session_paths(username, upload_id)
+            try:
+                session["offset"] = await UploadService._write_chunks(part_path, chunks, offset, session["total_size"])
+            except ValueError:
+                # 超出声明大小：截断回本次写入前的位置
+                with open(part_path, "r+b") as f:
+                    f.truncate(offset)
+                raise ValueError("分块超出声明的文件大小")
+            return session, True
+
+    @staticmethod
+    def finalize_session(username: str, upload_id: str) -> Optional[dict]:
+        """
+        完成上传：校验大小后原子移入附件目录
+
+        分块可能跨多次请求甚至进程重启，摘要在此处读取完整文件计算一次。
+        """
+        session = UploadService.get_session(username, upload_id)
+        if session is None:
+            return None
+        if session["offset"] != session["total_size"]:
+            raise ValueError(f"上传未完成：已接收 {session['offset']}/{session['total_size']} 字节")
+        meta_path, part_path = UploadService._session_paths(username, upload_id)
+        entry = MailStorageService.commit_attachment(username, session["mail_filename"], part_path, session["filename"])
+        meta_path.unlink(missing_ok=True)
+        UploadService._locks.pop(upload_id, None)
+        return {**session, **entry}
+
+    @staticmethod
+    def abort_session(username: str, upload_id: str) -> bool:
+        """取消上传会话并删除已接收的数据"""
+        if not UploadService._UPLOAD_ID_RE.match(upload_id):
+            return False
+        meta_path, part_path = UploadService._session_paths(username, upload_id)
+        existed = meta_path.exists()
+        meta_path.unlink(missing_ok=True)
+        part_path.unlink(missing_ok=True)
+        UploadService._locks.pop(upload_id, None)
+        return existed
+
+    @staticmethod
+    def cleanup_expired_sessions(username: str) -> int:
+        """删除超过保留时长的未完成会话与临时文件"""
+        upload_dir = Path(MailStorageService.BASE_DIR) / username / UploadService.UPLOAD_DIR_NAME
+        if not upload_dir.exists():
+            return 0
+        cutoff = (datetime.now() - timedelta(hours=UPLOAD_SESSION_TTL_HOURS)).timestamp()
+        removed = 0
+        for path in upload_dir.iterdir():
+            if path.is_file() and path.stat().st_mtime < cutoff:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
@@ -0,0 +1,76 @@
+"""
+内容类型识别 - 文件头魔数嗅探，辅以扩展名推断
+"""
+import mimetypes
+from pathlib import Path
+
+# 嗅探所需的文件头字节数
+SNIFF_BYTES = 512
+
+# 强特征魔数：命中即采用，优先于扩展名（防止扩展名被改动）
+_MAGIC_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"%PDF-", "application/pdf"),
+    (b"\x1f\x8b", "application/gzip"),
+    (b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (b"Rar!\x1a\x07", "application/vnd.rar"),
+    (b"ID3", "audio/mpeg"),
+    (b"OggS", "audio/ogg"),
+    (b"fLaC", "audio/flac"),
+]
+
+
+def _sniff(head: bytes) -> str | None:
+    """根据文件头魔数判断类型，未识别时返回 None"""
+    for signature, content_type in _MAGIC_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "audio/wav"
+    if head[4:8] == b"ftyp":
+        return "video/mp4"
+    return None
+
+
+def _looks_like_text(head: bytes) -> bool:
+    """不含 NUL 且可按 UTF-8 解码（允许末尾多字节字符被截断）"""
+    if b"\x00" in head:
+        return False
+    try:
+        head.decode("utf-8")
+        return True
+    except UnicodeDecodeError as e:
+        return e.start >= len(head) - 3
+
+
+def detect_content_type(head: bytes, filename: str) -> str:
+    """
+    识别内容类型：魔数 > 扩展名 > ZIP 容器 > 文本 > application/octet-stream
+
+    docx/xlsx 等格式本身是 ZIP 容器，因此 ZIP 魔数排在扩展名之后。
+    """
+    sniffed = _sniff(head)
+    if sniffed:
+        return sniffed
+
+    guessed, _ = mimetypes.guess_type(Path(filename).name)
+    if guessed:
+        return guessed
+
+    if head.startswith(b"PK\x03\x04"):
+        return "application/zip"
+    if head and _looks_like_text(head):
+        return "text/plain"
+    return "application/octet-stream"
+
+
+def detect_file_content_type(path: Path, filename: str | None = None) -> str:
+    """读取文件头识别内容类型"""
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    return detect_content_type(head, filename or path.name)
@@ -0,0 +1,35 @@
+"""
+凭据加密 - 外部邮箱密码等需要还原明文的凭据以服务端密钥加密保存（Fernet：AES-128-CBC + HMAC-SHA256）
+
+密文带 "enc1:" 前缀；没有前缀的值视为加密前保存的明文（由迁移统一加密），读取时原样返回。
+"""
+import base64
+import hashlib
+from cryptography.fernet import Fernet, InvalidToken
+from app.config import CREDENTIAL_SECRET, TOKEN_SECRET
+
+_PREFIX = "enc1:"
+
+
+def _fernet() -> Fernet:
+    secret = CREDENTIAL_SECRET or f"credential:{TOKEN_SECRET}"
+    return Fernet(base64.urlsafe_b64encode(hashlib.sha256(secret.encode("utf-8")).digest()))
+
+
+def is_encrypted(value: str | None) -> bool:
+    return bool(value) and value.startswith(_PREFIX)
+
+
+def encrypt_secret(plaintext: str) -> str:
+    """加密凭据，返回可直接保存的字符串"""
+    return _PREFIX + _fernet().encrypt(plaintext.encode("utf-8")).decode("ascii")
+
+
+def decrypt_secret(value: str | None) -> str | None:
+    """解密凭据；密钥不匹配或密文损坏时抛出 ValueError"""
+    if not is_encrypted(value):
+        return value
+    try:
+        return _fernet().decrypt(value[len(_PREFIX):].encode("ascii")).decode("utf-8")
+    except InvalidToken:
+        raise ValueError("凭据无法解密（密钥已更换或数据损坏）")
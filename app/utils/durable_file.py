@@ -0,0 +1,126 @@
+"""
+持久化文件写入 - 同目录临时文件 + rename 原子替换，目录 fsync 组提交
+
+读取方（如 POP3 RETR）要么看到完整的旧文件，要么看到完整的新文件；
+崩溃后不会留下写了一半的邮件。持久性级别由 MAIL_DURABILITY 配置。
+"""
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Iterable
+from app.config import MAIL_DURABILITY, MAIL_FSYNC_BATCH_WINDOW_MS
+
+
+def _fsync_dir(directory: str) -> None:
+    """fsync 目录使 rename 持久化（Windows 不支持打开目录，跳过）"""
+    if os.name == "nt":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _DirSyncBatcher:
+    """
+    目录 fsync 组提交
+
+    首个到达的线程成为 leader，执行 fsync 期间到达的请求累积为下一批，
+    由下一任 leader 对其中每个目录只 fsync 一次，所有等待者在所属批次完成后返回。
+    """
+
+    def __init__(self, window_ms: int = 0):
+        self._window = window_ms / 1000
+        self._cond = threading.Condition()
+        self._pending: set[str] = set()
+        self._collecting = 0  # 正在收集的批次号
+        self._synced = 0  # 已完成的批次数（批次号 < _synced 的都已落盘）
+        self._leader_active = False
+        self._errors: dict[int, OSError] = {}
+
+    def sync(self, directories: Iterable[str]) -> None:
+        """等待目录 fsync 完成（与并发调用合并执行）"""
+        with self._cond:
+            self._pending.update(directories)
+            batch_id = self._collecting
+            while self._synced <= batch_id:
+                if self._leader_active:
+                    self._cond.wait()
+                    continue
+                self._leader_active = True
+                self._cond.release()
+                try:
+                    if self._window:
+                        time.sleep(self._window)
+                finally:
+                    self._cond.acquire()
+                self._run_batch()
+            error = self._errors.get(batch_id)
+        if error:
+            raise error
+
+    def _run_batch(self) -> None:
+        """取出当前批次并执行 fsync（调用时持有锁，fsync 期间释放）"""
+        pending, self._pending = self._pending, set()
+        current = self._collecting
+        self._collecting += 1
+        self._cond.release()
+        error = None
+        try:
+            for directory in pending:
+                _fsync_dir(directory)
+        except OSError as e:
+            error = e
+        finally:
+            self._cond.acquire()
+        if error:
+            self._errors[current] = error
+        # 只保留最近批次的错误，等待者早已取走更早的结果
+        for old in [b for b in self._errors if b < current - 64]:
+            del self._errors[old]
+        self._synced = current + 1
+        self._leader_active = False
+        self._cond.notify_all()
+
+
+_dir_batcher = _DirSyncBatcher(MAIL_FSYNC_BATCH_WINDOW_MS)
+
+
+def sync_directories(directories: Iterable[Path]) -> None:
+    """按持久性配置 fsync 目录，使此前的 rename 落盘"""
+    unique = {str(d) for d in directories}
+    if MAIL_DURABILITY == "fsync":
+        for directory in unique:
+            _fsync_dir(directory)
+    elif MAIL_DURABILITY == "batch":
+        _dir_batcher.sync(unique)
+
+
+def write_text_atomic(filepath: Path, content: str, sync_dir: bool = True, temp_dir: Path = None) -> None:
+    """
+    原子写入文本文件：写同目录临时文件，按配置 fsync 后 rename 到目标路径
+
+    Args:
+        sync_dir: 是否立即 fsync 目录；批量写入时可传 False，写完后统一调用 sync_directories
+        temp_dir: 临时文件所在目录（须与目标在同一文件系统，如 Maildir 的 tmp/），默认为目标目录
+    """
+    if temp_dir is None:
+        temp_path = filepath.with_name(f".{filepath.name}.{uuid.uuid4().hex}.tmp")
+    else:
+        temp_path = temp_dir / f"{filepath.name}.{uuid.uuid4().hex}"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+            if MAIL_DURABILITY != "none":
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, filepath)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    if sync_dir:
+        sync_directories([filepath.parent])
+
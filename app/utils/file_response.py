@@ -0,0 +1,266 @@
+"""
+文件响应 - 在 FileResponse 基础上支持 Range 断点续传与 ETag/If-Modified-Since 条件请求
+
+gzip 压缩存储的文件对不接受 gzip 的客户端边读边解压返回（GzipDecodedFileResponse），
+Range 与条件请求按解压后的内容处理，断点续传同样可用。
+"""
+import gzip
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+
+def make_etag(stat_result: os.stat_result, suffix: str = "") -> str:
+    """由 inode、修改时间（纳秒）与大小生成强 ETag；同一文件的不同表示（如解压后）以 suffix 区分"""
+    return f'"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}{suffix}"'
+
+
+def accepts_encoding(header_value: Optional[str], coding: str) -> bool:
+    """
+    按 Accept-Encoding 判断客户端是否接受指定内容编码
+
+    逐项解析编码名与 q 值：显式列出时以其 q 值为准（q=0 表示拒绝），否则看通配符 *。
+    """
+    if not header_value:
+        return False
+    coding = coding.lower()
+    wildcard = None
+    for item in header_value.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name == coding:
+            return q > 0
+        if name == "*":
+            wildcard = q > 0
+    return bool(wildcard)
+
+
+def etag_matches(header_value: str, etag: str) -> bool:
+    """If-None-Match 比较（弱比较，忽略 W/ 前缀）"""
+    if header_value.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in header_value.split(",")]
+    return etag in candidates
+
+
+def _parse_http_date(value: str) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def is_not_modified(request_headers: Headers, etag: str, mtime: float) -> bool:
+    """条件请求判断：If-None-Match 优先，其次 If-Modified-Since"""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        since = _parse_http_date(if_modified_since)
+        return since is not None and int(mtime) <= since
+    return False
+
+
+def parse_range(range_header: str, size: int) -> Optional[tuple[int, int]]:
+    """
+    解析单段 Range 头，返回闭区间 (start, end)
+
+    Returns:
+        None 表示忽略 Range（语法不支持或多段），按完整文件返回；
+        (-1, -1) 表示范围无法满足（416）
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_str, sep, end_str = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if start_str == "":
+            # 后缀范围：最后 N 个字节
+            length = int(end_str)
+            if length <= 0:
+                return (-1, -1)
+            return (max(size - length, 0), size - 1)
+        start = int(start_str)
+        end = int(end_str) if end_str else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return (-1, -1)
+    if start < 0 or end < start:
+        return None
+    return (start, min(end, size - 1))
+
+
+def _if_range_matches(if_range: Optional[str], etag: str, mtime: float) -> bool:
+    """If-Range：未提供时直接按 Range 处理；提供时只有 ETag 或修改时间一致才返回部分内容"""
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    return if_range == formatdate(mtime, usegmt=True)
+
+
+def _apply_conditional_range(
+    response: Response, request_headers: Headers, mtime: float, size: int
+) -> Optional[tuple[int, int]]:
+    """
+    按条件请求与 Range 头设置响应状态码及相关头（响应须已设置 ETag），返回需要发送的闭区间
+
+    Returns:
+        206 时为 (start, end)，其余（200/304/416）为 None
+    """
+    etag = response.headers["etag"]
+    response.headers["accept-ranges"] = "bytes"
+
+    if is_not_modified(request_headers, etag, mtime):
+        response.status_code = 304
+        del response.headers["content-length"]
+        return None
+
+    range_header = request_headers.get("range")
+    if not range_header or not _if_range_matches(request_headers.get("if-range"), etag, mtime):
+        return None
+
+    parsed = parse_range(range_header, size)
+    if parsed is None:
+        return None
+    if parsed == (-1, -1):
+        response.status_code = 416
+        response.headers["content-range"] = f"bytes */{size}"
+        response.headers["content-length"] = "0"
+        return None
+
+    start, end = parsed
+    response.status_code = 206
+    response.headers["content-range"] = f"bytes {start}-{end}/{size}"
+    response.headers["content-length"] = str(end - start + 1)
+    return start, end
+
+
+class RangeFileResponse(FileResponse):
+    """
+    支持 Range 与条件请求的文件响应
+
+    - 完整响应沿用 FileResponse：服务器支持 pathsend 时直接交给服务器发送文件，否则分块读取
+    - 206 部分响应只分块读取所需区间，不会把整个文件读入内存
+    - If-None-Match / If-Modified-Since 命中时返回 304
+    """
+
+    def __init__(
+        self,
+        path,
+        request_headers: Headers,
+        stat_result: os.stat_result,
+        filename: str = None,
+        media_type: str = None,
+        headers: dict = None,
+        content_disposition_type: str = "attachment"
+    ):
+        super().__init__(
+            path,
+            headers=headers,
+            media_type=media_type,
+            filename=filename,
+            stat_result=stat_result,
+            content_disposition_type=content_disposition_type
+        )
+        self.headers["etag"] = make_etag(stat_result)
+        self.range = _apply_conditional_range(self, request_headers, stat_result.st_mtime, stat_result.st_size)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.status_code == 200:
+            await super().__call__(scope, receive, send)
+            return
+
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.status_code == 206 and scope["method"].upper() != "HEAD":
+            start, end = self.range
+            remaining = end - start + 1
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(start)
+                while remaining > 0:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # 文件在发送过程中被截断，结束响应
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        if self.background is not None:
+            await self.background()
+
+
+class GzipDecodedFileResponse(Response):
+    """
+    gzip 压缩存储文件的解压响应（客户端不接受 gzip 时使用），支持 Range 与条件请求
+
+    区间与 Content-Length 按解压后的大小计算；ETag 由存储文件生成并加后缀，与压缩表示区分，
+    文件不变时保持稳定，可用于 If-None-Match / If-Range。Range 起点之前的内容需解压后丢弃。
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(
+        self,
+        path,
+        request_headers: Headers,
+        stat_result: os.stat_result,
+        decoded_size: int,
+        media_type: str = None,
+        headers: dict = None
+    ):
+        super().__init__(content=None, status_code=200, headers=headers, media_type=media_type)
+        self.path = path
+        self.decoded_size = decoded_size
+        self.headers["content-length"] = str(decoded_size)
+        self.headers["last-modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+        self.headers["etag"] = make_etag(stat_result, "-identity")
+        self.range = _apply_conditional_range(self, request_headers, stat_result.st_mtime, decoded_size)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.status_code in (200, 206) and scope["method"].upper() != "HEAD":
+            start, end = self.range if self.range else (0, self.decoded_size - 1)
+            remaining = end - start + 1
+            finished = False
+            file = await anyio.to_thread.run_sync(gzip.open, self.path, "rb")
+            try:
+                if start:
+                    await anyio.to_thread.run_sync(file.seek, start)
+                while remaining > 0:
+                    chunk = await anyio.to_thread.run_sync(file.read, min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    finished = remaining <= 0
+                    await send({"type": "http.response.body", "body": chunk, "more_body": not finished})
+            finally:
+                file.close()
+            if not finished:
+                # 空文件，或解压内容比清单记录的短（文件被替换或损坏），结束响应
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        else:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,34 @@
+"""
+JSON 接口的 HTTP 缓存 - 由邮箱版本号等廉价版本信息生成 ETag，支持 If-None-Match 返回 304
+
+列表与读信接口在查询数据之前先比较 ETag，邮箱没有变化时轮询请求不再读取索引或邮件文件。
+"""
+import hashlib
+from typing import Optional
+from fastapi import Response
+from starlette.datastructures import Headers
+from app.utils.file_response import etag_matches
+
+# 每次使用前向服务端验证（配合 ETag 实现 304）
+REVALIDATE = "private, no-cache"
+# 邮件正文按邮件 ID 寻址，写入后不再改变
+IMMUTABLE = "private, max-age=31536000, immutable"
+
+
+def version_etag(*parts) -> str:
+    """由版本信息生成弱 ETag（内容按版本确定，不保证字节级一致）"""
+    digest = hashlib.sha1("\x00".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def not_modified(request_headers: Headers, etag: str, cache_control: str = REVALIDATE) -> Optional[Response]:
+    """If-None-Match 命中时返回 304 响应，否则返回 None"""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, etag.removeprefix("W/")):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
+
+
+def set_cache_headers(response: Response, etag: str, cache_control: str = REVALIDATE) -> None:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
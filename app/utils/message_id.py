@@ -0,0 +1,43 @@
+"""
+邮件 ID 生成 - 时间有序、进程内单调、跨进程不冲突
+
+格式：YYYYMMDD_HHMMSS_ffffff_<序号4位十六进制><节点ID>
+前缀与历史文件名（YYYYMMDD_HHMMSS_ffffff）一致，按字典序排序即按时间排序，
+新旧文件名可以混合排序。同一微秒内（或时钟回拨时）沿用上一个时间戳并递增序号；
+节点 ID 区分多个 worker 进程，未配置 MAIL_NODE_ID 时每个进程启动时随机生成。
+"""
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from app.config import MAIL_NODE_ID
+
+_SEQ_MAX = 0xFFFF
+_NODE_ID = (re.sub(r"[^0-9a-z]", "", MAIL_NODE_ID.lower()) or os.urandom(3).hex())[:8]
+
+_lock = threading.Lock()
+_last_us = 0
+_seq = 0
+
+
+def new_message_id() -> str:
+    """生成新的邮件 ID（不含 .txt 后缀）"""
+    global _last_us, _seq
+    with _lock:
+        now_us = time.time_ns() // 1000
+        if now_us > _last_us:
+            _last_us, _seq = now_us, 0
+        elif _seq < _SEQ_MAX:
+            _seq += 1
+        else:
+            _last_us, _seq = _last_us + 1, 0
+        ts_us, seq = _last_us, _seq
+
+    ts = datetime.fromtimestamp(ts_us // 1_000_000).replace(microsecond=ts_us % 1_000_000)
+    return f"{ts.strftime('%Y%m%d_%H%M%S_%f')}_{seq:04x}{_NODE_ID}"
+
+
+def new_mail_filename() -> str:
+    """生成新的邮件文件名"""
+    return f"{new_message_id()}.txt"
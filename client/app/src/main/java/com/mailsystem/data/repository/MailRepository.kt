@@ -465,7 +465,7 @@ class MailRepository(private val userPreferences: UserPreferences) {
             val token = userPreferences.token.first() ?: return Result.failure(Exception("未登录，请先登录"))
             val adminKey = userPreferences.getAdminKeyFirst()
             val response = api.broadcastMail(
-                BroadcastMailRequest(subject, body, "admin@localhost", userIds),
+                BroadcastMailRequest(subject, body, user_ids = userIds),
                 "Bearer $token",
                 adminKey
             )
@@ -0,0 +1,40 @@
+"""
+测试环境：数据库与邮箱目录均为相对路径，导入应用前切换到临时工作目录
+
+应用生命周期（SMTP/POP3 服务、清理任务）不启动，只初始化数据库后直接调用 HTTP 接口与服务。
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+WORK_DIR = Path(tempfile.mkdtemp(prefix="mail-tests-"))
+(WORK_DIR / "data").mkdir()
+shutil.copytree(ROOT / "filters", WORK_DIR / "filters")
+os.chdir(WORK_DIR)
+sys.path.insert(0, str(ROOT))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from app.db import init_db  # noqa: E402
+from app.main import app  # noqa: E402
+
+init_db()
+
+
+@pytest.fixture(scope="session")
+def client():
+    return TestClient(app)
+
+
+@pytest.fixture(scope="session")
+def auth_headers(client):
+    """注册并登录用户，返回带 Bearer 令牌的请求头"""
+    def login(username: str) -> dict:
+        client.post("/auth/register", json={"username": username, "password": "pw"})
+        token = client.post("/auth/login", json={"username": username, "password": "pw"}).json()["token"]
+        return {"Authorization": f"Bearer {token}"}
+    return login
@@ -0,0 +1,34 @@
+"""图片附件缩略图（需要 Pillow）"""
+import io
+import time
+
+import pytest
+
+from app.config import ATTACHMENT_THUMBNAIL_SIZE
+from app.services.mail_storage import MailStorageService
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def test_upload_generates_thumbnail(client, auth_headers):
+    headers = auth_headers("kate")
+    buf = io.BytesIO()
+    Image.new("RGB", (1200, 600), (200, 30, 30)).save(buf, "PNG")
+    r = client.post(
+        "/mail/attachment/upload/preview_mail.txt", files={"file": ("photo.png", buf.getvalue(), "image/png")}, headers=headers
+    )
+    assert r.status_code == 200
+
+    # 缩略图由后台线程生成
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        info = MailStorageService.get_attachment_info("kate", "preview_mail.txt", "photo.png")
+        if info and info.get("preview"):
+            break
+        time.sleep(0.05)
+
+    r = client.get("/mail/attachment/preview_mail.txt/photo.png/preview", headers=headers)
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "image/jpeg"
+    with Image.open(io.BytesIO(r.content)) as thumb:
+        assert max(thumb.size) == ATTACHMENT_THUMBNAIL_SIZE
@@ -0,0 +1,67 @@
+"""附件上传：邮件文件名不能拼接出邮箱目录之外的路径"""
+from pathlib import Path
+
+import pytest
+
+from app.config import MAIL_DOMAIN
+from app.services.mail_storage import MailStorageService
+
+
+@pytest.mark.parametrize("mail_filename", [
+    "../../../../tmp/escaped_dir",
+    "../../bob/attachments/x",
+    "..",
+    ".hidden",
+])
+def test_upload_session_rejects_traversal(client, auth_headers, mail_filename):
+    headers = auth_headers("alice")
+    r = client.post(
+        "/mail/attachment/upload-session",
+        json={"mail_filename": mail_filename, "filename": "a.txt", "size": 3},
+        headers=headers
+    )
+    assert r.status_code == 400
+    assert not Path("/tmp/escaped_dir").exists()
+    assert not Path(MailStorageService.BASE_DIR, "bob", "attachments", "x").exists()
+
+
+def test_attachment_paths_reject_traversal():
+    with pytest.raises(ValueError):
+        MailStorageService.get_attachment_dir("alice", "../bob/attachments/x")
+    with pytest.raises(ValueError):
+        MailStorageService.get_attachment_manifest_path("alice", "..")
+
+
+def test_upload_rejects_other_users_mail(client, auth_headers):
+    auth_headers("alice")
+    bob = auth_headers("bob")
+    sent = client.post(
+        "/mail/send", json={"to_addr": f"alice@{MAIL_DOMAIN}", "subject": "s", "body": "b"}, headers=bob
+    ).json()["data"]["filename"]
+    # 收件人可以给自己邮箱中的邮件上传附件，其他用户不能使用该邮件名
+    carol = auth_headers("carol")
+    r = client.post(
+        "/mail/attachment/upload-session",
+        json={"mail_filename": sent, "filename": "a.txt", "size": 3},
+        headers=carol
+    )
+    assert r.status_code == 404
+
+
+def test_upload_session_to_staging_name(client, auth_headers):
+    headers = auth_headers("alice")
+    r = client.post(
+        "/mail/attachment/upload-session",
+        json={"mail_filename": "20250101_000000_000.txt", "filename": "a.txt", "size": 3},
+        headers=headers
+    )
+    assert r.status_code == 200
+    upload_id = r.json()["upload_id"]
+    client.put(
+        f"/mail/attachment/upload-session/{upload_id}",
+        params={"offset": 0},
+        content=b"abc",
+        headers=headers
+    )
+    assert client.post(f"/mail/attachment/upload-session/{upload_id}/finalize", headers=headers).status_code == 200
+    assert (MailStorageService.get_attachment_dir("alice", "20250101_000000_000.txt") / "a.txt").is_file()
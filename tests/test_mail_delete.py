@@ -0,0 +1,39 @@
+"""软删除：已删除的邮件不能再读取，也不妨碍同名邮件移入该文件夹"""
+from app.config import MAIL_DOMAIN
+from app.services.mail_storage import MailStorageService
+
+
+def _send_to_self(client, headers, username):
+    r = client.post(
+        "/mail/send", json={"to_addr": f"{username}@{MAIL_DOMAIN}", "subject": "self", "body": "hello"}, headers=headers
+    )
+    return r.json()["data"]["filename"]
+
+
+def test_deleted_sent_mail_is_not_readable(client, auth_headers):
+    headers = auth_headers("dave")
+    filename = _send_to_self(client, headers, "dave")
+    assert client.get(f"/mail/sent/read/{filename}", headers=headers).status_code == 200
+
+    r = client.post("/mail/batch/delete", json={"filenames": [filename], "folder": "sent"}, headers=headers)
+    assert r.status_code == 200
+    assert client.get(f"/mail/sent/read/{filename}", headers=headers).status_code == 404
+    assert MailStorageService.read_sent_mail("dave", filename) is None
+
+
+def test_move_over_soft_deleted_mail(client, auth_headers):
+    headers = auth_headers("erin")
+    filename = _send_to_self(client, headers, "erin")
+    client.post("/mail/batch/delete", json={"filenames": [filename], "folder": "sent"}, headers=headers)
+
+    r = client.post(
+        "/mail/batch/move",
+        json={"filenames": [filename], "folder": "inbox", "target_folder": "sent"},
+        headers=headers
+    )
+    assert r.json()["succeeded"] == 1
+    assert MailStorageService.read_sent_mail("erin", filename) is not None
+
+    # 清理任务不能删掉移入的邮件文件
+    MailStorageService.purge_deleted_mails()
+    assert MailStorageService.read_sent_mail("erin", filename) is not None
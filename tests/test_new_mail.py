@@ -0,0 +1,41 @@
+"""新邮件判断：按 mails 表中未删除、未读（无 S 标记）的收件箱邮件"""
+from app.config import MAIL_DOMAIN
+from app.services.mail_backends import MaildirBackend
+
+
+def _deliver(client, sender_headers, username):
+    r = client.post(
+        "/mail/send", json={"to_addr": f"{username}@{MAIL_DOMAIN}", "subject": "hi", "body": "b"}, headers=sender_headers
+    )
+    return r.json()["data"]["filename"]
+
+
+def _has_new(client, headers):
+    return client.get("/mail/new", headers=headers).json()["has_new"]
+
+
+def test_deleted_new_mail_is_not_new(client, auth_headers):
+    headers = auth_headers("frank")
+    filename = _deliver(client, auth_headers("bob"), "frank")
+    assert _has_new(client, headers) is True
+
+    assert client.delete(f"/mail/delete/{filename}", headers=headers).status_code == 200
+    assert _has_new(client, headers) is False
+
+
+def test_flagged_unread_mail_is_new(client, auth_headers):
+    headers = auth_headers("grace")
+    filename = _deliver(client, auth_headers("bob"), "grace")
+
+    client.post(f"/mail/flags/{filename}", json={"add": "F"}, headers=headers)
+    assert _has_new(client, headers) is True
+    client.post(f"/mail/flags/{filename}", json={"add": "S"}, headers=headers)
+    assert _has_new(client, headers) is False
+
+
+def test_maildir_directory_follows_seen_flag(tmp_path):
+    backend = MaildirBackend(str(tmp_path))
+    assert backend.path_for("u", "inbox", "m.txt").parent.name == "new"
+    assert backend.path_for("u", "inbox", "m.txt", "F").parent.name == "new"
+    assert backend.path_for("u", "inbox", "m.txt", "FS").parent.name == "cur"
+    assert backend.path_for("u", "inbox", "m.txt", "F").name == f"m{backend.INFO_SEP}2,F"
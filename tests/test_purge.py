@@ -0,0 +1,54 @@
+"""清理任务：物理删除邮件时一并删除附件目录、附件清单、HTML 正文与缩略图"""
+from app.config import MAIL_DOMAIN
+from app.services.mail_storage import MailStorageService
+
+
+def _send_with_attachment(client, headers, sender, to_username):
+    staging = f"staging_{sender}_{to_username}.txt"
+    client.post(f"/mail/attachment/upload/{staging}", files={"file": ("a.txt", b"attachment", "text/plain")}, headers=headers)
+    r = client.post(
+        "/mail/send",
+        json={"to_addr": f"{to_username}@{MAIL_DOMAIN}", "subject": "att", "body": "b", "mail_filename": staging},
+        headers=headers
+    )
+    return r.json()["data"]["filename"]
+
+
+def _asset_paths(username, filename):
+    return [
+        MailStorageService.get_attachment_dir(username, filename),
+        MailStorageService.get_attachment_manifest_path(username, filename),
+        MailStorageService.get_attachment_preview_dir(username, filename),
+    ]
+
+
+def test_purge_removes_attachment_assets(client, auth_headers):
+    heidi = auth_headers("heidi")
+    filename = _send_with_attachment(client, auth_headers("ivan"), "ivan", "heidi")
+    MailStorageService.get_attachment_preview_dir("heidi", filename).mkdir(parents=True, exist_ok=True)
+    MailStorageService.get_mail_html_path("heidi", filename).write_text("<p>b</p>", encoding="utf-8")
+    assert MailStorageService.get_attachment_dir("heidi", filename).is_dir()
+
+    client.delete(f"/mail/delete/{filename}", headers=heidi)
+    MailStorageService.purge_deleted_mails()
+
+    for path in _asset_paths("heidi", filename) + [MailStorageService.get_mail_html_path("heidi", filename)]:
+        assert not path.exists(), path
+    # 发件人的副本不受影响
+    assert MailStorageService.get_attachment_dir("ivan", filename).is_dir()
+
+
+def test_purge_keeps_assets_shared_with_other_folder(client, auth_headers):
+    judy = auth_headers("judy")
+    filename = _send_with_attachment(client, judy, "judy", "judy")
+
+    client.post("/mail/batch/delete", json={"filenames": [filename], "folder": "sent"}, headers=judy)
+    MailStorageService.purge_deleted_mails()
+    # 收件箱中的同名邮件仍引用附件
+    assert MailStorageService.get_attachment_dir("judy", filename).is_dir()
+    assert MailStorageService.get_attachment_manifest_path("judy", filename).is_file()
+
+    client.delete(f"/mail/delete/{filename}", headers=judy)
+    MailStorageService.purge_deleted_mails()
+    for path in _asset_paths("judy", filename):
+        assert not path.exists(), path